@@ -1,7 +1,7 @@
 import configparser
 import os
 from pathlib import Path
-from typing import Optional
+from typing import List, Optional
 
 from . import settings
 
@@ -19,3 +19,37 @@ if base_path_str := CONFIG["DEFAULT"].get("BASE_PATH", None):
     BASE_PATH = Path(base_path_str + os.sep)
 
 DEFAULT_TAG_COLOR: str = CONFIG["DEFAULT"].get("DEFAULT_TAG_COLOR", "#d9d9d9")
+
+DB_BACKEND: str = CONFIG["DEFAULT"].get("DB_BACKEND", "tinydb")
+
+DB_SQLITE_PATH = Path(settings.BASE_DIR).joinpath("TaggerDB.sqlite3")
+if "DB_SQLITE_PATH" in CONFIG["DEFAULT"]:
+    DB_SQLITE_PATH = Path(CONFIG["DEFAULT"]["DB_SQLITE_PATH"])
+
+# the database is otherwise opened on first use
+DB_WARM_UP_ON_STARTUP: bool = CONFIG["DEFAULT"].getboolean(
+    "DB_WARM_UP_ON_STARTUP", False
+)
+
+DB_STORAGE: str = CONFIG["DEFAULT"].get("DB_STORAGE", "json")
+DB_JOURNAL_COMPACTION_THRESHOLD_KB: int = CONFIG["DEFAULT"].getint(
+    "DB_JOURNAL_COMPACTION_THRESHOLD_KB", 16384
+)
+
+DB_JSON_SERIALIZER: str = CONFIG["DEFAULT"].get("DB_JSON_SERIALIZER", "auto")
+
+DB_SHARD_PREFIXES: List[str] = [
+    prefix.strip()
+    for prefix in CONFIG["DEFAULT"].get("DB_SHARD_PREFIXES", "").split(",")
+    if prefix.strip()
+]
+
+DB_FLUSH_EVERY_N_WRITES: int = CONFIG["DEFAULT"].getint("DB_FLUSH_EVERY_N_WRITES", 1)
+DB_FLUSH_INTERVAL_MS: int = CONFIG["DEFAULT"].getint("DB_FLUSH_INTERVAL_MS", 0)
+DB_GROUP_COMMIT_WINDOW_MS: int = CONFIG["DEFAULT"].getint(
+    "DB_GROUP_COMMIT_WINDOW_MS", 0
+)
+DB_FLUSH_ON_REQUEST_END: bool = CONFIG["DEFAULT"].getboolean(
+    "DB_FLUSH_ON_REQUEST_END", False
+)
+DB_MULTIPROCESS: bool = CONFIG["DEFAULT"].getboolean("DB_MULTIPROCESS", False)
@@ -1,5 +1,26 @@
 from django.apps import AppConfig
+from django.core.signals import request_finished
+
+from Tagger import params
+
+
+def flush_db_on_request_finished(**_):
+    # pylint: disable=import-outside-toplevel
+    from pathtagger import db_backends
+
+    db_backends.get_db_operations().flush_db()
 
 
 class PathtaggerConfig(AppConfig):
     name = "pathtagger"
+
+    def ready(self):
+        if params.DB_WARM_UP_ON_STARTUP:
+            # pylint: disable=import-outside-toplevel
+            from pathtagger import db_backends
+
+            db_backends.get_db_operations().warm_up_db()
+        if params.DB_FLUSH_ON_REQUEST_END:
+            request_finished.connect(
+                flush_db_on_request_finished, dispatch_uid="pathtagger_flush_db"
+            )
@@ -0,0 +1,22 @@
+import importlib
+import logging
+
+from Tagger import params
+
+logger = logging.getLogger(__name__)
+
+DB_OPERATIONS_MODULES = {
+    "tinydb": "pathtagger.db_operations",
+    "sqlite": "pathtagger.sqlite_db_operations",
+}
+
+
+def get_db_operations():
+    if params.DB_BACKEND not in DB_OPERATIONS_MODULES:
+        logger.error(
+            "Unknown DB_BACKEND %r, falling back to 'tinydb' backend",
+            params.DB_BACKEND,
+        )
+        return importlib.import_module(DB_OPERATIONS_MODULES["tinydb"])
+    logger.debug("DB backend: %r", params.DB_BACKEND)
+    return importlib.import_module(DB_OPERATIONS_MODULES[params.DB_BACKEND])
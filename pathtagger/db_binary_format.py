@@ -0,0 +1,436 @@
+import functools
+import gc
+import json
+import struct
+from typing import BinaryIO, Dict, Iterator, List, Tuple
+
+# File layout (all integers little-endian):
+#   magic, version, table count, then per table:
+#     name, field name dictionary, list item dictionary, record shapes,
+#     record count, records section length, records
+#   record: length, doc_id, shape index, string section length, item counts of
+#     all list fields but the last one, NUL-separated string fields, list items
+#     (list item dictionary indexes for string lists, plain values for unsigned
+#     integer lists)
+MAGIC = b"TGDB"
+VERSION = 2
+# version 2 only added TYPE_UINT_LIST, so version 1 files are still readable
+SUPPORTED_VERSIONS = (1, 2)
+
+TYPE_STR = 0
+TYPE_STR_LIST = 1
+TYPE_JSON = 2
+TYPE_UINT_LIST = 3
+LIST_TYPES = (TYPE_STR_LIST, TYPE_UINT_LIST)
+
+STR_SEPARATOR = "\x00"
+
+_HEADER = struct.Struct("<4sB")
+_U32 = struct.Struct("<I")
+_U64 = struct.Struct("<Q")
+_SHAPE_HEADER = struct.Struct("<H")
+_SHAPE_FIELD = struct.Struct("<HB")
+_RECORD_HEADER = struct.Struct("<IIHI")
+
+Shape = Tuple[Tuple[str, int], ...]
+
+
+class BinaryFormatError(ValueError):
+    pass
+
+
+def is_binary_file(path) -> bool:
+    with open(path, "rb") as db_file:
+        return db_file.read(len(MAGIC)) == MAGIC
+
+
+@functools.lru_cache(maxsize=None)
+def _uint_array(count: int) -> struct.Struct:
+    return struct.Struct(f"<{count}I")
+
+
+@functools.lru_cache(maxsize=None)
+def _ushort_array(count: int) -> struct.Struct:
+    return struct.Struct(f"<{count}H")
+
+
+def _value_type(value) -> int:
+    if isinstance(value, str) and STR_SEPARATOR not in value:
+        return TYPE_STR
+    if isinstance(value, list):
+        if all(isinstance(item, str) for item in value):
+            return TYPE_STR_LIST
+        if all(
+            isinstance(item, int)
+            and not isinstance(item, bool)
+            and 0 <= item <= 0xFFFFFFFF
+            for item in value
+        ):
+            return TYPE_UINT_LIST
+    return TYPE_JSON
+
+
+def _pack_str(value: str) -> bytes:
+    encoded = value.encode("utf-8")
+    return _U32.pack(len(encoded)) + encoded
+
+
+def _pack_str_table(values: List[str]) -> bytes:
+    return _U32.pack(len(values)) + b"".join(_pack_str(value) for value in values)
+
+
+def _pack_shape(shape: Shape, key_indexes: Dict[str, int]) -> bytes:
+    return _SHAPE_HEADER.pack(len(shape)) + b"".join(
+        _SHAPE_FIELD.pack(key_indexes[key], value_type) for key, value_type in shape
+    )
+
+
+def _pack_record(
+    doc_id: int,
+    document: dict,
+    shape_index: int,
+    shape: Shape,
+    list_item_indexes: Dict[str, int],
+) -> bytes:
+    strs = []
+    counts = []
+    indexes = []
+    for key, value_type in shape:
+        value = document[key]
+        if value_type == TYPE_STR:
+            strs.append(value)
+        elif value_type == TYPE_JSON:
+            strs.append(json.dumps(value, ensure_ascii=False))
+        elif value_type == TYPE_UINT_LIST:
+            counts.append(len(value))
+            indexes.extend(value)
+        else:
+            counts.append(len(value))
+            indexes.extend(list_item_indexes[item] for item in value)
+    counts = counts[:-1]
+    str_section = STR_SEPARATOR.join(strs).encode("utf-8")
+    body = b"".join(
+        (
+            _ushort_array(len(counts)).pack(*counts),
+            str_section,
+            _uint_array(len(indexes)).pack(*indexes),
+        )
+    )
+    return (
+        _RECORD_HEADER.pack(
+            _RECORD_HEADER.size + len(body), doc_id, shape_index, len(str_section)
+        )
+        + body
+    )
+
+
+def _get_shape(document: dict) -> Shape:
+    return tuple((key, _value_type(value)) for key, value in document.items())
+
+
+class TableWriter:
+    def __init__(self, name: str, base: "TableReader" = None):
+        # extending the dictionaries of a base table keeps its raw records valid
+        self.name = name
+        self.keys: List[str] = list(base.keys) if base else []
+        self.key_indexes = {key: index for index, key in enumerate(self.keys)}
+        self.list_items: List[str] = list(base.list_items) if base else []
+        self.list_item_indexes = {
+            item: index for index, item in enumerate(self.list_items)
+        }
+        self.shapes: List[Shape] = list(base.shapes) if base else []
+        self.shape_indexes = {shape: index for index, shape in enumerate(self.shapes)}
+        self.records: List[bytes] = []
+
+    def add_raw_record(self, record: bytes):
+        self.records.append(record)
+
+    def add_document(self, doc_id, document: dict):
+        shape = _get_shape(document)
+        if (shape_index := self.shape_indexes.get(shape)) is None:
+            for key, _ in shape:
+                if key not in self.key_indexes:
+                    self.key_indexes[key] = len(self.keys)
+                    self.keys.append(key)
+            shape_index = self.shape_indexes[shape] = len(self.shapes)
+            self.shapes.append(shape)
+        for key, value_type in shape:
+            if value_type == TYPE_STR_LIST:
+                for item in document[key]:
+                    if item not in self.list_item_indexes:
+                        self.list_item_indexes[item] = len(self.list_items)
+                        self.list_items.append(item)
+        self.records.append(
+            _pack_record(
+                int(doc_id), document, shape_index, shape, self.list_item_indexes
+            )
+        )
+
+    def pack(self) -> bytes:
+        return b"".join(
+            (
+                _pack_str(self.name),
+                _pack_str_table(self.keys),
+                _pack_str_table(self.list_items),
+                _U32.pack(len(self.shapes)),
+                *(_pack_shape(shape, self.key_indexes) for shape in self.shapes),
+                _U32.pack(len(self.records)),
+                _U64.pack(sum(len(record) for record in self.records)),
+                *self.records,
+            )
+        )
+
+
+def pack_tables(table_writers: List[TableWriter]) -> bytes:
+    return b"".join(
+        (
+            _HEADER.pack(MAGIC, VERSION),
+            _U32.pack(len(table_writers)),
+            *(table_writer.pack() for table_writer in table_writers),
+        )
+    )
+
+
+def dumps(data: Dict[str, Dict[str, dict]]) -> bytes:
+    table_writers = []
+    for name, table in data.items():
+        table_writer = TableWriter(name)
+        for doc_id, document in table.items():
+            table_writer.add_document(doc_id, document)
+        table_writers.append(table_writer)
+    return pack_tables(table_writers)
+
+
+def dump(data: Dict[str, Dict[str, dict]], fp: BinaryIO):
+    fp.write(dumps(data))
+
+
+class RecordDecoder:
+    def __init__(self, list_items: List[str], shape: Shape):
+        str_fields = [field for field in shape if field[1] not in LIST_TYPES]
+        self.str_keys = [
+            key for key, value_type in str_fields if value_type == TYPE_STR
+        ]
+        self.json_keys = [
+            key for key, value_type in str_fields if value_type == TYPE_JSON
+        ]
+        self.str_positions = [
+            position
+            for position, (_, value_type) in enumerate(str_fields)
+            if value_type == TYPE_STR
+        ]
+        self.json_positions = [
+            position
+            for position, (_, value_type) in enumerate(str_fields)
+            if value_type == TYPE_JSON
+        ]
+        self.list_keys = [key for key, value_type in shape if value_type in LIST_TYPES]
+        self.uint_list_flags = [
+            value_type == TYPE_UINT_LIST
+            for _, value_type in shape
+            if value_type in LIST_TYPES
+        ]
+        self.counts_struct = _ushort_array(max(len(self.list_keys) - 1, 0))
+        self.get_list_item = list_items.__getitem__
+        # shapes without JSON fields and with at most one list field are
+        # decoded inline by TableReader.iter_records
+        self.is_simple = not self.json_keys and len(self.list_keys) <= 1
+        self.list_key = self.list_keys[0] if self.list_keys else None
+        self.is_uint_list = bool(self.uint_list_flags) and self.uint_list_flags[0]
+
+    def decode(self, buffer, offset: int, end: int, str_section_length: int) -> dict:
+        counts = self.counts_struct.unpack_from(buffer, offset)
+        offset += self.counts_struct.size
+        document = {}
+        if self.str_keys or self.json_keys:
+            strs = str(buffer[offset : offset + str_section_length], "utf-8").split(
+                STR_SEPARATOR
+            )
+            for key, position in zip(self.str_keys, self.str_positions):
+                document[key] = strs[position]
+            for key, position in zip(self.json_keys, self.json_positions):
+                document[key] = json.loads(strs[position])
+        offset += str_section_length
+        if self.list_keys:
+            count, rest = divmod(end - offset, _U32.size)
+            if rest:
+                raise BinaryFormatError("Corrupted record")
+            indexes = _uint_array(count).unpack_from(buffer, offset)
+            start = 0
+            for key, is_uint_list, count in zip(
+                self.list_keys, self.uint_list_flags, (*counts, count - sum(counts))
+            ):
+                items = indexes[start : start + count]
+                document[key] = (
+                    list(items)
+                    if is_uint_list
+                    else list(map(self.get_list_item, items))
+                )
+                start += count
+        elif offset != end:
+            raise BinaryFormatError("Corrupted record")
+        return document
+
+
+class TableReader:
+    def __init__(self, buffer, offset: int):
+        self.buffer = buffer
+        self.offset = offset
+        self.name = self._read_str()
+        self.keys = self._read_str_table()
+        self.list_items = self._read_str_table()
+        self.shapes = [self._read_shape() for _ in range(self._unpack(_U32)[0])]
+        self.decoders = [RecordDecoder(self.list_items, shape) for shape in self.shapes]
+        (self.record_count,) = self._unpack(_U32)
+        (records_length,) = self._unpack(_U64)
+        self.records_offset = self.offset
+        self.end_offset = self.records_offset + records_length
+        if self.end_offset > len(buffer):
+            raise BinaryFormatError(f"Truncated table {self.name!r}")
+
+    def _unpack(self, struct_: struct.Struct):
+        try:
+            values = struct_.unpack_from(self.buffer, self.offset)
+        except struct.error as exc:
+            raise BinaryFormatError("Truncated table header") from exc
+        self.offset += struct_.size
+        return values
+
+    def _read_str(self) -> str:
+        (length,) = self._unpack(_U32)
+        start = self.offset
+        self.offset += length
+        try:
+            return str(self.buffer[start : self.offset], "utf-8")
+        except UnicodeDecodeError as exc:
+            raise BinaryFormatError("Corrupted table header") from exc
+
+    def _read_str_table(self) -> List[str]:
+        (count,) = self._unpack(_U32)
+        return [self._read_str() for _ in range(count)]
+
+    def _read_shape(self) -> Shape:
+        (field_count,) = self._unpack(_SHAPE_HEADER)
+        try:
+            return tuple(
+                (self.keys[key_index], value_type)
+                for key_index, value_type in (
+                    self._unpack(_SHAPE_FIELD) for _ in range(field_count)
+                )
+            )
+        except IndexError as exc:
+            raise BinaryFormatError("Corrupted record shape") from exc
+
+    def iter_record_offsets(self) -> Iterator[Tuple[int, int]]:
+        buffer = self.buffer
+        unpack_header = _RECORD_HEADER.unpack_from
+        offset = self.records_offset
+        for _ in range(self.record_count):
+            record_length, doc_id, _, _ = unpack_header(buffer, offset)
+            yield doc_id, offset
+            offset += record_length
+
+    def raw_record(self, offset: int) -> bytes:
+        (record_length,) = _U32.unpack_from(self.buffer, offset)
+        return self.buffer[offset : offset + record_length]
+
+    def decode_record(self, offset: int) -> Tuple[int, dict]:
+        try:
+            record_length, doc_id, shape_index, str_section_length = (
+                _RECORD_HEADER.unpack_from(self.buffer, offset)
+            )
+            return doc_id, self.decoders[shape_index].decode(
+                self.buffer,
+                offset + _RECORD_HEADER.size,
+                offset + record_length,
+                str_section_length,
+            )
+        except (IndexError, struct.error, UnicodeDecodeError) as exc:
+            raise BinaryFormatError(f"Corrupted record at offset {offset}") from exc
+
+    def iter_records(self) -> Iterator[Tuple[int, dict]]:
+        # hot path of a cold load, hence the inlining and the local names
+        buffer = self.buffer
+        unpack_header = _RECORD_HEADER.unpack_from
+        header_size = _RECORD_HEADER.size
+        uint_array = _uint_array
+        decoders = self.decoders
+        offset = self.records_offset
+        try:
+            for _ in range(self.record_count):
+                record_length, doc_id, shape_index, str_section_length = unpack_header(
+                    buffer, offset
+                )
+                decoder = decoders[shape_index]
+                start = offset + header_size
+                end = offset + record_length
+                if not decoder.is_simple:
+                    document = decoder.decode(buffer, start, end, str_section_length)
+                else:
+                    str_end = start + str_section_length
+                    document = (
+                        dict(
+                            zip(
+                                decoder.str_keys,
+                                str(buffer[start:str_end], "utf-8").split(
+                                    STR_SEPARATOR
+                                ),
+                            )
+                        )
+                        if decoder.str_keys
+                        else {}
+                    )
+                    if decoder.list_key is not None:
+                        items = uint_array((end - str_end) >> 2).unpack_from(
+                            buffer, str_end
+                        )
+                        document[decoder.list_key] = (
+                            list(items)
+                            if decoder.is_uint_list
+                            else list(map(decoder.get_list_item, items))
+                        )
+                yield doc_id, document
+                offset = end
+        except (IndexError, struct.error, UnicodeDecodeError) as exc:
+            raise BinaryFormatError(f"Corrupted record at offset {offset}") from exc
+        if offset != self.end_offset:
+            raise BinaryFormatError(f"Corrupted table {self.name!r}")
+
+    def read_records(self) -> Dict[str, dict]:
+        return {str(doc_id): document for doc_id, document in self.iter_records()}
+
+
+def iter_tables(buffer) -> Iterator[TableReader]:
+    try:
+        magic, version = _HEADER.unpack_from(buffer, 0)
+        (table_count,) = _U32.unpack_from(buffer, _HEADER.size)
+    except struct.error as exc:
+        raise BinaryFormatError("Not a Tagger binary database") from exc
+    if magic != MAGIC:
+        raise BinaryFormatError("Not a Tagger binary database")
+    if version not in SUPPORTED_VERSIONS:
+        raise BinaryFormatError(f"Unsupported binary database version {version!r}")
+    offset = _HEADER.size + _U32.size
+    for _ in range(table_count):
+        table_reader = TableReader(buffer, offset)
+        yield table_reader
+        offset = table_reader.end_offset
+
+
+def loads(buffer) -> Dict[str, Dict[str, dict]]:
+    # the decoded documents cannot form reference cycles, so skip the cyclic
+    # garbage collector passes that allocating them would otherwise trigger
+    gc_was_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        return {
+            table_reader.name: table_reader.read_records()
+            for table_reader in iter_tables(buffer)
+        }
+    finally:
+        if gc_was_enabled:
+            gc.enable()
+
+
+def load(fp: BinaryIO) -> Dict[str, Dict[str, dict]]:
+    return loads(fp.read())
@@ -0,0 +1,287 @@
+import logging
+from array import array
+from bisect import bisect_left
+from itertools import compress, repeat
+from operator import sub
+from typing import Iterable, Iterator, List
+
+logger = logging.getLogger(__name__)
+
+ARRAY_CONTAINER_MAX_SIZE = 4096
+BITSET_CONTAINER_BYTES = 1 << 13
+# every byte expanded into eight 0/1 bytes, so that bitsets can be decoded with
+# itertools.compress without looping over the bits in Python
+_EXPANDED_BYTES = [
+    bytes((byte >> bit_index) & 1 for bit_index in range(8)) for byte in range(256)
+]
+
+
+def _container_from_sorted(lows: Iterable[int]):
+    lows = array("H", lows)
+    if len(lows) > ARRAY_CONTAINER_MAX_SIZE:
+        bits = bytearray(BITSET_CONTAINER_BYTES)
+        for low in lows:
+            bits[low >> 3] |= 1 << (low & 7)
+        return BitsetContainer(bits, len(lows))
+    return ArrayContainer(lows) if lows else None
+
+
+def _container_from_int(value: int):
+    if not (cardinality := value.bit_count()):
+        return None
+    if cardinality > ARRAY_CONTAINER_MAX_SIZE:
+        return BitsetContainer(
+            bytearray(value.to_bytes(BITSET_CONTAINER_BYTES, "little")), cardinality
+        )
+    lows = array("H")
+    while value:
+        lowest_bit = value & -value
+        lows.append(lowest_bit.bit_length() - 1)
+        value ^= lowest_bit
+    return ArrayContainer(lows)
+
+
+class ArrayContainer:
+    __slots__ = ("lows",)
+
+    def __init__(self, lows: array):
+        self.lows = lows
+
+    def __len__(self):
+        return len(self.lows)
+
+    def __iter__(self) -> Iterator[int]:
+        return iter(self.lows)
+
+    def to_list(self, base: int = 0) -> List[int]:
+        if base:
+            return [base | low for low in self.lows]
+        return self.lows.tolist()
+
+    def __contains__(self, low: int) -> bool:
+        index = bisect_left(self.lows, low)
+        return index < len(self.lows) and self.lows[index] == low
+
+    def to_int(self) -> int:
+        bits = bytearray(BITSET_CONTAINER_BYTES)
+        for low in self.lows:
+            bits[low >> 3] |= 1 << (low & 7)
+        return int.from_bytes(bits, "little")
+
+    def copy(self):
+        return ArrayContainer(array("H", self.lows))
+
+    def add(self, low: int):
+        index = bisect_left(self.lows, low)
+        if index < len(self.lows) and self.lows[index] == low:
+            return self
+        self.lows.insert(index, low)
+        if len(self.lows) > ARRAY_CONTAINER_MAX_SIZE:
+            return _container_from_sorted(self.lows)
+        return self
+
+    def discard(self, low: int):
+        index = bisect_left(self.lows, low)
+        if index < len(self.lows) and self.lows[index] == low:
+            del self.lows[index]
+        return self if self.lows else None
+
+    def intersection(self, other):
+        return _container_from_sorted(low for low in self.lows if low in other)
+
+    def union(self, other):
+        if isinstance(other, BitsetContainer):
+            return other.union(self)
+        return _container_from_sorted(sorted(set(self.lows).union(other.lows)))
+
+    def difference(self, other):
+        return _container_from_sorted(low for low in self.lows if low not in other)
+
+
+class BitsetContainer:
+    __slots__ = ("bits", "cardinality")
+
+    def __init__(self, bits: bytearray, cardinality: int):
+        self.bits = bits
+        self.cardinality = cardinality
+
+    def __len__(self):
+        return self.cardinality
+
+    def __iter__(self) -> Iterator[int]:
+        return iter(self.to_list())
+
+    def to_list(self, base: int = 0) -> List[int]:
+        return list(
+            compress(
+                range(base, base + (BITSET_CONTAINER_BYTES << 3)),
+                b"".join(map(_EXPANDED_BYTES.__getitem__, self.bits)),
+            )
+        )
+
+    def __contains__(self, low: int) -> bool:
+        return bool(self.bits[low >> 3] & (1 << (low & 7)))
+
+    def to_int(self) -> int:
+        return int.from_bytes(self.bits, "little")
+
+    def copy(self):
+        return BitsetContainer(bytearray(self.bits), self.cardinality)
+
+    def add(self, low: int):
+        if low not in self:
+            self.bits[low >> 3] |= 1 << (low & 7)
+            self.cardinality += 1
+        return self
+
+    def discard(self, low: int):
+        if low in self:
+            self.bits[low >> 3] &= ~(1 << (low & 7)) & 0xFF
+            self.cardinality -= 1
+            if self.cardinality <= ARRAY_CONTAINER_MAX_SIZE:
+                return _container_from_sorted(self.to_list())
+        return self
+
+    def intersection(self, other):
+        if isinstance(other, ArrayContainer):
+            return other.intersection(self)
+        return _container_from_int(self.to_int() & other.to_int())
+
+    def union(self, other):
+        return _container_from_int(self.to_int() | other.to_int())
+
+    def difference(self, other):
+        return _container_from_int(self.to_int() & ~other.to_int())
+
+
+# unsigned 32-bit integers are split into containers by their upper 16 bits;
+# sparse containers hold a sorted array, dense ones a fixed size bitset
+# only the subset of the pyroaring.BitMap API used by the tag index is implemented
+class RoaringBitmap:
+    __slots__ = ("_containers",)
+
+    def __init__(self, values: Iterable[int] = ()):
+        self._containers = {}
+        values = sorted(set(values))
+        start = 0
+        while start < len(values):
+            high = values[start] >> 16
+            end = bisect_left(values, (high + 1) << 16, start)
+            lows = values[start:end]
+            self._containers[high] = _container_from_sorted(
+                map(sub, lows, repeat(high << 16)) if high else lows
+            )
+            start = end
+
+    @classmethod
+    def _from_containers(cls, containers):
+        bitmap = cls()
+        bitmap._containers = {
+            high: container for high, container in containers if container is not None
+        }
+        return bitmap
+
+    def __len__(self):
+        return sum(len(container) for container in self._containers.values())
+
+    def __bool__(self):
+        return bool(self._containers)
+
+    def __iter__(self) -> Iterator[int]:
+        for high in sorted(self._containers):
+            yield from self._containers[high].to_list(high << 16)
+
+    def __contains__(self, value) -> bool:
+        if not isinstance(value, int) or value < 0:
+            return False
+        container = self._containers.get(value >> 16)
+        return container is not None and (value & 0xFFFF) in container
+
+    def __eq__(self, other):
+        if not isinstance(other, RoaringBitmap):
+            return NotImplemented
+        return len(self) == len(other) and list(self) == list(other)
+
+    def __repr__(self):
+        return f"{type(self).__name__}({list(self)!r})"
+
+    def copy(self):
+        return self._from_containers(
+            (high, container.copy()) for high, container in self._containers.items()
+        )
+
+    def add(self, value: int):
+        high = value >> 16
+        if (container := self._containers.get(high)) is None:
+            self._containers[high] = ArrayContainer(array("H", (value & 0xFFFF,)))
+        else:
+            self._containers[high] = container.add(value & 0xFFFF)
+
+    def discard(self, value: int):
+        high = value >> 16
+        if (container := self._containers.get(high)) is not None:
+            if (container := container.discard(value & 0xFFFF)) is None:
+                del self._containers[high]
+            else:
+                self._containers[high] = container
+
+    def __and__(self, other):
+        return self._from_containers(
+            (high, container.intersection(other._containers[high]))
+            for high, container in self._containers.items()
+            if high in other._containers
+        )
+
+    def __or__(self, other):
+        containers = {
+            high: container.copy()
+            for high, container in self._containers.items()
+            if high not in other._containers
+        }
+        for high, container in other._containers.items():
+            containers[high] = (
+                container.union(self._containers[high])
+                if high in self._containers
+                else container.copy()
+            )
+        return self._from_containers(containers.items())
+
+    def __sub__(self, other):
+        return self._from_containers(
+            (
+                high,
+                (
+                    container.difference(other._containers[high])
+                    if high in other._containers
+                    else container.copy()
+                ),
+            )
+            for high, container in self._containers.items()
+        )
+
+
+try:
+    from pyroaring import BitMap as Bitmap
+except ImportError:
+    Bitmap = RoaringBitmap
+logger.debug("Using bitmap implementation %r", Bitmap)
+
+
+def union(bitmaps: Iterable) -> Bitmap:
+    result = Bitmap()
+    for bitmap in bitmaps:
+        result = result | bitmap
+    return result
+
+
+def intersection(bitmaps: Iterable) -> Bitmap:
+    bitmaps = sorted(bitmaps, key=len)
+    if not bitmaps:
+        return Bitmap()
+    result = bitmaps[0]
+    for bitmap in bitmaps[1:]:
+        if not result:
+            break
+        result = result & bitmap
+    # never hand out a bitmap owned by the caller
+    return result.copy() if result is bitmaps[0] else result
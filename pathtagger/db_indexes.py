@@ -0,0 +1,510 @@
+import logging
+import threading
+from typing import Dict, Hashable, Iterable, List, Optional, Set, Tuple, Union
+
+from tinydb.database import Document, Table
+from tinydb.utils import LRUCache
+
+from pathtagger import db_bitmaps
+from pathtagger.db_bitmaps import Bitmap
+
+logger = logging.getLogger(__name__)
+
+
+class BitmapIndex:
+    def __init__(self, field: str):
+        self.field = field
+        # doc_ids serve as the dense mapping ordinals
+        self._doc_ids_by_value: Dict[int, Bitmap] = {}
+        self._values_by_doc_id: Dict[int, Tuple[int, ...]] = {}
+
+    def add(self, doc_id: int, document: dict):
+        values = tuple(set(document.get(self.field) or []))
+        self._values_by_doc_id[doc_id] = values
+        for value in values:
+            if (doc_ids := self._doc_ids_by_value.get(value)) is None:
+                doc_ids = self._doc_ids_by_value[value] = Bitmap()
+            doc_ids.add(doc_id)
+
+    def update(self, doc_id: int, document: dict):
+        values = self._values_by_doc_id.get(doc_id)
+        if values is not None and set(values) == set(document.get(self.field) or []):
+            return
+        self.discard(doc_id)
+        self.add(doc_id, document)
+
+    def discard(self, doc_id: int):
+        for value in self._values_by_doc_id.pop(doc_id, ()):
+            doc_ids = self._doc_ids_by_value[value]
+            doc_ids.discard(doc_id)
+            if not doc_ids:
+                del self._doc_ids_by_value[value]
+
+    def clear(self):
+        self._doc_ids_by_value.clear()
+        self._values_by_doc_id.clear()
+
+    @property
+    def doc_ids(self) -> Bitmap:
+        return Bitmap(self._values_by_doc_id)
+
+    def get_doc_ids(self, value: int) -> Bitmap:
+        if (doc_ids := self._doc_ids_by_value.get(value)) is None:
+            return Bitmap()
+        return doc_ids.copy()
+
+    def get_count(self, value: int) -> int:
+        if (doc_ids := self._doc_ids_by_value.get(value)) is None:
+            return 0
+        return len(doc_ids)
+
+    def intersect(self, doc_ids: Bitmap, value: int) -> Bitmap:
+        if (value_doc_ids := self._doc_ids_by_value.get(value)) is None:
+            return Bitmap()
+        return doc_ids & value_doc_ids
+
+    def subtract(self, doc_ids: Bitmap, value: int) -> Bitmap:
+        if (value_doc_ids := self._doc_ids_by_value.get(value)) is None:
+            return doc_ids
+        return doc_ids - value_doc_ids
+
+    def get_doc_ids_with_all(self, values: Iterable[int]) -> Bitmap:
+        if not (values := set(values)):
+            return self.doc_ids
+        if not values.issubset(self._doc_ids_by_value):
+            return Bitmap()
+        return db_bitmaps.intersection(
+            self._doc_ids_by_value[value] for value in values
+        )
+
+    def get_doc_ids_with_none(self) -> Bitmap:
+        return Bitmap(
+            doc_id for doc_id, values in self._values_by_doc_id.items() if not values
+        )
+
+    def get_doc_ids_with_any(self, values: Iterable[int]) -> Bitmap:
+        return db_bitmaps.union(
+            self._doc_ids_by_value[value]
+            for value in set(values)
+            if value in self._doc_ids_by_value
+        )
+
+
+class UniqueIndex:
+    def __init__(self, field: str):
+        self.field = field
+        self._doc_id_by_value: Dict[Hashable, int] = {}
+        self._value_by_doc_id: Dict[int, Hashable] = {}
+
+    def add(self, doc_id: int, document: dict):
+        if (value := document.get(self.field)) is None:
+            return
+        if (indexed_doc_id := self._doc_id_by_value.get(value)) not in (
+            None,
+            doc_id,
+        ):
+            logger.warning(
+                "Duplicate %s %r (doc_ids=%r), indexing only the first one",
+                self.field,
+                value,
+                [indexed_doc_id, doc_id],
+            )
+            return
+        self._doc_id_by_value[value] = doc_id
+        self._value_by_doc_id[doc_id] = value
+
+    def update(self, doc_id: int, document: dict):
+        # e.g. the path of a mapping whose tags changed is not indexed again
+        value = self._value_by_doc_id.get(doc_id)
+        if value is not None and value == document.get(self.field):
+            return
+        self.discard(doc_id)
+        self.add(doc_id, document)
+
+    def discard(self, doc_id: int):
+        if (value := self._value_by_doc_id.pop(doc_id, None)) is not None:
+            del self._doc_id_by_value[value]
+
+    def clear(self):
+        self._doc_id_by_value.clear()
+        self._value_by_doc_id.clear()
+
+    @property
+    def doc_ids(self) -> Set[int]:
+        return set(self._value_by_doc_id)
+
+    def get_doc_id(self, value: Hashable) -> Optional[int]:
+        return self._doc_id_by_value.get(value)
+
+
+def _split_path(db_path_str: str) -> List[str]:
+    return db_path_str.rstrip("/").split("/")
+
+
+def _get_components(db_path_str: str) -> Iterable[str]:
+    # a component repeated within a path is indexed once for it
+    return dict.fromkeys(_split_path(db_path_str.lower()))
+
+
+def _get_trigrams(value: str) -> Set[str]:
+    return {value[index : index + 3] for index in range(len(value) - 2)}
+
+
+# paths share most of their components, so the trigrams of the distinct
+# lowercased components are indexed rather than those of every path
+class PathTrigramIndex:
+    def __init__(self):
+        self._component_ids: Dict[str, int] = {}
+        self._components: List[Optional[str]] = []
+        # most components, e.g. file names, belong to a single document, whose
+        # doc_id is kept instead of a set
+        self._doc_ids_by_component_id: List[Union[None, int, Set[int]]] = []
+        self._component_ids_by_trigram: Dict[str, Bitmap] = {}
+        self._doc_count = 0
+
+    @classmethod
+    def build(cls, values_by_doc_id: Dict[int, str]):
+        index = cls()
+        for doc_id, value in values_by_doc_id.items():
+            for component in _get_components(value):
+                if (component_id := index._component_ids.get(component)) is None:
+                    index._component_ids[component] = len(index._components)
+                    index._components.append(component)
+                    index._doc_ids_by_component_id.append(doc_id)
+                else:
+                    index._add_doc_id(component_id, doc_id)
+        component_ids_by_trigram = {}
+        for component_id, component in enumerate(index._components):
+            for trigram in _get_trigrams(component):
+                if (component_ids := component_ids_by_trigram.get(trigram)) is None:
+                    component_ids_by_trigram[trigram] = [component_id]
+                else:
+                    component_ids.append(component_id)
+        index._component_ids_by_trigram = {
+            trigram: Bitmap(component_ids)
+            for trigram, component_ids in component_ids_by_trigram.items()
+        }
+        index._doc_count = len(values_by_doc_id)
+        return index
+
+    def _add_doc_id(self, component_id: int, doc_id: int):
+        doc_ids = self._doc_ids_by_component_id[component_id]
+        if isinstance(doc_ids, int):
+            self._doc_ids_by_component_id[component_id] = {doc_ids, doc_id}
+        else:
+            doc_ids.add(doc_id)
+
+    def add(self, doc_id: int, value: str):
+        for component in _get_components(value):
+            if (component_id := self._component_ids.get(component)) is not None:
+                self._add_doc_id(component_id, doc_id)
+                continue
+            component_id = self._component_ids[component] = len(self._components)
+            self._components.append(component)
+            self._doc_ids_by_component_id.append(doc_id)
+            for trigram in _get_trigrams(component):
+                if trigram not in self._component_ids_by_trigram:
+                    self._component_ids_by_trigram[trigram] = Bitmap()
+                self._component_ids_by_trigram[trigram].add(component_id)
+        self._doc_count += 1
+
+    def discard(self, doc_id: int, value: str):
+        for component in _get_components(value):
+            component_id = self._component_ids[component]
+            doc_ids = self._doc_ids_by_component_id[component_id]
+            if not isinstance(doc_ids, int):
+                doc_ids.discard(doc_id)
+                if doc_ids:
+                    continue
+            # ids of removed components are not reused
+            del self._component_ids[component]
+            self._components[component_id] = None
+            self._doc_ids_by_component_id[component_id] = None
+            for trigram in _get_trigrams(component):
+                component_ids = self._component_ids_by_trigram[trigram]
+                component_ids.discard(component_id)
+                if not component_ids:
+                    del self._component_ids_by_trigram[trigram]
+        self._doc_count -= 1
+
+    def get_candidate_doc_ids(self, value: str) -> Optional[Bitmap]:
+        # a match contains the longest part between slashes within one component
+        if not (probe := max(value.lower().split("/"), key=len)):
+            return None
+        if trigrams := _get_trigrams(probe):
+            component_ids = db_bitmaps.intersection(
+                self._component_ids_by_trigram.get(trigram, Bitmap())
+                for trigram in trigrams
+            )
+        else:
+            component_ids = range(len(self._components))
+        doc_ids = []
+        for component_id in component_ids:
+            if probe not in (self._components[component_id] or ""):
+                continue
+            if isinstance(
+                component_doc_ids := self._doc_ids_by_component_id[component_id], int
+            ):
+                doc_ids.append(component_doc_ids)
+            else:
+                doc_ids.extend(component_doc_ids)
+            # checking every path is cheaper than collecting most of them
+            if len(doc_ids) > self._doc_count // 4:
+                return None
+        return Bitmap(doc_ids)
+
+
+def _update_doc_ids(doc_ids: Set[int], node_doc_ids: Union[int, Set[int]]):
+    if isinstance(node_doc_ids, int):
+        doc_ids.add(node_doc_ids)
+    else:
+        doc_ids.update(node_doc_ids)
+
+
+class PathIndex(UniqueIndex):
+    def __init__(self, field: str):
+        super().__init__(field)
+        # trie of path components; the doc_id of a node's path is kept under None,
+        # or a set of them if paths differing in a trailing slash share the node
+        self._trie: Dict[Optional[str], dict] = {}
+        # built on the first substring search
+        self._trigram_index: Optional[PathTrigramIndex] = None
+        self._trigram_index_lock = threading.Lock()
+
+    def add(self, doc_id: int, document: dict):
+        super().add(doc_id, document)
+        if (value := self._value_by_doc_id.get(doc_id)) is None:
+            return
+        node = self._trie
+        for component in _split_path(value):
+            node = node.setdefault(component, {})
+        if (doc_ids := node.get(None)) is None:
+            node[None] = doc_id
+        elif isinstance(doc_ids, int):
+            node[None] = {doc_ids, doc_id}
+        else:
+            doc_ids.add(doc_id)
+        if self._trigram_index is not None:
+            self._trigram_index.add(doc_id, value)
+
+    def discard(self, doc_id: int):
+        if (value := self._value_by_doc_id.get(doc_id)) is not None:
+            nodes = [self._trie]
+            components = _split_path(value)
+            for component in components:
+                nodes.append(nodes[-1][component])
+            doc_ids = nodes[-1][None]
+            if isinstance(doc_ids, int):
+                del nodes[-1][None]
+            else:
+                doc_ids.discard(doc_id)
+                if len(doc_ids) == 1:
+                    nodes[-1][None] = doc_ids.pop()
+            # prune the nodes left without documents and children
+            for component, node in zip(reversed(components), reversed(nodes[:-1])):
+                if node[component]:
+                    break
+                del node[component]
+            if self._trigram_index is not None:
+                self._trigram_index.discard(doc_id, value)
+        super().discard(doc_id)
+
+    def clear(self):
+        super().clear()
+        self._trie.clear()
+        self._trigram_index = None
+
+    def get_candidate_doc_ids_like(self, value: str) -> Optional[Bitmap]:
+        if self._trigram_index is None:
+            # concurrent readers wait for a single build
+            with self._trigram_index_lock:
+                if self._trigram_index is None:
+                    self._trigram_index = PathTrigramIndex.build(self._value_by_doc_id)
+                    logger.debug("Built trigram index for %r", self.field)
+        return self._trigram_index.get_candidate_doc_ids(value)
+
+    def get_doc_ids_under(self, value: str, recursive: bool = True) -> Set[int]:
+        node = self._trie
+        for component in _split_path(value):
+            if (node := node.get(component)) is None:
+                return set()
+        doc_ids = set()
+        if not recursive:
+            for component, child in node.items():
+                if component is not None and None in child:
+                    _update_doc_ids(doc_ids, child[None])
+            return doc_ids
+        nodes = [child for component, child in node.items() if component is not None]
+        while nodes:
+            for component, child in nodes.pop().items():
+                if component is None:
+                    _update_doc_ids(doc_ids, child)
+                else:
+                    nodes.append(child)
+        return doc_ids
+
+
+TABLE_INDEXES = {
+    "_default": (("tag_ids", BitmapIndex), ("path", PathIndex)),
+    "favorite_paths": (("path", UniqueIndex),),
+    "tags": (("name", UniqueIndex),),
+}
+
+
+class IndexedTable(Table):
+    def __init__(self, storage, name, cache_size=10):
+        # indexes are built on first use, so that loading the table does not
+        # have to read every document
+        self._indexes = None
+        self._indexes_lock = threading.Lock()
+        if (get_last_doc_id := getattr(storage, "get_last_doc_id", None)) is None:
+            super().__init__(storage, name, cache_size=cache_size)
+            return
+        # unlike Table, finds the last doc id without reading every document
+        self._storage = storage
+        self._name = name
+        self._query_cache = LRUCache(capacity=cache_size)
+        self._last_id = get_last_doc_id()
+
+    def _get_indexes(self) -> Dict[str, Union[BitmapIndex, UniqueIndex]]:
+        if self._indexes is None:
+            # concurrent readers must not see the indexes before they are built
+            with self._indexes_lock:
+                if self._indexes is None:
+                    indexes = {
+                        field: index_cls(field)
+                        for field, index_cls in TABLE_INDEXES.get(self.name, ())
+                    }
+                    for doc_id, document in self._read().items():
+                        for index in indexes.values():
+                            index.add(doc_id, document)
+                    self._indexes = indexes
+                    logger.debug(
+                        "Built indexes %r for table %r", list(indexes), self.name
+                    )
+        return self._indexes
+
+    def _index_document(self, doc_id: int, document: dict):
+        for index in (self._indexes or {}).values():
+            index.add(doc_id, document)
+
+    def _unindex_document(self, doc_id: int):
+        for index in (self._indexes or {}).values():
+            index.discard(doc_id)
+
+    def _reindex_document(self, doc_id: int, document: dict):
+        for index in (self._indexes or {}).values():
+            index.update(doc_id, document)
+
+    def index(self, field: str):
+        return self._get_indexes()[field]
+
+    def all(self):
+        return list(self._read().values())
+
+    def __iter__(self):
+        yield from self._read().values()
+
+    def get_doc_ids(self) -> Set[int]:
+        if (get_doc_ids := getattr(self._storage, "get_doc_ids", None)) is not None:
+            return get_doc_ids()
+        return set(self._read())
+
+    def __len__(self):
+        # counts the stored records without building a document of each
+        if (count := getattr(self._storage, "count", None)) is not None:
+            return count()
+        return super().__len__()
+
+    def get(self, cond=None, doc_id=None, eid=None):
+        # reading the table would build a document of each record
+        if (
+            doc_id is None
+            or (get_documents := getattr(self._storage, "get_documents", None)) is None
+        ):
+            return super().get(cond, doc_id, eid)
+        return get_documents([doc_id]).get(doc_id)
+
+    def get_multiple(self, doc_ids: Iterable[int]) -> List[Document]:
+        if (get_documents := getattr(self._storage, "get_documents", None)) is None:
+            data = self._read()
+            return [data[doc_id] for doc_id in sorted(doc_ids) if doc_id in data]
+        documents = get_documents(doc_ids)
+        return [documents[doc_id] for doc_id in sorted(documents)]
+
+    def process_elements(self, func, cond=None, doc_ids=None, eids=None):
+        if not self._indexes:
+            return super().process_elements(func, cond, doc_ids, eids)
+
+        def indexed_func(data, doc_id):
+            func(data, doc_id)
+            if doc_id in data:
+                self._reindex_document(doc_id, data[doc_id])
+            else:
+                self._unindex_document(doc_id)
+
+        return super().process_elements(indexed_func, cond, doc_ids, eids)
+
+    def insert(self, document):
+        doc_id = super().insert(document)
+        self._index_document(doc_id, document)
+        return doc_id
+
+    def insert_multiple(self, documents):
+        documents = list(documents)
+        doc_ids = super().insert_multiple(documents)
+        for doc_id, document in zip(doc_ids, documents):
+            self._index_document(doc_id, document)
+        return doc_ids
+
+    def write_back(self, documents, doc_ids=None, eids=None):
+        indexed_doc_ids = doc_ids if doc_ids is not None else eids
+        if indexed_doc_ids is None:
+            indexed_doc_ids = [document.doc_id for document in documents]
+        indexed_documents = list(zip(indexed_doc_ids, documents))
+        written_doc_ids = super().write_back(documents, doc_ids, eids)
+        for doc_id, document in indexed_documents:
+            self._reindex_document(doc_id, document)
+        return written_doc_ids
+
+    def write_batch(
+        self,
+        documents: Dict[int, dict],
+        removed_doc_ids: Iterable[int],
+        new_documents: Iterable[dict],
+    ) -> List[int]:
+        data = self._read()
+        removed_doc_ids = [doc_id for doc_id in removed_doc_ids if doc_id in data]
+        for doc_id in removed_doc_ids:
+            del data[doc_id]
+        for doc_id, document in documents.items():
+            data[doc_id] = dict(document)
+        new_documents = {self._get_next_id(): document for document in new_documents}
+        for doc_id, document in new_documents.items():
+            data[doc_id] = dict(document)
+        self._write(data)
+        for doc_id in removed_doc_ids:
+            self._unindex_document(doc_id)
+        for doc_id, document in {**documents, **new_documents}.items():
+            self._reindex_document(doc_id, document)
+        return list(new_documents)
+
+    def purge(self):
+        super().purge()
+        for index in (self._indexes or {}).values():
+            index.clear()
+
+    def reload(self, doc_ids: Optional[Iterable[int]] = None):
+        # updates the indexes for the documents changed by another process, or
+        # rebuilds them on next use if it is unknown which ones did
+        self.clear_cache()
+        data = self._read()
+        if doc_ids is None:
+            self._indexes = None
+            self._init_last_id(data)
+            return
+        for doc_id in doc_ids:
+            self._unindex_document(doc_id)
+            if doc_id in data:
+                self._index_document(doc_id, data[doc_id])
+            self._last_id = max(self._last_id, doc_id)
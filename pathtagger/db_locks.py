@@ -0,0 +1,149 @@
+import contextlib
+import logging
+import os
+import threading
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+
+class ReadWriteLock:
+    def __init__(self):
+        self._condition = threading.Condition(threading.Lock())
+        self._readers_count = 0
+        self._waiting_writers_count = 0
+        self._writer = None
+        self._write_depth = 0
+        # nested acquisitions by the same thread never wait, so that locked
+        # functions may call each other
+        self._local = threading.local()
+
+    def _get_read_depth(self) -> int:
+        return getattr(self._local, "read_depth", 0)
+
+    def acquire_read(self):
+        read_depth = self._get_read_depth()
+        if read_depth or self._writer == threading.get_ident():
+            self._local.read_depth = read_depth + 1
+            return
+        with self._condition:
+            # waiting writers go first, so that a stream of readers cannot
+            # starve them
+            while self._writer is not None or self._waiting_writers_count:
+                self._condition.wait()
+            self._readers_count += 1
+        self._local.read_depth = 1
+
+    def release_read(self):
+        if not (read_depth := self._get_read_depth()):
+            raise RuntimeError("Cannot release an unacquired read lock")
+        self._local.read_depth = read_depth - 1
+        if read_depth > 1 or self._writer == threading.get_ident():
+            return
+        with self._condition:
+            self._readers_count -= 1
+            if not self._readers_count:
+                self._condition.notify_all()
+
+    def acquire_write(self):
+        if self._writer == threading.get_ident():
+            self._write_depth += 1
+            return
+        if self._get_read_depth():
+            raise RuntimeError("Cannot upgrade a read lock to a write lock")
+        with self._condition:
+            self._waiting_writers_count += 1
+            try:
+                while self._writer is not None or self._readers_count:
+                    self._condition.wait()
+            finally:
+                self._waiting_writers_count -= 1
+            self._writer = threading.get_ident()
+            self._write_depth = 1
+
+    def release_write(self):
+        if self._writer != threading.get_ident():
+            raise RuntimeError("Cannot release an unacquired write lock")
+        self._write_depth -= 1
+        if self._write_depth:
+            return
+        with self._condition:
+            self._writer = None
+            self._condition.notify_all()
+
+    def is_held(self) -> bool:
+        return bool(self._get_read_depth()) or self._writer == threading.get_ident()
+
+    @contextlib.contextmanager
+    def read_locked(self):
+        self.acquire_read()
+        try:
+            yield
+        finally:
+            self.release_read()
+
+    @contextlib.contextmanager
+    def write_locked(self):
+        self.acquire_write()
+        try:
+            yield
+        finally:
+            self.release_write()
+
+
+class FileLock:
+    GENERATION_SIZE = 20
+
+    def __init__(self, path: str):
+        # the file holds a counter of the changes made to the database, so that
+        # processes can tell whether their copy is stale without reading it
+        self.path = path
+        self.synced_generation: Optional[int] = None
+        self._fd: Optional[int] = None
+        self._pid: Optional[int] = None
+        self._depth = 0
+
+    def _get_fd(self) -> int:
+        # flock() locks belong to the open file description, which a forked
+        # process would otherwise share with its parent
+        if self._pid != os.getpid():
+            if self._fd is not None:
+                os.close(self._fd)
+            self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+            self._pid = os.getpid()
+            self._depth = 0
+        return self._fd
+
+    def get_generation(self) -> int:
+        return int(os.pread(self._get_fd(), self.GENERATION_SIZE, 0) or 0)
+
+    def increment_generation(self) -> int:
+        generation = self.get_generation() + 1
+        os.pwrite(self._get_fd(), b"%020d" % generation, 0)
+        return generation
+
+    def acquire(self):
+        fd = self._get_fd()
+        if not self._depth and fcntl is not None:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+        self._depth += 1
+
+    def release(self):
+        if not self._depth:
+            raise RuntimeError("Cannot release an unacquired file lock")
+        self._depth -= 1
+        if not self._depth and fcntl is not None:
+            fcntl.flock(self._get_fd(), fcntl.LOCK_UN)
+
+    @contextlib.contextmanager
+    def locked(self):
+        self.acquire()
+        try:
+            yield
+        finally:
+            self.release()
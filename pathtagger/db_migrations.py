@@ -0,0 +1,63 @@
+import logging
+
+from tinydb import TinyDB
+
+logger = logging.getLogger(__name__)
+
+META_TABLE_NAME = "meta"
+# databases created before schema versioning have no meta table
+INITIAL_SCHEMA_VERSION = 1
+
+
+def _migrate_tag_ids_to_int(db: TinyDB):
+    # mapping tag ids used to be stored as strings
+    mappings = {
+        mapping.doc_id: {
+            **mapping,
+            "tag_ids": sorted(int(tag_id) for tag_id in mapping.get("tag_ids", [])),
+        }
+        for mapping in db.table("_default")
+        if any(isinstance(tag_id, str) for tag_id in mapping.get("tag_ids", []))
+    }
+    logger.info("Converting tag ids of %d mappings to integers...", len(mappings))
+    db.table("_default").write_batch(mappings, [], [])
+
+
+MIGRATIONS = {2: _migrate_tag_ids_to_int}
+SCHEMA_VERSION = max(MIGRATIONS)
+
+
+def get_schema_version(db: TinyDB) -> int:
+    if meta := next(iter(db.table(META_TABLE_NAME)), None):
+        return meta.get("schema_version", INITIAL_SCHEMA_VERSION)
+    return INITIAL_SCHEMA_VERSION
+
+
+def _set_schema_version(db: TinyDB, schema_version: int):
+    meta_table = db.table(META_TABLE_NAME)
+    if meta := next(iter(meta_table), None):
+        meta_table.update({"schema_version": schema_version}, doc_ids=[meta.doc_id])
+    else:
+        meta_table.insert({"schema_version": schema_version})
+
+
+def migrate_db(db: TinyDB):
+    schema_version = get_schema_version(db)
+    if schema_version > SCHEMA_VERSION:
+        logger.error(
+            "Database schema version %d is newer than the supported version %d",
+            schema_version,
+            SCHEMA_VERSION,
+        )
+        return
+    if schema_version == SCHEMA_VERSION:
+        logger.debug("Database schema version: %d", schema_version)
+        return
+    for target_schema_version in range(schema_version + 1, SCHEMA_VERSION + 1):
+        logger.info(
+            "Migrating database schema from version %d to version %d...",
+            target_schema_version - 1,
+            target_schema_version,
+        )
+        MIGRATIONS[target_schema_version](db)
+        _set_schema_version(db, target_schema_version)
@@ -1,65 +1,317 @@
+import atexit
+import contextlib
+import contextvars
+import functools
+import itertools
 import logging
-import re
-from collections import namedtuple
-from typing import List, NamedTuple, Optional, Set, Union
+import threading
+from typing import Dict, Iterable, Iterator, List, Optional, Set, Union
 
-from tinydb import Query, TinyDB, where
+from tinydb import TinyDB
+from tinydb.database import Document
 
+from pathtagger import db_binary_format, db_locks, db_query
+from pathtagger.db_bitmaps import Bitmap
+from pathtagger.db_indexes import TABLE_INDEXES, IndexedTable
+from pathtagger.db_locks import FileLock, ReadWriteLock
+from pathtagger.db_migrations import migrate_db
+from pathtagger.db_serializers import get_serializer
+from pathtagger.db_snapshots import Snapshot
+from pathtagger.db_storages import (
+    BinaryStorage,
+    JournalStorage,
+    JSONFileStorage,
+    LazyStorageProxy,
+    MmapStorage,
+    ShardedStorage,
+    WriteBehindCachingMiddleware,
+)
+from pathtagger.db_utils import (
+    MappingsBatch,
+    classify_doc_ids,
+    get_shard_name,
+    get_valid_page,
+    is_valid_hex_color,
+)
 from Tagger import params
 
 logger = logging.getLogger(__name__)
 
+# all threads share DB, so that reads may run in parallel, but not during a write;
+# with DB_MULTIPROCESS, writes also lock the database file for other processes
+DB_LOCK = ReadWriteLock()
 
-def load_db(path):
-    return TinyDB(
-        path,
-        sort_keys=True,
-        indent=4,
-        separators=(",", ": "),
-        encoding="utf-8",
-        ensure_ascii=False,
+# below this many mappings, paths are checked without the trigram index
+PATH_INDEX_MIN_MAPPING_COUNT = 2000
+
+# opened on first use, or on startup by warm_up_db()
+DB: Optional[TinyDB] = None
+_DB_OPEN_LOCK = threading.Lock()
+
+# the snapshot read by the current context within snapshot()
+_PINNED_SNAPSHOT: contextvars.ContextVar = contextvars.ContextVar(
+    "pinned_snapshot", default=None
+)
+
+
+def _get_storage_cls(storage: Optional[str] = None):
+    storage = params.DB_STORAGE if storage is None else storage
+    storage_classes = {
+        "json": JSONFileStorage,
+        "journal": functools.partial(
+            JournalStorage,
+            compaction_threshold=params.DB_JOURNAL_COMPACTION_THRESHOLD_KB * 1024,
+            compact_in_background=not params.DB_MULTIPROCESS,
+        ),
+        "binary": BinaryStorage,
+        "mmap": MmapStorage,
+    }
+    if storage not in storage_classes:
+        logger.error("Unknown DB_STORAGE %r, falling back to 'json' storage", storage)
+        storage_cls = JSONFileStorage
+    else:
+        logger.debug("DB storage: %r", storage)
+        storage_cls = storage_classes[storage]
+    if not params.DB_SHARD_PREFIXES:
+        return storage_cls
+    if storage_cls is MmapStorage:
+        # the documents of a memory-mapped table cannot be split without decoding
+        logger.error("DB_SHARD_PREFIXES is not supported by 'mmap' storage")
+        return storage_cls
+    logger.debug("DB shard prefixes: %r", params.DB_SHARD_PREFIXES)
+    return functools.partial(
+        ShardedStorage,
+        storage_cls=storage_cls,
+        get_shard_name=functools.partial(
+            get_shard_name, shard_prefixes=params.DB_SHARD_PREFIXES
+        ),
     )
 
 
-def _classify_doc_ids(doc_ids: List[int], reference_doc_ids: Set[int]) -> NamedTuple:
-    DocIdClassification = namedtuple(
-        "DocIdClassification", "invalid_doc_ids nonexistent_doc_ids existing_doc_ids"
+def load_db(path):
+    file_lock = None
+    if params.DB_MULTIPROCESS:
+        if db_locks.fcntl is None:
+            logger.error("DB_MULTIPROCESS is not supported on this platform")
+        file_lock = FileLock(str(path) + ".lock")
+    with file_lock.locked() if file_lock else contextlib.nullcontext():
+        db = TinyDB(
+            path,
+            storage=WriteBehindCachingMiddleware(
+                _get_storage_cls(),
+                flush_every_n_writes=params.DB_FLUSH_EVERY_N_WRITES,
+                flush_interval_ms=params.DB_FLUSH_INTERVAL_MS,
+                file_lock=file_lock,
+                group_commit_window_ms=params.DB_GROUP_COMMIT_WINDOW_MS,
+            ),
+            serializer=get_serializer(params.DB_JSON_SERIALIZER),
+            table_class=IndexedTable,
+            storage_proxy_class=LazyStorageProxy,
+        )
+        migrate_db(db)
+        if file_lock is not None:
+            file_lock.synced_generation = file_lock.get_generation()
+            db.storage.flush()
+    return db
+
+
+def _open_db() -> TinyDB:
+    global DB  # pylint: disable=global-statement
+    if DB is None:
+        with _DB_OPEN_LOCK:
+            if DB is None:
+                db = load_db(params.DB_PATH)
+                # the table sizes are known without building their documents
+                logger.info(
+                    "Loaded database at %r. "
+                    "Found %d tags, %d mappings, and %d favorites.",
+                    params.DB_PATH,
+                    len(db.table("tags")),
+                    len(db.table()),
+                    len(db.table("favorite_paths")),
+                )
+                DB = db
+    return DB
+
+
+def _reload_db():
+    if not DB.storage.is_stale:
+        return
+    with DB.storage.file_lock.locked():
+        changed_doc_ids = DB.storage.reload()
+        logger.debug("Reloaded database changed by another process")
+        for table_name in DB.tables() | set(changed_doc_ids or ()):
+            DB.table(table_name).reload(
+                None
+                if changed_doc_ids is None
+                else map(int, changed_doc_ids.get(table_name, ()))
+            )
+
+
+def _read_locked(func):
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        _open_db()
+        # nested calls run with the database already in sync
+        if not DB_LOCK.is_held() and DB.storage.is_stale:
+            with DB_LOCK.write_locked():
+                _reload_db()
+        with DB_LOCK.read_locked():
+            return func(*args, **kwargs)
+
+    return wrapper
+
+
+@contextlib.contextmanager
+def _unpinned():
+    # writes always read the live data, even within snapshot()
+    pinned_snapshot_token = _PINNED_SNAPSHOT.set(None)
+    try:
+        yield
+    finally:
+        _PINNED_SNAPSHOT.reset(pinned_snapshot_token)
+
+
+def _write_locked(func):
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        _open_db()
+        # nested calls are committed along with the outermost one
+        is_nested = DB_LOCK.is_held()
+        with _unpinned(), DB_LOCK.write_locked():
+            if (file_lock := DB.storage.file_lock) is not None:
+                with file_lock.locked():
+                    _reload_db()
+                    try:
+                        return func(*args, **kwargs)
+                    finally:
+                        # other processes only see the flushed changes
+                        DB.storage.flush()
+            result = func(*args, **kwargs)
+            version = DB.storage.version
+        if DB.storage.group_commit_window_ms and not is_nested:
+            # the changes are on disk once the call returns
+            DB.storage.wait_for_commit(version, flush_db)
+        return result
+
+    return wrapper
+
+
+def _table(name: str = "_default"):
+    if (snapshot := _PINNED_SNAPSHOT.get()) is None:
+        return DB.table(name)
+    # until the next write, the live indexes also hold for the snapshot
+    return snapshot.table(
+        name, DB.table(name) if DB.storage.is_current(snapshot) else None
     )
-    if not (doc_ids and reference_doc_ids):
-        return DocIdClassification(set(), set(), set())
-    invalid_doc_ids = {doc_id for doc_id in doc_ids if not doc_id}
-    valid_doc_ids = set(doc_ids) - invalid_doc_ids
-    return DocIdClassification(
-        invalid_doc_ids,
-        valid_doc_ids - reference_doc_ids,
-        valid_doc_ids.intersection(reference_doc_ids),
+
+
+@_read_locked
+def get_snapshot() -> Snapshot:
+    current_snapshot = DB.storage.get_snapshot()
+    logger.debug("Returning snapshot (version=%d)...", current_snapshot.version)
+    return current_snapshot
+
+
+@contextlib.contextmanager
+def snapshot():
+    # the reads within see the database as it was on entry, no matter what is
+    # written meanwhile, including by the writes within
+    if _PINNED_SNAPSHOT.get() is not None:
+        yield
+        return
+    pinned_snapshot_token = _PINNED_SNAPSHOT.set(get_snapshot())
+    try:
+        yield
+    finally:
+        _PINNED_SNAPSHOT.reset(pinned_snapshot_token)
+
+
+def flush_db():
+    # a database not opened yet has nothing to flush
+    if DB is not None:
+        _flush_db()
+
+
+@_read_locked
+def _flush_db():
+    if DB.storage.is_dirty:
+        logger.debug("Flushing database...")
+        DB.storage.flush()
+
+
+@_read_locked
+def warm_up_db():
+    # builds the indexes up front, so that the first requests do not wait for them
+    for table_name, table_indexes in TABLE_INDEXES.items():
+        for field, _ in table_indexes:
+            DB.table(table_name).index(field)
+    logger.debug("Warmed up database")
+
+
+@_read_locked
+def get_db_data() -> Dict[str, Dict[str, dict]]:
+    # all tables with their documents by doc id string, as in the database file
+    return {
+        table_name: {
+            str(document.doc_id): dict(document) for document in _table(table_name)
+        }
+        for table_name in sorted(DB.tables())
+    }
+
+
+def read_db_data(path) -> Dict[str, Dict[str, dict]]:
+    # reads a database as stored, i.e. with its journal or shards, but without
+    # migrating it, e.g. to copy it into another database
+    flush_db()
+    storage = params.DB_STORAGE
+    if (is_binary := db_binary_format.is_binary_file(path)) != (
+        storage in ("binary", "mmap")
+    ):
+        storage = "binary" if is_binary else "json"
+    db_storage = _get_storage_cls(storage)(
+        path, serializer=get_serializer(params.DB_JSON_SERIALIZER)
     )
+    try:
+        return {
+            table_name: {
+                str(doc_id): dict(document) for doc_id, document in table.items()
+            }
+            for table_name, table in sorted((db_storage.read() or {}).items())
+        }
+    finally:
+        db_storage.close()
 
 
+@_read_locked
 def get_all_favorites():
-    favorites = DB.table("favorite_paths").all()
+    favorites = _table("favorite_paths").all()
     logger.debug("Returning %d favorites...", len(favorites))
     return favorites
 
 
+@_read_locked
 def get_favorite(db_path_str: str):
     if not db_path_str:
         logger.warning("Invalid argument for parameter 'db_path_str': %r", db_path_str)
         return None
     logger.debug("DB path string: %r", db_path_str)
-    if favorite := DB.table("favorite_paths").get(where("path") == db_path_str):
+    favorites = _table("favorite_paths")
+    favorite_id = favorites.index("path").get_doc_id(db_path_str)
+    if favorite := favorites.get(doc_id=favorite_id) if favorite_id else None:
         logger.debug("Returning favorite (doc_id=%d)...", favorite.doc_id)
     else:
         logger.debug("Returning favorite %r...", favorite)
     return favorite
 
 
+@_write_locked
 def insert_favorite(db_path_str: str):
     if not db_path_str:
         logger.warning("Invalid argument for parameter 'db_path_str': %r", db_path_str)
         return None
     logger.debug("DB path string: %r", db_path_str)
-    if get_favorite(db_path_str):
+    if DB.table("favorite_paths").index("path").get_doc_id(db_path_str):
         logger.info("Favorite (path=%r) already exists", db_path_str)
         return None
     if inserted_favorite_id := DB.table("favorite_paths").insert({"path": db_path_str}):
@@ -69,23 +321,27 @@ def insert_favorite(db_path_str: str):
     return inserted_favorite_id
 
 
+@_write_locked
 def delete_favorite(db_path_str: str):
     if not db_path_str:
         logger.warning("Invalid argument for parameter 'db_path_str': %r", db_path_str)
     logger.debug("DB path string: %r", db_path_str)
-    if not get_favorite(db_path_str):
-        logger.warning("No favorite (path=%r) found")
+    favorites = DB.table("favorite_paths")
+    if not (favorite_id := favorites.index("path").get_doc_id(db_path_str)):
+        logger.warning("No favorite (path=%r) found", db_path_str)
     else:
         logger.info("Deleting favorite (path=%r)...", db_path_str)
-        DB.table("favorite_paths").remove(where("path") == db_path_str)
+        favorites.remove(doc_ids=[favorite_id])
 
 
+@_read_locked
 def get_all_tags():
-    tags = DB.table("tags").all()
+    tags = _table("tags").all()
     logger.debug("Returning %d tags...", len(tags))
     return tags
 
 
+@_read_locked
 def get_tag(*, tag_id: int = None, name: str = None):
     if name == "":  # pylint:disable=compare-to-empty-string
         logger.warning("Invalid argument for parameter 'name': %r", name)
@@ -93,10 +349,10 @@ def get_tag(*, tag_id: int = None, name: str = None):
     if not (tag_id or name):
         logger.error("Either truthy tag id or truthy tag name is required")
         return None
-    tag = DB.table("tags").get(
-        doc_id=tag_id if tag_id else None,
-        cond=(where("name") == name) if name else None,
-    )
+    tags = _table("tags")
+    if not tag_id:
+        tag_id = tags.index("name").get_doc_id(name)
+    tag = tags.get(doc_id=tag_id) if tag_id else None
     if tag and name:
         if tag["name"] == name:
             logger.debug("Returning tag (doc_id=%d)...", tag.doc_id)
@@ -110,27 +366,17 @@ def get_tag(*, tag_id: int = None, name: str = None):
     return tag
 
 
-def _is_valid_hex_color(color: str) -> bool:
-    if not color or not isinstance(color, str):
-        logger.warning("Invalid argument for parameter 'color': %r", color)
-        return False
-    if is_valid_color := bool(re.fullmatch(r"^#[0-9A-Fa-f]{6}$", color)):
-        logger.debug("Valid color: %r", color)
-    else:
-        logger.debug("Invalid color: %r", color)
-    return is_valid_color
-
-
+@_write_locked
 def insert_tag(name: str, color: str) -> Optional[int]:
     if not name:
         logger.error("Invalid argument for parameter 'name': %r", name)
         return None
     logger.debug("Name: %r", name)
-    if not (color and _is_valid_hex_color(color)):
+    if not (color and is_valid_hex_color(color)):
         logger.error("Invalid argument for parameter 'color': %r", color)
         return None
     logger.debug("Color: %r", color)
-    if get_tag(name=name):
+    if DB.table("tags").index("name").get_doc_id(name):
         logger.error("Tag (name=%r) already exists", name)
         return None
     if inserted_tag_id := DB.table("tags").insert({"name": name, "color": color}):
@@ -140,12 +386,13 @@ def insert_tag(name: str, color: str) -> Optional[int]:
     return inserted_tag_id
 
 
+@_write_locked
 def delete_tags(tag_ids: List[int]):
     (
         invalid_tag_ids,
         nonexistent_tag_ids,
         existing_tag_ids,
-    ) = _classify_doc_ids(tag_ids, {tag.doc_id for tag in get_all_tags()})
+    ) = classify_doc_ids(tag_ids, {tag.doc_id for tag in get_all_tags()})
     if invalid_tag_ids:
         logger.warning(
             "Argument for parameter 'tag_ids' contains invalid tag ids: %r",
@@ -160,30 +407,64 @@ def delete_tags(tag_ids: List[int]):
         )
     else:
         logger.debug("Nonexistent tag ids: %r", nonexistent_tag_ids)
-    existing_tag_id_strs = {str(tag_id) for tag_id in existing_tag_ids}
-    mappings = DB.search(Query().tag_ids.any(existing_tag_id_strs))
+    mappings = DB.get_multiple(
+        DB.index("tag_ids").get_doc_ids_with_any(existing_tag_ids)
+    )
     logger.debug(
         "Updating mappings with the following doc_ids: %r...",
         [mapping.doc_id for mapping in mappings],
     )
     for mapping in mappings:
-        mapping["tag_ids"] = sorted(set(mapping["tag_ids"]) - existing_tag_id_strs)
-    DB.write_back(mappings)
+        mapping["tag_ids"] = sorted(set(mapping["tag_ids"]) - existing_tag_ids)
+    _write_back_mappings(mappings)
     logger.info("Deleting tags with the following doc_ids: %r...", existing_tag_ids)
     DB.table("tags").remove(doc_ids=existing_tag_ids)
-    remove_mappings_without_tags()
 
 
+@_read_locked
 def get_tag_mappings(tag_id: int):
     if not tag_id:
         logger.warning("Invalid argument for parameter 'tag_id': %r", tag_id)
     else:
         logger.debug("Tag id: %r", tag_id)
-    mappings = DB.search(Query().tag_ids.all([str(tag_id)]))
+    mappings = _table().get_multiple(_table().index("tag_ids").get_doc_ids(tag_id))
     logger.debug("Returning %d mappings...", len(mappings))
     return mappings
 
 
+@_read_locked
+def iter_tag_mappings(
+    tag_id: int,
+    limit: Optional[int] = None,
+    offset: int = 0,
+    after_mapping_id: Optional[int] = None,
+) -> Iterator[Document]:
+    if not tag_id:
+        logger.warning("Invalid argument for parameter 'tag_id': %r", tag_id)
+    else:
+        logger.debug("Tag id: %r", tag_id)
+    with snapshot():
+        return _iter_mappings(
+            _table().index("tag_ids").get_doc_ids(tag_id),
+            limit,
+            offset,
+            after_mapping_id,
+        )
+
+
+@_read_locked
+def get_tag_occurrence_counts() -> Dict[int, int]:
+    # the tag index is kept up to date by every mapping mutation and rebuilt on
+    # load, so its postings double as occurrence counters
+    tag_index = _table().index("tag_ids")
+    occurrence_counts = {
+        tag_id: tag_index.get_count(tag_id) for tag_id in _table("tags").get_doc_ids()
+    }
+    logger.debug("Returning occurrence counts of %d tags...", len(occurrence_counts))
+    return occurrence_counts
+
+
+@_write_locked
 def update_tag(tag_id: int, name: str, color: str):
     if not tag_id:
         logger.error("Invalid argument for parameter 'tag_id': %r", tag_id)
@@ -197,10 +478,12 @@ def update_tag(tag_id: int, name: str, color: str):
         logger.error("Invalid argument for parameter 'color': %r", color)
         return
     logger.debug("Color: %r", color)
-    if not _is_valid_hex_color(color):
+    if not is_valid_hex_color(color):
         logger.error("Invalid color: %r", color)
         return
-    if (tag := get_tag(name=name)) and tag.doc_id != tag_id:
+    if (
+        existing_tag_id := DB.table("tags").index("name").get_doc_id(name)
+    ) and existing_tag_id != tag_id:
         logger.error("Tag (name=%r) already exists", name)
         return
     if tag := get_tag(tag_id=tag_id):
@@ -210,6 +493,7 @@ def update_tag(tag_id: int, name: str, color: str):
         logger.error("Nonexistent tag (doc_id=%r)", tag_id)
 
 
+@_read_locked
 def get_mapping(*, mapping_id: int = None, db_path_str: str = None):
     if db_path_str == "":  # pylint:disable=compare-to-empty-string
         logger.warning("Invalid argument for parameter 'db_path_str': %r", db_path_str)
@@ -217,10 +501,9 @@ def get_mapping(*, mapping_id: int = None, db_path_str: str = None):
     if not (mapping_id or db_path_str):
         logger.error("Either truthy mapping id or truthy mapping path is required")
         return None
-    mapping = DB.get(
-        doc_id=mapping_id if mapping_id else None,
-        cond=(where("path") == db_path_str) if db_path_str else None,
-    )
+    if not mapping_id:
+        mapping_id = _table().index("path").get_doc_id(db_path_str)
+    mapping = _table().get(doc_id=mapping_id) if mapping_id else None
     if mapping and db_path_str:
         if mapping["path"] == db_path_str:
             logger.debug("Returning mapping (doc_id=%d)...", mapping.doc_id)
@@ -234,12 +517,13 @@ def get_mapping(*, mapping_id: int = None, db_path_str: str = None):
     return mapping
 
 
+@_write_locked
 def remove_tags_from_mappings(tag_ids: List[int], mapping_ids: List[int]):
     (
         invalid_tag_ids,
         nonexistent_tag_ids,
         existing_tag_ids,
-    ) = _classify_doc_ids(tag_ids, {tag.doc_id for tag in get_all_tags()})
+    ) = classify_doc_ids(tag_ids, {tag.doc_id for tag in get_all_tags()})
     if invalid_tag_ids:
         logger.warning(
             "Argument for parameter 'tag_ids' contains invalid tag ids: %r",
@@ -258,9 +542,7 @@ def remove_tags_from_mappings(tag_ids: List[int], mapping_ids: List[int]):
         invalid_mapping_ids,
         nonexistent_mapping_ids,
         existing_mapping_ids,
-    ) = _classify_doc_ids(
-        mapping_ids, {mapping.doc_id for mapping in get_all_mappings()}
-    )
+    ) = classify_doc_ids(mapping_ids, DB.get_doc_ids())
     if invalid_mapping_ids:
         logger.warning(
             "Argument for parameter mapping_ids contains invalid mapping ids: %r",
@@ -275,32 +557,103 @@ def remove_tags_from_mappings(tag_ids: List[int], mapping_ids: List[int]):
         )
     else:
         logger.debug("Nonexistent mapping ids: %r", nonexistent_mapping_ids)
-    if existing_mappings := [
-        get_mapping(mapping_id=mapping_id) for mapping_id in existing_mapping_ids
-    ]:
+    if existing_mappings := DB.get_multiple(existing_mapping_ids):
         logger.info(
             "Updating mappings with the following doc_ids: %r...",
             [mapping.doc_id for mapping in existing_mappings],
         )
         for mapping in existing_mappings:
-            mapping["tag_ids"] = sorted(
-                set(mapping["tag_ids"]) - {str(tag_id) for tag_id in existing_tag_ids}
-            )
-        DB.write_back(existing_mappings)
-    remove_mappings_without_tags()
+            mapping["tag_ids"] = sorted(set(mapping["tag_ids"]) - existing_tag_ids)
+        _write_back_mappings(existing_mappings)
+
 
+def _write_back_mappings(mappings: List[Document]):
+    # mappings left without tags are deleted in the same write, so that only the
+    # mappings touched by a change are checked rather than the whole table
+    untagged_mapping_ids = [
+        mapping.doc_id for mapping in mappings if not mapping["tag_ids"]
+    ]
+    if untagged_mapping_ids:
+        logger.info("Deleting mappings left without tags: %r...", untagged_mapping_ids)
+    DB.write_batch(
+        {mapping.doc_id: mapping for mapping in mappings if mapping["tag_ids"]},
+        untagged_mapping_ids,
+        [],
+    )
 
+
+@_write_locked
 def remove_mappings_without_tags():
     logger.debug("Removing mappings without tags...")
-    DB.remove(Query().tag_ids.test(lambda x: not x))
+    if untagged_mapping_ids := DB.index("tag_ids").get_doc_ids_with_none():
+        logger.info("Deleting mappings without tags: %r...", list(untagged_mapping_ids))
+        DB.remove(doc_ids=list(untagged_mapping_ids))
 
 
+@_read_locked
 def get_all_mappings():
-    mappings = DB.all()
+    mappings = _table().all()
     logger.debug("Returning %d mappings...", len(mappings))
     return mappings
 
 
+@_read_locked
+def iter_all_mappings(
+    limit: Optional[int] = None,
+    offset: int = 0,
+    after_mapping_id: Optional[int] = None,
+) -> Iterator[Document]:
+    with snapshot():
+        return _iter_mappings(
+            Bitmap(_table().get_doc_ids()), limit, offset, after_mapping_id
+        )
+
+
+def _iter_mappings(
+    mapping_ids: Iterable[int],
+    limit: Optional[int],
+    offset: int,
+    after_mapping_id: Optional[int],
+    db_path_str_like: Optional[str] = None,
+) -> Iterator[Document]:
+    # called within snapshot(); the mappings are read from the snapshot by id
+    # order as the iterator is consumed, so that it neither blocks writes nor
+    # sees them
+    limit, offset = get_valid_page(limit, offset)
+    logger.debug(
+        "Iterating mappings (limit=%r, offset=%r, after_mapping_id=%r)...",
+        limit,
+        offset,
+        after_mapping_id,
+    )
+    table = _PINNED_SNAPSHOT.get().table()
+    if after_mapping_id is not None:
+        mapping_ids = itertools.dropwhile(
+            lambda mapping_id: mapping_id <= after_mapping_id, mapping_ids
+        )
+    mappings = (
+        mapping
+        for mapping_id in mapping_ids
+        if (mapping := table.get(mapping_id)) is not None
+    )
+    if db_path_str_like:
+        db_path_str_like_lower = db_path_str_like.lower()
+        mappings = (
+            mapping
+            for mapping in mappings
+            if mapping["path"].lower().find(db_path_str_like_lower) > -1
+        )
+    return itertools.islice(mappings, offset, None if limit is None else offset + limit)
+
+
+@_read_locked
+def get_mappings_count() -> int:
+    mappings_count = len(_table())
+    logger.debug("Returning mappings count %d...", mappings_count)
+    return mappings_count
+
+
+@_write_locked
 def insert_mapping(
     db_path_str: str, tag_ids: Union[List[int], None] = None
 ) -> Optional[int]:
@@ -325,7 +678,7 @@ def insert_mapping(
         invalid_tag_ids,
         nonexistent_tag_ids,
         existing_tag_ids,
-    ) = _classify_doc_ids(tag_ids, {tag.doc_id for tag in get_all_tags()})
+    ) = classify_doc_ids(tag_ids, {tag.doc_id for tag in get_all_tags()})
     if invalid_tag_ids:
         logger.warning(
             "Argument for parameter 'tag_ids' contains invalid tag ids: %r",
@@ -343,9 +696,7 @@ def insert_mapping(
     if inserted_mapping_id := DB.insert(
         {
             "path": db_path_str,
-            "tag_ids": (
-                [str(tag_id) for tag_id in existing_tag_ids] if existing_tag_ids else []
-            ),
+            "tag_ids": (sorted(existing_tag_ids) if existing_tag_ids else []),
         }
     ):
         logger.info("Inserted new mapping (doc_id=%d)", inserted_mapping_id)
@@ -354,14 +705,13 @@ def insert_mapping(
     return inserted_mapping_id
 
 
+@_write_locked
 def delete_mappings(mapping_ids: List[int]):
     (
         invalid_mapping_ids,
         nonexistent_mapping_ids,
         existing_mapping_ids,
-    ) = _classify_doc_ids(
-        mapping_ids, {mapping.doc_id for mapping in get_all_mappings()}
-    )
+    ) = classify_doc_ids(mapping_ids, DB.get_doc_ids())
     if invalid_mapping_ids:
         logger.warning(
             "Argument for parameter 'mapping_ids' contains invalid mapping ids: %r",
@@ -380,9 +730,9 @@ def delete_mappings(mapping_ids: List[int]):
         "Deleting mappings with the following doc_ids: %r...", existing_mapping_ids
     )
     DB.remove(doc_ids=existing_mapping_ids)
-    remove_mappings_without_tags()
 
 
+@_write_locked
 def update_mapping_path(mapping_id: int, db_path_str: str) -> None:
     if not mapping_id:
         logger.error("Invalid argument for parameter 'mapping_id': %r", mapping_id)
@@ -404,16 +754,77 @@ def update_mapping_path(mapping_id: int, db_path_str: str) -> None:
         logger.error("Nonexistent mapping (doc_id=%r)", mapping_id)
 
 
+@_read_locked
 def get_filtered_mappings(
     tag_ids_to_include: List[int],
     tag_ids_to_exclude: List[int],
     db_path_str_like: Optional[str] = None,
+    within_db_path_str: Optional[str] = None,
+    query_str: Optional[str] = None,
 ):
+    existing_tag_ids_to_include, existing_tag_ids_to_exclude = _classify_tag_ids(
+        tag_ids_to_include, tag_ids_to_exclude
+    )
+    mapping_ids = _get_filtered_mapping_ids(
+        existing_tag_ids_to_include,
+        existing_tag_ids_to_exclude,
+        db_path_str_like,
+        within_db_path_str,
+        query_str,
+    )
+    mappings = _table().get_multiple(
+        _table().get_doc_ids() if mapping_ids is None else mapping_ids
+    )
+    if db_path_str_like:
+        db_path_str_like_lower = db_path_str_like.lower()
+        mappings = [
+            mapping
+            for mapping in mappings
+            if mapping["path"].lower().find(db_path_str_like_lower) > -1
+        ]
+    logger.debug("Returning %d mappings...", len(mappings))
+    return mappings
+
+
+@_read_locked
+def iter_filtered_mappings(
+    tag_ids_to_include: List[int],
+    tag_ids_to_exclude: List[int],
+    db_path_str_like: Optional[str] = None,
+    within_db_path_str: Optional[str] = None,
+    query_str: Optional[str] = None,
+    limit: Optional[int] = None,
+    offset: int = 0,
+    after_mapping_id: Optional[int] = None,
+) -> Iterator[Document]:
+    with snapshot():
+        existing_tag_ids_to_include, existing_tag_ids_to_exclude = _classify_tag_ids(
+            tag_ids_to_include, tag_ids_to_exclude
+        )
+        mapping_ids = _get_filtered_mapping_ids(
+            existing_tag_ids_to_include,
+            existing_tag_ids_to_exclude,
+            db_path_str_like,
+            within_db_path_str,
+            query_str,
+        )
+        # the bitmaps of the live indexes change with later writes
+        mapping_ids = (
+            Bitmap(_table().get_doc_ids())
+            if mapping_ids is None
+            else mapping_ids.copy()
+        )
+        return _iter_mappings(
+            mapping_ids, limit, offset, after_mapping_id, db_path_str_like
+        )
+
+
+def _classify_tag_ids(tag_ids_to_include: List[int], tag_ids_to_exclude: List[int]):
     (
         invalid_tag_ids_to_include,
         nonexistent_tag_ids_to_include,
         existing_tag_ids_to_include,
-    ) = _classify_doc_ids(tag_ids_to_include, {tag.doc_id for tag in get_all_tags()})
+    ) = classify_doc_ids(tag_ids_to_include, {tag.doc_id for tag in get_all_tags()})
     if invalid_tag_ids_to_include:
         logger.warning(
             "Argument for parameter 'tag_ids_to_include' contains invalid tag ids: %r",
@@ -435,7 +846,7 @@ def get_filtered_mappings(
         invalid_tag_ids_to_exclude,
         nonexistent_tag_ids_to_exclude,
         existing_tag_ids_to_exclude,
-    ) = _classify_doc_ids(tag_ids_to_exclude, {tag.doc_id for tag in get_all_tags()})
+    ) = classify_doc_ids(tag_ids_to_exclude, {tag.doc_id for tag in get_all_tags()})
     if invalid_tag_ids_to_exclude:
         logger.warning(
             "Argument for parameter 'tag_ids_to_exclude' contains invalid tag ids: %r",
@@ -453,33 +864,144 @@ def get_filtered_mappings(
         logger.debug(
             "Nonexistent tag ids to exclude: %r", nonexistent_tag_ids_to_exclude
         )
-    tag_str_ids_to_include = [str(tag_id) for tag_id in existing_tag_ids_to_include]
-    tag_str_ids_to_exclude = [str(tag_id) for tag_id in existing_tag_ids_to_exclude]
-    if db_path_str_like:  # pylint: disable=consider-ternary-expression
-        mappings = DB.search(
-            (Query().tag_ids.all(tag_str_ids_to_include))
-            & (~(Query().tag_ids.any(tag_str_ids_to_exclude)))
-            & (
-                Query().path.test(
-                    lambda x: x.lower().find(db_path_str_like.lower()) > -1
-                )
+    return existing_tag_ids_to_include, existing_tag_ids_to_exclude
+
+
+def _get_filtered_mapping_ids(
+    tag_ids_to_include: Set[int],
+    tag_ids_to_exclude: Set[int],
+    db_path_str_like: Optional[str],
+    within_db_path_str: Optional[str],
+    query_str: Optional[str],
+) -> Optional[Bitmap]:
+    # filters are applied from the most to the least selective one, so that each
+    # works on the fewest surviving mapping ids; None stands for all mappings
+    tag_index = _table().index("tag_ids")
+    mapping_count = len(_table())
+    steps = [
+        (
+            tag_index.get_count(tag_id),
+            f"tag {tag_id}",
+            lambda mapping_ids, tag_id=tag_id: (
+                tag_index.get_doc_ids(tag_id)
+                if mapping_ids is None
+                else tag_index.intersect(mapping_ids, tag_id)
+            ),
+        )
+        for tag_id in tag_ids_to_include
+    ]
+    if within_db_path_str:
+        steps.append(
+            (
+                mapping_count,
+                f"within {within_db_path_str!r}",
+                lambda mapping_ids: _narrow_mapping_ids(
+                    mapping_ids,
+                    Bitmap(
+                        _table().index("path").get_doc_ids_under(within_db_path_str)
+                    ),
+                ),
             )
         )
-    else:
-        mappings = DB.search(
-            (Query().tag_ids.all(tag_str_ids_to_include))
-            & (~(Query().tag_ids.any(tag_str_ids_to_exclude)))
+    if query_str:
+        steps.append(
+            (
+                mapping_count,
+                f"query {query_str!r}",
+                lambda mapping_ids: _narrow_mapping_ids(
+                    mapping_ids,
+                    db_query.evaluate_query(
+                        db_query.parse_query(query_str),
+                        _get_query_term_mapping_ids,
+                        lambda: tag_index.doc_ids,
+                        _estimate_query_term_mapping_count,
+                    ),
+                ),
+            )
+        )
+    steps.sort(key=lambda step: step[0])
+    logger.debug("Filter plan: %r", [(count, name) for count, name, _ in steps])
+    mapping_ids = None
+    for _, name, narrow in steps:
+        if not (mapping_ids := narrow(mapping_ids)):
+            logger.debug("No mappings left after filtering by %s", name)
+            return mapping_ids
+    # verifying a few paths is cheaper than looking them up in the trigram index
+    if db_path_str_like and (
+        mapping_ids is None or len(mapping_ids) > PATH_INDEX_MIN_MAPPING_COUNT
+    ):
+        candidate_mapping_ids = (
+            _table().index("path").get_candidate_doc_ids_like(db_path_str_like)
         )
+        if candidate_mapping_ids is not None:
+            logger.debug("Path candidate mapping count: %d", len(candidate_mapping_ids))
+            mapping_ids = _narrow_mapping_ids(mapping_ids, candidate_mapping_ids)
+    if not tag_ids_to_exclude:
+        return mapping_ids
+    if mapping_ids is None:
+        mapping_ids = tag_index.doc_ids
+    for tag_id in sorted(tag_ids_to_exclude, key=tag_index.get_count):
+        if not mapping_ids:
+            break
+        mapping_ids = tag_index.subtract(mapping_ids, tag_id)
+    return mapping_ids
+
+
+def _narrow_mapping_ids(mapping_ids: Optional[Bitmap], other: Bitmap) -> Bitmap:
+    return other if mapping_ids is None else mapping_ids & other
+
+
+def _estimate_query_term_mapping_count(term) -> int:
+    if isinstance(term, db_query.TagTerm):
+        if (tag_id := _table("tags").index("name").get_doc_id(term.name)) is None:
+            return 0
+        return _table().index("tag_ids").get_count(tag_id)
+    return len(_table())
+
+
+def _get_query_term_mapping_ids(term) -> Bitmap:
+    if isinstance(term, db_query.TagTerm):
+        if (tag_id := _table("tags").index("name").get_doc_id(term.name)) is None:
+            logger.warning("Query contains nonexistent tag name: %r", term.name)
+            return Bitmap()
+        return _table().index("tag_ids").get_doc_ids(tag_id)
+    if isinstance(term, db_query.PathUnderTerm):
+        return Bitmap(_table().index("path").get_doc_ids_under(term.value))
+    value_lower = term.value.lower()
+    candidate_mapping_ids = (
+        _table().index("path").get_candidate_doc_ids_like(term.value)
+    )
+    return Bitmap(
+        mapping.doc_id
+        for mapping in (
+            _table().all()
+            if candidate_mapping_ids is None
+            else _table().get_multiple(candidate_mapping_ids)
+        )
+        if mapping["path"].lower().find(value_lower) > -1
+    )
+
+
+@_read_locked
+def get_mappings_under(db_path_str: str, recursive: bool = True):
+    if not db_path_str:
+        logger.warning("Invalid argument for parameter 'db_path_str': %r", db_path_str)
+        return []
+    logger.debug("DB path string: %r", db_path_str)
+    mappings = _table().get_multiple(
+        _table().index("path").get_doc_ids_under(db_path_str, recursive=recursive)
+    )
     logger.debug("Returning %d mappings...", len(mappings))
     return mappings
 
 
+@_write_locked
 def append_tags_to_mappings(tag_ids: List[int], mapping_ids: List[int]):
     (
         invalid_tag_ids,
         nonexistent_tag_ids,
         existing_tag_ids,
-    ) = _classify_doc_ids(tag_ids, {tag.doc_id for tag in get_all_tags()})
+    ) = classify_doc_ids(tag_ids, {tag.doc_id for tag in get_all_tags()})
     if invalid_tag_ids:
         logger.warning(
             "Argument for parameter 'tag_ids' contains invalid tag ids: %r",
@@ -498,9 +1020,7 @@ def append_tags_to_mappings(tag_ids: List[int], mapping_ids: List[int]):
         invalid_mapping_ids,
         nonexistent_mapping_ids,
         existing_mapping_ids,
-    ) = _classify_doc_ids(
-        mapping_ids, {mapping.doc_id for mapping in get_all_mappings()}
-    )
+    ) = classify_doc_ids(mapping_ids, DB.get_doc_ids())
     if invalid_mapping_ids:
         logger.warning(
             "Argument for parameter 'mapping_ids' contains invalid mapping ids: %r",
@@ -515,27 +1035,82 @@ def append_tags_to_mappings(tag_ids: List[int], mapping_ids: List[int]):
         )
     else:
         logger.debug("Nonexistent mapping ids: %r", nonexistent_mapping_ids)
-    if existing_mappings := [
-        get_mapping(mapping_id=mapping_id) for mapping_id in existing_mapping_ids
-    ]:
+    if existing_mappings := DB.get_multiple(existing_mapping_ids):
         logger.info(
             "Updating mappings with the following doc_ids: %r...",
             [mapping.doc_id for mapping in existing_mappings],
         )
         for mapping in existing_mappings:
-            mapping["tag_ids"] = sorted(
-                set(mapping["tag_ids"]).union(
-                    {str(tag_id) for tag_id in existing_tag_ids}
-                )
-            )
+            mapping["tag_ids"] = sorted(set(mapping["tag_ids"]).union(existing_tag_ids))
         DB.write_back(existing_mappings)
 
 
-DB = load_db(params.DB_PATH)
-logger.info(
-    "Loaded database at %r. Found %d tags, %d mappings, and %d favorites.",
-    params.DB_PATH,
-    len(get_all_tags()),
-    len(get_all_mappings()),
-    len(get_all_favorites()),
-)
+@contextlib.contextmanager
+def batch():
+    mappings_batch = MappingsBatch()
+    yield mappings_batch
+    commit_batch(mappings_batch)
+
+
+@_write_locked
+def commit_batch(mappings_batch: MappingsBatch):
+    if not mappings_batch:
+        logger.debug("Nothing to commit")
+        return
+    (
+        invalid_tag_ids,
+        nonexistent_tag_ids,
+        existing_tag_ids,
+    ) = classify_doc_ids(mappings_batch.tag_ids, DB.table("tags").get_doc_ids())
+    if invalid_tag_ids:
+        logger.warning("Batch contains invalid tag ids: %r", invalid_tag_ids)
+    else:
+        logger.debug("Invalid tag ids: %r", invalid_tag_ids)
+    if nonexistent_tag_ids:
+        logger.warning("Batch contains nonexistent tag ids: %r", nonexistent_tag_ids)
+    else:
+        logger.debug("Nonexistent tag ids: %r", nonexistent_tag_ids)
+    (
+        invalid_mapping_ids,
+        nonexistent_mapping_ids,
+        existing_mapping_ids,
+    ) = classify_doc_ids(mappings_batch.mapping_ids, DB.get_doc_ids())
+    if invalid_mapping_ids:
+        logger.warning("Batch contains invalid mapping ids: %r", invalid_mapping_ids)
+    else:
+        logger.debug("Invalid mapping ids: %r", invalid_mapping_ids)
+    if nonexistent_mapping_ids:
+        logger.warning(
+            "Batch contains nonexistent mapping ids: %r", nonexistent_mapping_ids
+        )
+    else:
+        logger.debug("Nonexistent mapping ids: %r", nonexistent_mapping_ids)
+    path_index = DB.index("path")
+    existing_mapping_ids.update(
+        mapping_id
+        for db_path_str in mappings_batch.db_path_strs
+        if (mapping_id := path_index.get_doc_id(db_path_str)) is not None
+    )
+    mappings = DB.get_multiple(existing_mapping_ids)
+    changes = mappings_batch.resolve(mappings, existing_tag_ids)
+    logger.info(
+        "Committing batch: updating %d, deleting %d and inserting %d mappings...",
+        len(changes.updated_mappings),
+        len(changes.deleted_mapping_ids),
+        len(changes.inserted_mappings),
+    )
+    mappings_by_doc_id = {mapping.doc_id: mapping for mapping in mappings}
+    mappings_batch.inserted_mapping_ids = DB.write_batch(
+        {
+            mapping_id: {**mappings_by_doc_id[mapping_id], "tag_ids": tag_ids}
+            for mapping_id, tag_ids in changes.updated_mappings.items()
+        },
+        changes.deleted_mapping_ids,
+        [
+            {"path": db_path_str, "tag_ids": tag_ids}
+            for db_path_str, tag_ids in changes.inserted_mappings.items()
+        ],
+    )
+
+
+atexit.register(flush_db)
@@ -0,0 +1,176 @@
+import functools
+import logging
+import math
+import re
+from collections import namedtuple
+from typing import Callable, List, Optional
+
+from pathtagger import db_bitmaps
+from pathtagger.db_bitmaps import Bitmap
+
+logger = logging.getLogger(__name__)
+
+TagTerm = namedtuple("TagTerm", "name")
+PathContainsTerm = namedtuple("PathContainsTerm", "value")
+PathUnderTerm = namedtuple("PathUnderTerm", "value")
+NotExpr = namedtuple("NotExpr", "operand")
+AndExpr = namedtuple("AndExpr", "operands")
+OrExpr = namedtuple("OrExpr", "operands")
+
+TERM_TYPES = (TagTerm, PathContainsTerm, PathUnderTerm)
+PREDICATES = {"path": PathContainsTerm, "under": PathUnderTerm}
+KEYWORDS = {"AND": "&", "OR": "|", "NOT": "!"}
+TOKEN_REGEX = re.compile(
+    r"\s*(?:"
+    r"(?P<operator>[()&|!])"
+    r'|"(?P<string>(?:[^"\\]|\\.)*)"'
+    r'|(?P<word>[^\s()&|!"]+)'
+    r")"
+)
+
+
+class QuerySyntaxError(ValueError):
+    pass
+
+
+def _tokenize(query_str: str) -> List[tuple]:
+    tokens = []
+    position = 0
+    end = len(query_str.rstrip())
+    while position < end:
+        if not (match := TOKEN_REGEX.match(query_str, position)):
+            raise QuerySyntaxError(f"Unterminated string at position {position}")
+        if match["operator"]:
+            tokens.append(("operator", match["operator"]))
+        elif match["string"] is not None:
+            tokens.append(("string", re.sub(r"\\(.)", r"\1", match["string"])))
+        elif match["word"] in KEYWORDS:
+            tokens.append(("operator", KEYWORDS[match["word"]]))
+        else:
+            tokens.append(("word", match["word"]))
+        position = match.end()
+    return tokens
+
+
+class _Parser:
+    def __init__(self, tokens: List[tuple]):
+        self.tokens = tokens
+        self.index = 0
+
+    def _peek(self) -> Optional[tuple]:
+        return self.tokens[self.index] if self.index < len(self.tokens) else None
+
+    def _next(self, expected: str) -> tuple:
+        if (token := self._peek()) is None:
+            raise QuerySyntaxError(f"Expected {expected}, found end of query")
+        self.index += 1
+        return token
+
+    def parse(self):
+        expr = self._parse_or()
+        if (token := self._peek()) is not None:
+            raise QuerySyntaxError(f"Unexpected {token[1]!r}")
+        return expr
+
+    def _parse_or(self):
+        operands = [self._parse_and()]
+        while self._peek() == ("operator", "|"):
+            self.index += 1
+            operands.append(self._parse_and())
+        return operands[0] if len(operands) == 1 else OrExpr(tuple(operands))
+
+    def _parse_and(self):
+        operands = [self._parse_not()]
+        while self._peek() == ("operator", "&"):
+            self.index += 1
+            operands.append(self._parse_not())
+        return operands[0] if len(operands) == 1 else AndExpr(tuple(operands))
+
+    def _parse_not(self):
+        if self._peek() == ("operator", "!"):
+            self.index += 1
+            return NotExpr(self._parse_not())
+        return self._parse_term()
+
+    def _parse_term(self):
+        kind, value = self._next("tag name, predicate or '('")
+        if (kind, value) == ("operator", "("):
+            expr = self._parse_or()
+            if self._next("')'") != ("operator", ")"):
+                raise QuerySyntaxError(f"Expected ')' at token {self.index}")
+            return expr
+        if kind == "operator":
+            raise QuerySyntaxError(f"Unexpected {value!r}")
+        name, separator, argument = value.partition(":")
+        if kind == "word" and separator and name in PREDICATES:
+            if not argument:
+                argument_kind, argument = self._next(f"argument of {value!r}")
+                if argument_kind == "operator":
+                    raise QuerySyntaxError(f"Expected argument of {value!r}")
+            return PREDICATES[name](argument)
+        return TagTerm(value)
+
+
+def _simplify(expr):
+    if isinstance(expr, NotExpr):
+        operand = _simplify(expr.operand)
+        return operand.operand if isinstance(operand, NotExpr) else NotExpr(operand)
+    if isinstance(expr, (AndExpr, OrExpr)):
+        operands = []
+        for operand in map(_simplify, expr.operands):
+            for flat_operand in (
+                operand.operands if isinstance(operand, type(expr)) else (operand,)
+            ):
+                if flat_operand not in operands:
+                    operands.append(flat_operand)
+        return operands[0] if len(operands) == 1 else type(expr)(tuple(operands))
+    return expr
+
+
+@functools.lru_cache(maxsize=128)
+def parse_query(query_str: str):
+    if not (tokens := _tokenize(query_str)):
+        raise QuerySyntaxError("Empty query")
+    expr = _simplify(_Parser(tokens).parse())
+    logger.debug("Parsed query %r into %r", query_str, expr)
+    return expr
+
+
+def evaluate_query(
+    expr,
+    get_term_doc_ids: Callable[..., Bitmap],
+    get_all_doc_ids: Callable[[], Bitmap],
+    estimate_term_count: Optional[Callable[..., int]] = None,
+) -> Bitmap:
+    # conjunctions subtract their negated operands from the intersection of the
+    # others, so that the ids of all documents are only needed without the latter
+    def evaluate(operand):
+        return evaluate_query(
+            operand, get_term_doc_ids, get_all_doc_ids, estimate_term_count
+        )
+
+    def estimate(operand):
+        # operands without an estimate are evaluated last
+        if estimate_term_count and isinstance(operand, TERM_TYPES):
+            return estimate_term_count(operand)
+        return math.inf
+
+    if isinstance(expr, TERM_TYPES):
+        return get_term_doc_ids(expr)
+    if isinstance(expr, OrExpr):
+        return db_bitmaps.union(map(evaluate, expr.operands))
+    operands = expr.operands if isinstance(expr, AndExpr) else (expr,)
+    included = [operand for operand in operands if not isinstance(operand, NotExpr)]
+    excluded = [operand.operand for operand in operands if isinstance(operand, NotExpr)]
+    doc_ids = None
+    for operand in sorted(included, key=estimate):
+        doc_ids = evaluate(operand) if doc_ids is None else doc_ids & evaluate(operand)
+        if not doc_ids:
+            return doc_ids
+    if doc_ids is None:
+        doc_ids = get_all_doc_ids()
+    for operand in sorted(excluded, key=estimate):
+        if not doc_ids:
+            break
+        doc_ids = doc_ids - evaluate(operand)
+    return doc_ids
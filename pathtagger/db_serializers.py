@@ -0,0 +1,72 @@
+import json
+import logging
+from typing import Dict, Type
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+logger = logging.getLogger(__name__)
+
+
+class JSONSerializer:
+    name = "json"
+
+    @staticmethod
+    def dumps(data) -> bytes:
+        return json.dumps(data, ensure_ascii=False, separators=(",", ":")).encode(
+            "utf-8"
+        )
+
+    @staticmethod
+    def loads(content: bytes):
+        return json.loads(content)
+
+
+class PrettyJSONSerializer(JSONSerializer):
+    name = "pretty"
+
+    @staticmethod
+    def dumps(data) -> bytes:
+        return json.dumps(
+            data,
+            sort_keys=True,
+            indent=4,
+            separators=(",", ": "),
+            ensure_ascii=False,
+        ).encode("utf-8")
+
+
+class OrjsonSerializer:
+    name = "orjson"
+
+    @staticmethod
+    def dumps(data) -> bytes:
+        # the tables written by TinyDB are keyed by ints
+        return orjson.dumps(data, option=orjson.OPT_NON_STR_KEYS)
+
+    @staticmethod
+    def loads(content: bytes):
+        return orjson.loads(content)
+
+
+# the serializers of the database file and journal, whose records must each fit
+# on one line; PrettyJSONSerializer is for exports only
+SERIALIZERS: Dict[str, Type] = {
+    serializer_cls.name: serializer_cls
+    for serializer_cls in (JSONSerializer, OrjsonSerializer)
+}
+
+
+def get_serializer(name: str = "auto"):
+    # "auto" picks orjson when it is installed
+    if name == "auto":
+        return OrjsonSerializer() if orjson is not None else JSONSerializer()
+    if name not in SERIALIZERS:
+        logger.error("Unknown JSON serializer %r, falling back to 'json'", name)
+        return JSONSerializer()
+    if name == OrjsonSerializer.name and orjson is None:
+        logger.error("orjson is not installed, falling back to 'json' serializer")
+        return JSONSerializer()
+    return SERIALIZERS[name]()
@@ -0,0 +1,89 @@
+import logging
+import threading
+from typing import Dict, Iterable, Iterator, List, Optional, Set, Union
+
+from tinydb.database import Document
+
+from pathtagger.db_indexes import TABLE_INDEXES, BitmapIndex, UniqueIndex
+
+logger = logging.getLogger(__name__)
+
+
+class Snapshot:
+    def __init__(self, version: int, tables: dict):
+        # writers replace the tables of the storage rather than changing them, so
+        # a snapshot only holds references, and successive snapshots share the
+        # tables and documents that did not change in between
+        self.version = version
+        self._tables = tables
+        self._indexes: Dict[str, Dict[str, Union[BitmapIndex, UniqueIndex]]] = {}
+        self._indexes_lock = threading.Lock()
+
+    def table(self, name: str = "_default", live_table=None) -> "SnapshotTable":
+        return SnapshotTable(self, name, self._tables.get(name, {}), live_table)
+
+    def get_indexes(self, name: str) -> Dict[str, Union[BitmapIndex, UniqueIndex]]:
+        if (indexes := self._indexes.get(name)) is None:
+            with self._indexes_lock:
+                if (indexes := self._indexes.get(name)) is None:
+                    indexes = {
+                        field: index_cls(field)
+                        for field, index_cls in TABLE_INDEXES.get(name, ())
+                    }
+                    for document in self.table(name):
+                        for index in indexes.values():
+                            index.add(document.doc_id, document)
+                    self._indexes[name] = indexes
+                    logger.debug(
+                        "Built indexes %r for table %r of snapshot %d",
+                        list(indexes),
+                        name,
+                        self.version,
+                    )
+        return indexes
+
+
+class SnapshotTable:
+    def __init__(self, snapshot: Snapshot, name: str, records, live_table=None):
+        self.name = name
+        self._snapshot = snapshot
+        # tables read from the storage are keyed by strings, written ones by ints
+        self._records = records
+        # answers index lookups while the snapshot is the current version
+        self._live_table = live_table
+
+    def _get_record(self, doc_id: int) -> Optional[dict]:
+        for key in (doc_id, str(doc_id)):
+            if key in self._records:
+                return self._records[key]
+        return None
+
+    def index(self, field: str):
+        if self._live_table is not None:
+            return self._live_table.index(field)
+        return self._snapshot.get_indexes(self.name)[field]
+
+    def get(self, doc_id: int) -> Optional[Document]:
+        if (record := self._get_record(doc_id)) is None:
+            return None
+        return Document(record, doc_id)
+
+    def get_multiple(self, doc_ids: Iterable[int]) -> List[Document]:
+        return [
+            Document(record, doc_id)
+            for doc_id in sorted(doc_ids)
+            if (record := self._get_record(doc_id)) is not None
+        ]
+
+    def all(self) -> List[Document]:
+        return list(self)
+
+    def __iter__(self) -> Iterator[Document]:
+        for key, record in self._records.items():
+            yield Document(record, int(key))
+
+    def __len__(self) -> int:
+        return len(self._records)
+
+    def get_doc_ids(self) -> Set[int]:
+        return set(map(int, self._records))
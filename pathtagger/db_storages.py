@@ -0,0 +1,859 @@
+import functools
+import glob
+import logging
+import mmap
+import os
+import threading
+import time
+from collections.abc import MutableMapping
+from typing import Callable, Dict, Iterable, Iterator, Optional, Set, Tuple
+
+from tinydb import TinyDB
+from tinydb.database import Document, StorageProxy
+from tinydb.middlewares import CachingMiddleware
+from tinydb.storages import Storage, touch
+
+from pathtagger import db_binary_format
+from pathtagger.db_locks import FileLock
+from pathtagger.db_serializers import JSONSerializer
+from pathtagger.db_snapshots import Snapshot
+
+logger = logging.getLogger(__name__)
+
+MAPPINGS_TABLE = TinyDB.DEFAULT_TABLE
+
+
+def _replace(tmp_path: str, path: str):
+    os.replace(tmp_path, path)
+    # the rename itself is only durable once the directory is synced
+    if os.name == "posix":
+        dir_fd = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY)
+        try:
+            os.fsync(dir_fd)
+        finally:
+            os.close(dir_fd)
+
+
+def _get_changed_doc_ids(old_data, new_data) -> Optional[Dict[str, Set[str]]]:
+    changed_doc_ids = {}
+    for table_name in old_data.keys() | new_data.keys():
+        old_table = old_data.get(table_name, {})
+        new_table = new_data.get(table_name, {})
+        if not (isinstance(old_table, dict) and isinstance(new_table, dict)):
+            return None
+        changed_doc_ids[table_name] = {
+            doc_id
+            for doc_id in old_table.keys() | new_table.keys()
+            if old_table.get(doc_id) != new_table.get(doc_id)
+        }
+    return changed_doc_ids
+
+
+class WriteBehindCachingMiddleware(CachingMiddleware):
+    def __init__(
+        self,
+        storage_cls=TinyDB.DEFAULT_STORAGE,
+        flush_every_n_writes: int = 1,
+        flush_interval_ms: int = 0,
+        file_lock: Optional[FileLock] = None,
+        group_commit_window_ms: int = 0,
+    ):
+        super().__init__(storage_cls)
+        self.flush_every_n_writes = flush_every_n_writes
+        self.flush_interval_ms = flush_interval_ms
+        # writes are flushed by the group commits the writers wait for instead
+        self.group_commit_window_ms = group_commit_window_ms
+        self._commit_condition = threading.Condition()
+        self._is_committing = False
+        self._committed_version = 0
+        # shared with other processes, which must hold it while flushing
+        self.file_lock = file_lock
+        self._lock = threading.RLock()
+        self._flush_timer = None
+        # incremented by every change of the cached data
+        self.version = 0
+        self._snapshot: Optional[Snapshot] = None
+
+    @property
+    def is_dirty(self) -> bool:
+        return self._cache_modified_count > 0
+
+    @property
+    def is_stale(self) -> bool:
+        return (
+            self.file_lock is not None
+            and self.file_lock.get_generation() != self.file_lock.synced_generation
+        )
+
+    def read(self):
+        with self._lock:
+            return super().read()
+
+    def write(self, data):
+        with self._lock:
+            self.cache = data
+            self.version += 1
+            self._cache_modified_count += 1
+            if self.group_commit_window_ms:
+                return
+            if (
+                self.flush_every_n_writes
+                and self._cache_modified_count >= self.flush_every_n_writes
+            ):
+                self._flush()
+            elif self.flush_interval_ms and self._flush_timer is None:
+                self._flush_timer = threading.Timer(
+                    self.flush_interval_ms / 1000, self.flush
+                )
+                self._flush_timer.daemon = True
+                self._flush_timer.start()
+
+    def flush(self):
+        with self._lock:
+            self._flush()
+
+    def wait_for_commit(self, version: int, flush: Optional[Callable] = None):
+        # the first writer to wait leads a group commit, which flushes the changes
+        # of all the writers arriving within the window at once
+        with self._commit_condition:
+            while self._committed_version < version and self._is_committing:
+                self._commit_condition.wait()
+            if self._committed_version >= version:
+                return
+            self._is_committing = True
+        committed_version = self._committed_version
+        try:
+            time.sleep(self.group_commit_window_ms / 1000)
+            # later writes may be flushed as well, but wait for a commit of their own
+            flushed_version = self.version
+            logger.debug("Group commit of database version %d...", flushed_version)
+            (flush or self.flush)()
+            committed_version = flushed_version
+        finally:
+            # on failure, a waiting writer leads the next commit
+            with self._commit_condition:
+                self._committed_version = committed_version
+                self._is_committing = False
+                self._commit_condition.notify_all()
+
+    def reload(self) -> Optional[Dict[str, Set[str]]]:
+        # returns the ids of the documents changed since the last read by table,
+        # or None if they are unknown
+        with self._lock:
+            if self.is_dirty:
+                logger.warning(
+                    "Discarding %d cached database writes on reload",
+                    self._cache_modified_count,
+                )
+                self._cache_modified_count = 0
+            old_data = self.cache
+            if (reload := getattr(self.storage, "reload", None)) is not None:
+                changed_doc_ids = reload()
+            else:
+                changed_doc_ids = None
+            self.cache = self.storage.read()
+            self.version += 1
+            if self.file_lock is not None:
+                self.file_lock.synced_generation = self.file_lock.get_generation()
+            if changed_doc_ids is None and old_data is not None:
+                changed_doc_ids = _get_changed_doc_ids(old_data, self.cache or {})
+            return changed_doc_ids
+
+    def get_snapshot(self) -> Snapshot:
+        # only the table dicts are copied, as TinyDB replaces rather than changes
+        # them on write; lazy records are changed in place and copied as well
+        with self._lock:
+            if self._snapshot is None or self._snapshot.version != self.version:
+                self._snapshot = Snapshot(
+                    self.version,
+                    {
+                        name: table.copy() if isinstance(table, LazyRecords) else table
+                        for name, table in (self.read() or {}).items()
+                    },
+                )
+            return self._snapshot
+
+    def is_current(self, snapshot: Snapshot) -> bool:
+        return snapshot is self._snapshot and snapshot.version == self.version
+
+    def _flush(self):
+        if self._flush_timer is not None:
+            self._flush_timer.cancel()
+            self._flush_timer = None
+        if self.is_dirty:
+            logger.debug(
+                "Flushing %d cached database writes...", self._cache_modified_count
+            )
+            super().flush()
+            if self.file_lock is not None:
+                self.file_lock.synced_generation = self.file_lock.increment_generation()
+
+    def close(self):
+        with self._lock:
+            self._flush()
+            self.storage.close()
+
+
+class JSONFileStorage(Storage):
+    def __init__(self, path, create_dirs=False, serializer=None, **_):
+        super().__init__()
+        touch(path, create_dirs=create_dirs)
+        self.path = str(path)
+        self.serializer = serializer or JSONSerializer()
+
+    def read(self):
+        with open(self.path, "rb") as db_file:
+            if not (content := db_file.read()):
+                return None
+        return self.serializer.loads(content)
+
+    def write(self, data):
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "wb") as tmp_file:
+            tmp_file.write(self.serializer.dumps(data))
+            tmp_file.flush()
+            os.fsync(tmp_file.fileno())
+        _replace(tmp_path, self.path)
+
+
+class JournalStorage(Storage):
+    JOURNAL_SUFFIX = ".journal"
+    COMPACTING_JOURNAL_SUFFIX = ".journal.compacting"
+
+    def __init__(
+        self,
+        path,
+        create_dirs=False,
+        serializer=None,
+        compaction_threshold: int = 16 * 1024 * 1024,
+        compact_in_background: bool = True,
+        **_,
+    ):
+        super().__init__()
+        touch(path, create_dirs=create_dirs)
+        self.path = str(path)
+        self.journal_path = self.path + self.JOURNAL_SUFFIX
+        self.compacting_journal_path = self.path + self.COMPACTING_JOURNAL_SUFFIX
+        # writes both the snapshot and the journal records, one per line
+        self.serializer = serializer or JSONSerializer()
+        self.compaction_threshold = compaction_threshold
+        # other processes must not see a compaction in progress
+        self.compact_in_background = compact_in_background
+        self._lock = threading.RLock()
+        self._compaction_thread = None
+        self._data = self._load()
+        self._journal = open(  # pylint: disable=consider-using-with
+            self.journal_path, "ab"
+        )
+        # forked processes share the file offset of the journal, so its end as
+        # seen by this process is tracked separately
+        self._journal_offset = self._journal.tell()
+        self._files_state = self._get_files_state()
+
+    def _load(self) -> Dict[str, Dict[str, dict]]:
+        with open(self.path, "rb") as snapshot_file:
+            content = snapshot_file.read()
+        data = self.serializer.loads(content) if content else {}
+        leftover_journal_paths = [
+            journal_path
+            for journal_path in (self.compacting_journal_path, self.journal_path)
+            if os.path.exists(journal_path)
+        ]
+        for journal_path in leftover_journal_paths:
+            self._replay(journal_path, data)
+        if os.path.exists(self.compacting_journal_path):
+            logger.warning("Finishing interrupted compaction of %r", self.path)
+            self._write_snapshot(data)
+            os.remove(self.journal_path)
+            os.remove(self.compacting_journal_path)
+        return data
+
+    def _replay(
+        self,
+        journal_path: str,
+        data: Dict[str, Dict[str, dict]],
+        offset: int = 0,
+        changed_doc_ids: Optional[Dict[str, Set[str]]] = None,
+    ):
+        replayed_count = 0
+        valid_size = offset
+        with open(journal_path, "rb") as journal_file:
+            journal_file.seek(offset)
+            for line in journal_file:
+                try:
+                    if not line.endswith(b"\n"):
+                        raise ValueError("Missing record terminator")
+                    record = self.serializer.loads(line)
+                except ValueError:
+                    logger.warning(
+                        "Truncating incomplete journal record in %r: %r",
+                        journal_path,
+                        line,
+                    )
+                    break
+                if changed_doc_ids is not None:
+                    self._record_change(record, data, changed_doc_ids)
+                self._apply(record, data)
+                replayed_count += 1
+                valid_size += len(line)
+        if valid_size < os.path.getsize(journal_path):
+            os.truncate(journal_path, valid_size)
+        logger.debug("Replayed %d records from %r", replayed_count, journal_path)
+        return valid_size
+
+    @staticmethod
+    def _apply(record: dict, data: Dict[str, Dict[str, dict]]):
+        if record["op"] == "create":
+            data.setdefault(record["table"], {})
+        elif record["op"] == "drop":
+            data.pop(record["table"], None)
+        elif record["op"] == "upsert":
+            data.setdefault(record["table"], {})[record["doc_id"]] = record["doc"]
+        elif record["op"] == "remove":
+            data.get(record["table"], {}).pop(record["doc_id"], None)
+
+    @staticmethod
+    def _record_change(
+        record: dict,
+        data: Dict[str, Dict[str, dict]],
+        changed_doc_ids: Dict[str, Set[str]],
+    ):
+        # dropping a table changes all of its documents
+        if "doc_id" in record:
+            changed_doc_ids.setdefault(record["table"], set()).add(record["doc_id"])
+        else:
+            changed_doc_ids.setdefault(record["table"], set()).update(
+                data.get(record["table"], {})
+            )
+
+    def _get_files_state(self) -> Optional[tuple]:
+        # compactions replace both the snapshot and the journal file
+        try:
+            snapshot_stat = os.stat(self.path)
+            journal_stat = os.stat(self.journal_path)
+        except FileNotFoundError:
+            return None
+        return (
+            snapshot_stat.st_ino,
+            snapshot_stat.st_mtime_ns,
+            snapshot_stat.st_size,
+            journal_stat.st_ino,
+        )
+
+    def reload(self) -> Optional[Dict[str, Set[str]]]:
+        # replays only the records appended to the journal by other processes,
+        # unless the journal was compacted in the meantime
+        with self._lock:
+            if self._get_files_state() == self._files_state:
+                changed_doc_ids = {}
+                self._journal_offset = self._replay(
+                    self.journal_path, self._data, self._journal_offset, changed_doc_ids
+                )
+                return changed_doc_ids
+            logger.debug("Reloading %r after compaction", self.path)
+            self._journal.close()
+            self._data = self._load()
+            self._journal = open(  # pylint: disable=consider-using-with
+                self.journal_path, "ab"
+            )
+            self._journal_offset = self._journal.tell()
+            self._files_state = self._get_files_state()
+            return None
+
+    @staticmethod
+    def _diff(
+        old_data: Dict[str, Dict[str, dict]], new_data: Dict[str, Dict[str, dict]]
+    ):
+        for table_name in old_data.keys() - new_data.keys():
+            yield {"op": "drop", "table": table_name}
+        for table_name, new_table in new_data.items():
+            if (old_table := old_data.get(table_name)) is None:
+                old_table = {}
+                yield {"op": "create", "table": table_name}
+            for doc_id in old_table.keys() - new_table.keys():
+                yield {"op": "remove", "table": table_name, "doc_id": doc_id}
+            for doc_id, doc in new_table.items():
+                if old_table.get(doc_id) != doc:
+                    yield {
+                        "op": "upsert",
+                        "table": table_name,
+                        "doc_id": doc_id,
+                        "doc": doc,
+                    }
+
+    def read(self):
+        with self._lock:
+            if not self._data:
+                return None
+            return {name: dict(table) for name, table in self._data.items()}
+
+    def write(self, data):
+        new_data = {
+            table_name: {str(doc_id): doc for doc_id, doc in table.items()}
+            for table_name, table in data.items()
+        }
+        with self._lock:
+            records = [
+                self.serializer.dumps(record) + b"\n"
+                for record in self._diff(self._data, new_data)
+            ]
+            if records:
+                self._journal.write(b"".join(records))
+                self._journal.flush()
+                os.fsync(self._journal.fileno())
+                self._journal_offset = self._journal.tell()
+            self._data = new_data
+            if self._journal.tell() >= self.compaction_threshold:
+                self._start_compaction()
+
+    def _start_compaction(self):
+        if self._compaction_thread is not None and self._compaction_thread.is_alive():
+            return
+        logger.info("Compacting journal %r...", self.journal_path)
+        self._journal.close()
+        os.replace(self.journal_path, self.compacting_journal_path)
+        self._journal = open(  # pylint: disable=consider-using-with
+            self.journal_path, "ab"
+        )
+        self._journal_offset = 0
+        data = {name: dict(table) for name, table in self._data.items()}
+        if not self.compact_in_background:
+            self._compact(data)
+            self._files_state = self._get_files_state()
+            return
+        self._compaction_thread = threading.Thread(
+            target=self._compact, args=(data,), daemon=True
+        )
+        self._compaction_thread.start()
+
+    def _compact(self, data: Dict[str, Dict[str, dict]]):
+        self._write_snapshot(data)
+        os.remove(self.compacting_journal_path)
+        logger.info("Compacted journal %r", self.journal_path)
+
+    def _write_snapshot(self, data: Dict[str, Dict[str, dict]]):
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "wb") as tmp_file:
+            tmp_file.write(self.serializer.dumps(data))
+            tmp_file.flush()
+            os.fsync(tmp_file.fileno())
+        _replace(tmp_path, self.path)
+
+    def close(self):
+        if self._compaction_thread is not None:
+            self._compaction_thread.join()
+        with self._lock:
+            self._journal.close()
+
+
+class BinaryStorage(Storage):
+    def __init__(self, path, create_dirs=False, **_):
+        super().__init__()
+        touch(path, create_dirs=create_dirs)
+        self.path = str(path)
+
+    def read(self):
+        with open(self.path, "rb") as db_file:
+            if not (content := db_file.read()):
+                return None
+        try:
+            return db_binary_format.loads(content)
+        except db_binary_format.BinaryFormatError as exc:
+            raise db_binary_format.BinaryFormatError(
+                f"{self.path!r} is not a binary database, "
+                "convert it with 'python manage.py convert_db'"
+            ) from exc
+
+    def write(self, data):
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "wb") as tmp_file:
+            db_binary_format.dump(data, tmp_file)
+            tmp_file.flush()
+            os.fsync(tmp_file.fileno())
+        _replace(tmp_path, self.path)
+
+
+class ShardedStorage(Storage):
+    SHARD_INFIX = ".shard-"
+
+    def __init__(
+        self,
+        path,
+        storage_cls=TinyDB.DEFAULT_STORAGE,
+        get_shard_name: Optional[Callable[[str], Optional[str]]] = None,
+        **kwargs,
+    ):
+        # the mappings are split by path into a file per shard, next to the main
+        # file, which holds the other tables and the mappings of no shard
+        super().__init__()
+        self.path = str(path)
+        self._path_root, self._path_ext = os.path.splitext(self.path)
+        self._get_shard_name = get_shard_name or (lambda db_path_str: None)
+        self._create_storage = functools.partial(storage_cls, **kwargs)
+        self._storage = self._create_storage(path)
+        self._shard_storages: Dict[str, Storage] = {}
+        self._open_shard_storages()
+        # the data of each file as last read or written, so that only the files
+        # with changed data are written
+        self._files_data: Dict[Optional[str], dict] = {}
+
+    def _get_shard_path(self, shard_name: str) -> str:
+        return self._path_root + self.SHARD_INFIX + shard_name + self._path_ext
+
+    def _open_shard_storages(self) -> bool:
+        # also opens the shards created by other processes; returns whether any
+        # new one was found
+        shard_path_prefix = self._path_root + self.SHARD_INFIX
+        shard_names = set()
+        for shard_path in glob.iglob(
+            glob.escape(shard_path_prefix) + "*" + glob.escape(self._path_ext)
+        ):
+            shard_name = shard_path[
+                len(shard_path_prefix) : len(shard_path) - len(self._path_ext)
+            ]
+            # skips journals and temporary files of the shards
+            if "." not in shard_name:
+                shard_names.add(shard_name)
+        new_shard_names = shard_names - self._shard_storages.keys()
+        for shard_name in sorted(new_shard_names):
+            self._shard_storages[shard_name] = self._create_storage(
+                self._get_shard_path(shard_name)
+            )
+            logger.debug("Opened shard %r", shard_name)
+        return bool(new_shard_names)
+
+    def read(self):
+        data = self._storage.read() or {}
+        self._files_data = {None: data}
+        tables = dict(data)
+        mappings = dict(data.get(MAPPINGS_TABLE, {}))
+        for shard_name, storage in self._shard_storages.items():
+            shard_data = self._files_data[shard_name] = storage.read() or {}
+            mappings.update(shard_data.get(MAPPINGS_TABLE, {}))
+        if mappings or MAPPINGS_TABLE in data:
+            tables[MAPPINGS_TABLE] = mappings
+        return tables or None
+
+    def write(self, data):
+        files_data: Dict[Optional[str], dict] = {
+            shard_name: {MAPPINGS_TABLE: {}} for shard_name in self._shard_storages
+        }
+        files_data[None] = {
+            table_name: {str(doc_id): document for doc_id, document in table.items()}
+            for table_name, table in data.items()
+            if table_name != MAPPINGS_TABLE
+        }
+        if MAPPINGS_TABLE in data:
+            files_data[None][MAPPINGS_TABLE] = {}
+        for doc_id, document in data.get(MAPPINGS_TABLE, {}).items():
+            shard_name = self._get_shard_name(document.get("path"))
+            files_data.setdefault(shard_name, {MAPPINGS_TABLE: {}})[MAPPINGS_TABLE][
+                str(doc_id)
+            ] = document
+        # the shards go first, so that a mapping moved between them is never lost
+        for shard_name in sorted(files_data, key=lambda name: name is None):
+            if files_data[shard_name] == self._files_data.get(shard_name):
+                continue
+            if shard_name is None:
+                storage = self._storage
+            elif (storage := self._shard_storages.get(shard_name)) is None:
+                storage = self._shard_storages[shard_name] = self._create_storage(
+                    self._get_shard_path(shard_name)
+                )
+                logger.info("Created shard %r", shard_name)
+            logger.debug("Writing shard %r...", shard_name)
+            storage.write(files_data[shard_name])
+            self._files_data[shard_name] = files_data[shard_name]
+
+    def reload(self) -> Optional[Dict[str, Set[str]]]:
+        # returns the ids of the changed documents by table, or None if any file
+        # cannot tell them
+        changed_doc_ids: Optional[Dict[str, Set[str]]] = {}
+        if self._open_shard_storages():
+            changed_doc_ids = None
+        for storage in (self._storage, *self._shard_storages.values()):
+            if (reload := getattr(storage, "reload", None)) is None:
+                changed_doc_ids = None
+            elif (storage_changed_doc_ids := reload()) is None:
+                changed_doc_ids = None
+            elif changed_doc_ids is not None:
+                for table_name, doc_ids in storage_changed_doc_ids.items():
+                    changed_doc_ids.setdefault(table_name, set()).update(doc_ids)
+        return changed_doc_ids
+
+    def close(self):
+        for storage in (self._storage, *self._shard_storages.values()):
+            storage.close()
+
+
+class LazyRecords:
+    def __init__(self, table_reader: db_binary_format.TableReader):
+        self.rebase(table_reader)
+
+    def rebase(self, table_reader: db_binary_format.TableReader):
+        self._table_reader = table_reader
+        self._offsets = dict(table_reader.iter_record_offsets())
+        self._changed: Dict[int, dict] = {}
+        self._removed = set()
+        self._added = set()
+
+    def copy(self) -> "LazyRecords":
+        # the offsets are replaced rather than changed on rebase, so they are shared
+        records = LazyRecords.__new__(LazyRecords)
+        records._table_reader = self._table_reader
+        records._offsets = self._offsets
+        records._changed = dict(self._changed)
+        records._removed = set(self._removed)
+        records._added = set(self._added)
+        return records
+
+    def __contains__(self, doc_id) -> bool:
+        return doc_id in self._changed or (
+            doc_id in self._offsets and doc_id not in self._removed
+        )
+
+    def __iter__(self) -> Iterator[int]:
+        for doc_id in self._offsets:
+            if doc_id not in self._removed:
+                yield doc_id
+        yield from self._added
+
+    def __len__(self) -> int:
+        return len(self._offsets) - len(self._removed) + len(self._added)
+
+    def items(self) -> Iterator[Tuple[int, dict]]:
+        for doc_id, document in self._table_reader.iter_records():
+            if doc_id in self._changed:
+                yield doc_id, dict(self._changed[doc_id])
+            elif doc_id not in self._removed:
+                yield doc_id, document
+        for doc_id in self._added:
+            yield doc_id, dict(self._changed[doc_id])
+
+    def __getitem__(self, doc_id: int) -> dict:
+        return self.get_document(doc_id)
+
+    def get_document(self, doc_id: int) -> dict:
+        if (document := self._changed.get(doc_id)) is not None:
+            return dict(document)
+        if doc_id in self._removed:
+            raise KeyError(doc_id)
+        return self._table_reader.decode_record(self._offsets[doc_id])[1]
+
+    def set_document(self, doc_id: int, document: dict):
+        self._changed[doc_id] = dict(document)
+        if doc_id in self._offsets:
+            self._removed.discard(doc_id)
+        else:
+            self._added.add(doc_id)
+
+    def remove_document(self, doc_id: int):
+        self._changed.pop(doc_id, None)
+        if doc_id in self._offsets:
+            self._removed.add(doc_id)
+        else:
+            self._added.discard(doc_id)
+
+    def to_table_writer(self, name: str) -> db_binary_format.TableWriter:
+        table_writer = db_binary_format.TableWriter(name, base=self._table_reader)
+        for doc_id, offset in self._offsets.items():
+            if doc_id in self._changed:
+                table_writer.add_document(doc_id, self._changed[doc_id])
+            elif doc_id not in self._removed:
+                table_writer.add_raw_record(self._table_reader.raw_record(offset))
+        for doc_id in self._added:
+            table_writer.add_document(doc_id, self._changed[doc_id])
+        return table_writer
+
+
+class LazyDataProxy(MutableMapping):
+    def __init__(self, records: LazyRecords, raw_data: dict):
+        self.records = records
+        self.raw_data = raw_data
+        self._documents: Dict[int, Document] = {}
+        self._assigned_doc_ids = set()
+        self._removed_doc_ids = set()
+
+    def __getitem__(self, doc_id: int) -> Document:
+        if doc_id in self._removed_doc_ids:
+            raise KeyError(doc_id)
+        if (document := self._documents.get(doc_id)) is None:
+            document = self._documents[doc_id] = Document(
+                self.records.get_document(doc_id), doc_id
+            )
+        return document
+
+    def __setitem__(self, doc_id: int, document: dict):
+        self._removed_doc_ids.discard(doc_id)
+        self._assigned_doc_ids.add(doc_id)
+        self._documents[doc_id] = Document(document, doc_id)
+
+    def __delitem__(self, doc_id: int):
+        if doc_id not in self:
+            raise KeyError(doc_id)
+        self._documents.pop(doc_id, None)
+        self._assigned_doc_ids.discard(doc_id)
+        self._removed_doc_ids.add(doc_id)
+
+    def __contains__(self, doc_id) -> bool:
+        return doc_id not in self._removed_doc_ids and (
+            doc_id in self._documents or doc_id in self.records
+        )
+
+    def __iter__(self) -> Iterator[int]:
+        for doc_id in self.records:
+            if doc_id not in self._removed_doc_ids:
+                yield doc_id
+        for doc_id in self._assigned_doc_ids:
+            if doc_id not in self.records:
+                yield doc_id
+
+    def __len__(self) -> int:
+        return (
+            len(self.records)
+            - sum(1 for doc_id in self._removed_doc_ids if doc_id in self.records)
+            + sum(1 for doc_id in self._assigned_doc_ids if doc_id not in self.records)
+        )
+
+    def items(self) -> Iterator[Tuple[int, Document]]:
+        # streams the documents without keeping them around like __getitem__
+        # does, so scanning a table does not hold all of it in memory
+        for doc_id, document in self.records.items():
+            if doc_id in self._removed_doc_ids:
+                continue
+            if (handed_out_document := self._documents.get(doc_id)) is not None:
+                yield doc_id, handed_out_document
+            else:
+                yield doc_id, Document(document, doc_id)
+        for doc_id in self._assigned_doc_ids:
+            if doc_id not in self.records:
+                yield doc_id, self._documents[doc_id]
+
+    def values(self) -> Iterator[Document]:
+        for _, document in self.items():
+            yield document
+
+    def apply(self):
+        for doc_id in self._removed_doc_ids:
+            self.records.remove_document(doc_id)
+        for doc_id, document in self._documents.items():
+            # TinyDB updates the documents it has read in place
+            if (
+                doc_id in self._assigned_doc_ids
+                or document != self.records.get_document(doc_id)
+            ):
+                self.records.set_document(doc_id, document)
+
+
+class LazyStorageProxy(StorageProxy):
+    def _read_records(self):
+        return (self._storage.read() or {}).get(self._table_name, {})
+
+    def count(self) -> int:
+        return len(self._read_records())
+
+    def get_doc_ids(self) -> Set[int]:
+        return set(map(int, self._read_records()))
+
+    def get_documents(self, doc_ids: Iterable[int]) -> Dict[int, Document]:
+        # builds only the requested documents rather than all of the table's
+        records = self._read_records()
+        documents = {}
+        for doc_id in doc_ids:
+            # tables read from the storage are keyed by strings, written ones by ints
+            for key in (doc_id, str(doc_id)):
+                if key in records:
+                    documents[doc_id] = Document(records[key], doc_id)
+                    break
+        return documents
+
+    def get_last_doc_id(self) -> int:
+        raw_data = self._storage.read() or {}
+        if self._table_name not in raw_data:
+            # creates the table, as reading it does
+            self.read()
+            return 0
+        return max(map(int, raw_data[self._table_name]), default=0)
+
+    def read(self):
+        raw_data = self._storage.read() or {}
+        if isinstance(records := raw_data.get(self._table_name), LazyRecords):
+            return LazyDataProxy(records, raw_data)
+        return super().read()
+
+    def write(self, data):
+        if isinstance(data, LazyDataProxy):
+            data.apply()
+            data.raw_data[self._table_name] = data.records
+            self._storage.write(data.raw_data)
+        else:
+            super().write(data)
+
+
+class MmapStorage(Storage):
+    def __init__(self, path, create_dirs=False, **_):
+        super().__init__()
+        touch(path, create_dirs=create_dirs)
+        self.path = str(path)
+        self._tables: Optional[Dict[str, LazyRecords]] = None
+
+    def _map_tables(self) -> Dict[str, db_binary_format.TableReader]:
+        with open(self.path, "rb") as db_file:
+            if not os.fstat(db_file.fileno()).st_size:
+                return {}
+            # the mapping stays valid after the file is closed or replaced
+            buffer = mmap.mmap(db_file.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            return {
+                table_reader.name: table_reader
+                for table_reader in db_binary_format.iter_tables(buffer)
+            }
+        except db_binary_format.BinaryFormatError as exc:
+            raise db_binary_format.BinaryFormatError(
+                f"{self.path!r} is not a binary database, "
+                "convert it with 'python manage.py convert_db'"
+            ) from exc
+
+    def read(self):
+        if self._tables is None:
+            self._tables = {
+                name: LazyRecords(table_reader)
+                for name, table_reader in self._map_tables().items()
+            }
+            logger.debug(
+                "Mapped %r with %r records",
+                self.path,
+                {name: len(records) for name, records in self._tables.items()},
+            )
+        return dict(self._tables) or None
+
+    def reload(self) -> None:
+        # maps the file again on the next read; the documents are decoded lazily,
+        # so there is nothing to compare
+        self._tables = None
+
+    def write(self, data):
+        table_writers = []
+        for name, table in data.items():
+            if isinstance(table, LazyRecords):
+                table_writers.append(table.to_table_writer(name))
+            else:
+                table_writer = db_binary_format.TableWriter(name)
+                for doc_id, document in table.items():
+                    table_writer.add_document(doc_id, document)
+                table_writers.append(table_writer)
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "wb") as tmp_file:
+            tmp_file.write(db_binary_format.pack_tables(table_writers))
+            tmp_file.flush()
+            os.fsync(tmp_file.fileno())
+        _replace(tmp_path, self.path)
+        # drop the written documents and serve them lazily from the new file
+        table_readers = self._map_tables()
+        self._tables = {}
+        for name, table in data.items():
+            if isinstance(table, LazyRecords):
+                table.rebase(table_readers[name])
+            else:
+                table = data[name] = LazyRecords(table_readers[name])
+            self._tables[name] = table
@@ -0,0 +1,150 @@
+import logging
+import re
+from collections import namedtuple
+from typing import Dict, Iterable, List, NamedTuple, Optional, Set, Tuple
+
+from tinydb.database import Document
+
+logger = logging.getLogger(__name__)
+
+
+def classify_doc_ids(doc_ids: List[int], reference_doc_ids: Set[int]) -> NamedTuple:
+    DocIdClassification = namedtuple(
+        "DocIdClassification", "invalid_doc_ids nonexistent_doc_ids existing_doc_ids"
+    )
+    if not (doc_ids and reference_doc_ids):
+        return DocIdClassification(set(), set(), set())
+    invalid_doc_ids = {doc_id for doc_id in doc_ids if not doc_id}
+    valid_doc_ids = set(doc_ids) - invalid_doc_ids
+    return DocIdClassification(
+        invalid_doc_ids,
+        valid_doc_ids - reference_doc_ids,
+        valid_doc_ids.intersection(reference_doc_ids),
+    )
+
+
+def is_valid_hex_color(color: str) -> bool:
+    if not color or not isinstance(color, str):
+        logger.warning("Invalid argument for parameter 'color': %r", color)
+        return False
+    if is_valid_color := bool(re.fullmatch(r"^#[0-9A-Fa-f]{6}$", color)):
+        logger.debug("Valid color: %r", color)
+    else:
+        logger.debug("Invalid color: %r", color)
+    return is_valid_color
+
+
+def get_valid_page(limit: Optional[int], offset: int) -> Tuple[Optional[int], int]:
+    if limit is not None and limit < 0:
+        logger.warning("Invalid argument for parameter 'limit': %r", limit)
+        limit = 0
+    if offset < 0:
+        logger.warning("Invalid argument for parameter 'offset': %r", offset)
+        offset = 0
+    return limit, offset
+
+
+def get_shard_name(db_path_str: str, shard_prefixes: List[str]) -> Optional[str]:
+    # the longest matching prefix picks the shard; with "*" among the prefixes,
+    # each top-level directory not matching any gets a shard of its own
+    if not db_path_str:
+        return None
+    matching_prefixes = [
+        prefix
+        for prefix in (prefix.rstrip("/") for prefix in shard_prefixes)
+        if prefix not in ("", "*")
+        and (db_path_str == prefix or db_path_str.startswith(prefix + "/"))
+    ]
+    if matching_prefixes:
+        prefix = max(matching_prefixes, key=len)
+    elif "*" in shard_prefixes:
+        prefix = db_path_str.strip("/").split("/", 1)[0]
+    else:
+        return None
+    # shard names are part of file names
+    return re.sub(r"[^\w-]+", "_", prefix.strip("/")) or None
+
+
+MappingsBatchChanges = namedtuple(
+    "MappingsBatchChanges", "updated_mappings deleted_mapping_ids inserted_mappings"
+)
+
+
+class MappingsBatch:
+    def __init__(self):
+        # (operation, tag ids, mapping ids) in the order they were added
+        self._operations = []
+        self._mappings_to_insert: Dict[str, Set[int]] = {}
+        self.inserted_mapping_ids: List[int] = []
+
+    def append_tags_to_mappings(self, tag_ids: List[int], mapping_ids: List[int]):
+        self._operations.append(("append", set(tag_ids), set(mapping_ids)))
+
+    def remove_tags_from_mappings(self, tag_ids: List[int], mapping_ids: List[int]):
+        self._operations.append(("remove", set(tag_ids), set(mapping_ids)))
+
+    def delete_mappings(self, mapping_ids: List[int]):
+        self._operations.append(("delete", set(), set(mapping_ids)))
+
+    def insert_mapping(self, db_path_str: str, tag_ids: List[int]):
+        if not db_path_str:
+            logger.error(
+                "Invalid argument for parameter 'db_path_str': %r", db_path_str
+            )
+            return
+        self._mappings_to_insert.setdefault(db_path_str, set(tag_ids))
+
+    @property
+    def tag_ids(self) -> List[int]:
+        return list(
+            set().union(
+                *(tag_ids for _, tag_ids, _ in self._operations),
+                *self._mappings_to_insert.values(),
+            )
+        )
+
+    @property
+    def mapping_ids(self) -> List[int]:
+        return list(set().union(*(ids for _, _, ids in self._operations)))
+
+    @property
+    def db_path_strs(self) -> List[str]:
+        return list(self._mappings_to_insert)
+
+    def __bool__(self) -> bool:
+        return bool(self._operations or self._mappings_to_insert)
+
+    def resolve(
+        self, mappings: Iterable[Document], existing_tag_ids: Set[int]
+    ) -> MappingsBatchChanges:
+        mapping_paths = set()
+        updated_mappings = {}
+        deleted_mapping_ids = set()
+        for mapping in mappings:
+            mapping_paths.add(mapping["path"])
+            mapping_tag_ids = set(mapping["tag_ids"])
+            for operation, tag_ids, mapping_ids in self._operations:
+                if mapping.doc_id not in mapping_ids:
+                    continue
+                if operation == "delete":
+                    mapping_tag_ids = set()
+                    break
+                if operation == "append":
+                    mapping_tag_ids |= tag_ids & existing_tag_ids
+                else:
+                    mapping_tag_ids -= tag_ids & existing_tag_ids
+            if not mapping_tag_ids:
+                deleted_mapping_ids.add(mapping.doc_id)
+            elif (sorted_tag_ids := sorted(mapping_tag_ids)) != mapping["tag_ids"]:
+                updated_mappings[mapping.doc_id] = sorted_tag_ids
+        inserted_mappings = {}
+        for db_path_str, tag_ids in self._mappings_to_insert.items():
+            if db_path_str in mapping_paths:
+                logger.info("Mapping (path=%r) already exists", db_path_str)
+            elif tag_ids := tag_ids & existing_tag_ids:
+                inserted_mappings[db_path_str] = sorted(tag_ids)
+            else:
+                logger.debug("Skipping mapping (path=%r) without tags", db_path_str)
+        return MappingsBatchChanges(
+            updated_mappings, deleted_mapping_ids, inserted_mappings
+        )
@@ -0,0 +1,86 @@
+import random
+import timeit
+import tracemalloc
+
+from django.core.management.base import BaseCommand
+
+from pathtagger.db_indexes import PathIndex
+
+
+def _scan(paths_by_doc_id, value):
+    value_lower = value.lower()
+    return [
+        doc_id
+        for doc_id, path in paths_by_doc_id.items()
+        if path.lower().find(value_lower) > -1
+    ]
+
+
+def _search(index, paths_by_doc_id, value):
+    if (doc_ids := index.get_candidate_doc_ids_like(value)) is None:
+        return _scan(paths_by_doc_id, value)
+    value_lower = value.lower()
+    return [
+        doc_id
+        for doc_id in doc_ids
+        if paths_by_doc_id[doc_id].lower().find(value_lower) > -1
+    ]
+
+
+class Command(BaseCommand):
+    help = (
+        "Compares case-insensitive path substring searches on synthetic mappings "
+        "using a full scan and the path trigram index."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--mappings", type=int, default=100000)
+        parser.add_argument("--repeat", type=int, default=5)
+        parser.add_argument("--seed", type=int, default=0)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options["seed"])
+        paths_by_doc_id = {
+            doc_id: (
+                f"/home/user{doc_id % 7}/Projects/Project{rng.randint(0, 500)}"
+                f"/src/module_{rng.randint(0, 3000)}/File_{doc_id}.py"
+            )
+            for doc_id in range(1, options["mappings"] + 1)
+        }
+        index = PathIndex("path")
+        for doc_id, path in paths_by_doc_id.items():
+            index.add(doc_id, {"path": path})
+        start = timeit.default_timer()
+        index.get_candidate_doc_ids_like("")
+        build = timeit.default_timer() - start
+        # tracing slows allocations down, so the size is measured on a second build
+        traced_index = PathIndex("path")
+        traced_index._value_by_doc_id = index._value_by_doc_id
+        tracemalloc.start()
+        traced_index.get_candidate_doc_ids_like("")
+        size, _ = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        del traced_index
+        self.stdout.write(
+            f"{len(paths_by_doc_id)} mappings, best of {options['repeat']} runs"
+        )
+        self.stdout.write(
+            f"trigram index build: {build * 1000:.1f} ms ({size // 1024} KiB)"
+        )
+        for value in ("file_1234", "MODULE_12", "project42/src", "user3", ".py"):
+            results = {
+                implementation: min(
+                    timeit.repeat(function, number=1, repeat=options["repeat"])
+                )
+                for implementation, function in {
+                    "scan": lambda: _scan(paths_by_doc_id, value),
+                    "trigram": lambda: _search(index, paths_by_doc_id, value),
+                }.items()
+            }
+            self.stdout.write(
+                f"{value!r} ({len(_search(index, paths_by_doc_id, value))} matches): "
+                + ", ".join(
+                    f"{implementation} {duration * 1000:.2f} ms"
+                    for implementation, duration in results.items()
+                )
+            )
@@ -0,0 +1,72 @@
+import functools
+import random
+import timeit
+
+from django.core.management.base import BaseCommand
+
+from pathtagger import db_serializers
+
+
+class Command(BaseCommand):
+    help = (
+        "Compares writing and reading a synthetic database with the pretty-printed "
+        "JSON the database file used to be written as, compact JSON and orjson."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--mappings", type=int, default=500000)
+        parser.add_argument("--tags", type=int, default=50)
+        parser.add_argument("--repeat", type=int, default=3)
+        parser.add_argument("--seed", type=int, default=0)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options["seed"])
+        tag_ids = list(range(1, options["tags"] + 1))
+        # tables as written by TinyDB, keyed by int doc ids
+        data = {
+            "_default": {
+                doc_id: {
+                    "path": f"/home/user/library/{doc_id % 1000}/mapping-{doc_id}",
+                    "tag_ids": sorted(rng.sample(tag_ids, rng.randint(1, 4))),
+                }
+                for doc_id in range(1, options["mappings"] + 1)
+            },
+            "tags": {
+                tag_id: {"name": f"tag-{tag_id}", "color": "#d9d9d9"}
+                for tag_id in tag_ids
+            },
+            "favorite_paths": {1: {"path": "/home/user/library"}},
+        }
+        serializers = [
+            db_serializers.PrettyJSONSerializer(),
+            db_serializers.JSONSerializer(),
+        ]
+        if db_serializers.orjson is not None:
+            serializers.append(db_serializers.OrjsonSerializer())
+        else:
+            self.stdout.write("orjson is not installed, skipping it")
+        self.stdout.write(
+            f"{options['mappings']} mappings, {len(tag_ids)} tags, "
+            f"best of {options['repeat']} runs"
+        )
+        for serializer in serializers:
+            content = serializer.dumps(data)
+            dump_duration = min(
+                timeit.repeat(
+                    functools.partial(serializer.dumps, data),
+                    number=1,
+                    repeat=options["repeat"],
+                )
+            )
+            load_duration = min(
+                timeit.repeat(
+                    functools.partial(serializer.loads, content),
+                    number=1,
+                    repeat=options["repeat"],
+                )
+            )
+            self.stdout.write(
+                f"{serializer.name}: {len(content) / 1024 / 1024:.1f} MiB, "
+                f"dump {dump_duration * 1000:.0f} ms, "
+                f"load {load_duration * 1000:.0f} ms"
+            )
@@ -0,0 +1,98 @@
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from pathtagger.db_serializers import JSONSerializer
+
+# run in a fresh process per measurement, as the module state is what is measured
+STARTUP_SCRIPT = """
+import json, sys, time
+start = time.perf_counter()
+import django
+django.setup()
+from Tagger import params
+params.DB_PATH = sys.argv[1]
+from pathtagger import db_operations, views
+timings = {"import": time.perf_counter() - start}
+start = time.perf_counter()
+db_operations.get_mappings_count()
+timings["open"] = time.perf_counter() - start
+start = time.perf_counter()
+db_operations.warm_up_db()
+timings["warm_up"] = time.perf_counter() - start
+start = time.perf_counter()
+len(db_operations.get_all_tags())
+len(db_operations.get_all_mappings())
+len(db_operations.get_all_favorites())
+timings["materialized_counts"] = time.perf_counter() - start
+print(json.dumps(timings))
+"""
+
+
+class Command(BaseCommand):
+    help = (
+        "Measures the startup of fresh processes on a synthetic database: importing "
+        "the database operations, opening the database on first use, warming it "
+        "up, and counting its documents by materializing them, as startup used to."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--mappings", type=int, default=100000)
+        parser.add_argument("--tags", type=int, default=50)
+        parser.add_argument("--repeat", type=int, default=3)
+        parser.add_argument("--seed", type=int, default=0)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options["seed"])
+        tag_ids = list(range(1, options["tags"] + 1))
+        data = {
+            "_default": {
+                doc_id: {
+                    "path": f"/home/user/library/{doc_id % 1000}/mapping-{doc_id}",
+                    "tag_ids": sorted(rng.sample(tag_ids, rng.randint(1, 4))),
+                }
+                for doc_id in range(1, options["mappings"] + 1)
+            },
+            "tags": {
+                tag_id: {"name": f"tag-{tag_id}", "color": "#d9d9d9"}
+                for tag_id in tag_ids
+            },
+            "favorite_paths": {1: {"path": "/home/user/library"}},
+            "meta": {1: {"schema_version": 2}},
+        }
+        with tempfile.TemporaryDirectory() as tmp_dir_name:
+            db_path = os.path.join(tmp_dir_name, "TaggerDB.json")
+            with open(db_path, "wb") as db_file:
+                db_file.write(JSONSerializer.dumps(data))
+            runs = [
+                json.loads(
+                    subprocess.run(
+                        [sys.executable, "-c", STARTUP_SCRIPT, db_path],
+                        cwd=settings.BASE_DIR,
+                        env={
+                            **os.environ,
+                            "DJANGO_SETTINGS_MODULE": "Tagger.settings",
+                        },
+                        capture_output=True,
+                        check=True,
+                        text=True,
+                    ).stdout
+                )
+                for _ in range(options["repeat"])
+            ]
+        self.stdout.write(
+            f"{options['mappings']} mappings, {len(tag_ids)} tags, "
+            f"best of {options['repeat']} runs"
+        )
+        self.stdout.write(
+            ", ".join(
+                f"{step} {min(run[step] for run in runs) * 1000:.0f} ms"
+                for step in runs[0]
+            )
+        )
@@ -0,0 +1,150 @@
+import random
+import timeit
+import tracemalloc
+from collections import defaultdict
+
+from django.core.management.base import BaseCommand, CommandError
+
+from pathtagger.db_indexes import BitmapIndex
+
+
+def _build_set_index(mappings):
+    # sets of doc ids by tag id plus the reverse lookup needed for updates, as
+    # kept by the tag index before it switched to bitmaps
+    doc_ids_by_tag_id = defaultdict(set)
+    tag_ids_by_doc_id = {}
+    for doc_id, mapping in mappings.items():
+        tag_ids_by_doc_id[doc_id] = set(mapping["tag_ids"])
+        for tag_id in mapping["tag_ids"]:
+            doc_ids_by_tag_id[tag_id].add(doc_id)
+    return doc_ids_by_tag_id, tag_ids_by_doc_id
+
+
+def _build_bitmap_index(mappings):
+    index = BitmapIndex("tag_ids")
+    for doc_id, mapping in mappings.items():
+        index.add(doc_id, mapping)
+    return index
+
+
+def _measure_build(build, mappings):
+    start = timeit.default_timer()
+    index = build(mappings)
+    duration = timeit.default_timer() - start
+    # tracing slows allocations down, so the size is measured on a second build
+    tracemalloc.start()
+    traced_index = build(mappings)
+    size, _ = tracemalloc.get_traced_memory()
+    del traced_index
+    tracemalloc.stop()
+    return index, duration, size
+
+
+class Command(BaseCommand):
+    help = (
+        "Compares tag membership lookups on synthetic mappings using list scans, "
+        "sets of doc ids and the compressed bitmap tag index."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--mappings", type=int, default=100000)
+        parser.add_argument("--tags", type=int, default=50)
+        parser.add_argument("--repeat", type=int, default=5)
+        parser.add_argument("--seed", type=int, default=0)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options["seed"])
+        tag_ids = list(range(1, options["tags"] + 1))
+        # a few popular tags and a long tail of rare ones
+        weights = [1 / tag_id for tag_id in tag_ids]
+        mappings = {
+            doc_id: {
+                "path": f"/mapping/{doc_id}",
+                "tag_ids": sorted(
+                    set(rng.choices(tag_ids, weights, k=rng.randint(1, 4)))
+                ),
+            }
+            for doc_id in range(1, options["mappings"] + 1)
+        }
+        include, exclude = [1, 2], [3]
+        (set_index, _), set_build, set_size = _measure_build(_build_set_index, mappings)
+        bitmap_index, bitmap_build, bitmap_size = _measure_build(
+            _build_bitmap_index, mappings
+        )
+        self.stdout.write(
+            f"{len(mappings)} mappings, {len(tag_ids)} tags, "
+            f"best of {options['repeat']} runs"
+        )
+        self.stdout.write(
+            f"index build: set {set_build * 1000:.1f} ms ({set_size // 1024} KiB), "
+            f"bitmap {bitmap_build * 1000:.1f} ms ({bitmap_size // 1024} KiB)"
+        )
+        benchmarks = {
+            "get_tag_mappings": {
+                "list": lambda: [
+                    doc_id
+                    for doc_id, mapping in mappings.items()
+                    if include[0] in mapping["tag_ids"]
+                ],
+                "set": lambda: sorted(set_index[include[0]]),
+                "bitmap": lambda: list(bitmap_index.get_doc_ids(include[0])),
+            },
+            "get_filtered_mappings": {
+                "list": lambda: [
+                    doc_id
+                    for doc_id, mapping in mappings.items()
+                    if set(include).issubset(mapping["tag_ids"])
+                    and not set(exclude).intersection(mapping["tag_ids"])
+                ],
+                "set": lambda: sorted(
+                    set.intersection(*(set_index[tag_id] for tag_id in include))
+                    - set.union(*(set_index[tag_id] for tag_id in exclude))
+                ),
+                "bitmap": lambda: list(
+                    bitmap_index.get_doc_ids_with_all(include)
+                    - bitmap_index.get_doc_ids_with_any(exclude)
+                ),
+            },
+            "delete_tags": {
+                "list": lambda: [
+                    doc_id
+                    for doc_id, mapping in mappings.items()
+                    if set(include).intersection(mapping["tag_ids"])
+                ],
+                "set": lambda: sorted(
+                    set.union(*(set_index[tag_id] for tag_id in include))
+                ),
+                "bitmap": lambda: list(bitmap_index.get_doc_ids_with_any(include)),
+            },
+        }
+        for operation, implementations in benchmarks.items():
+            # the timings are only comparable if every implementation finds the
+            # same mappings
+            doc_ids = {
+                implementation: function()
+                for implementation, function in implementations.items()
+            }
+            if any(
+                implementation_doc_ids != doc_ids["list"]
+                for implementation_doc_ids in doc_ids.values()
+            ):
+                raise CommandError(
+                    f"{operation}: implementations found different mappings, "
+                    + ", ".join(
+                        f"{implementation} {len(implementation_doc_ids)}"
+                        for implementation, implementation_doc_ids in doc_ids.items()
+                    )
+                )
+            results = {
+                implementation: min(
+                    timeit.repeat(function, number=1, repeat=options["repeat"])
+                )
+                for implementation, function in implementations.items()
+            }
+            self.stdout.write(
+                f"{operation} ({len(doc_ids['list'])} mappings): "
+                + ", ".join(
+                    f"{implementation} {duration * 1000:.2f} ms"
+                    for implementation, duration in results.items()
+                )
+            )
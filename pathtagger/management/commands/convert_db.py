@@ -0,0 +1,41 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from pathtagger import db_binary_format
+from pathtagger.db_serializers import get_serializer
+from Tagger import params
+
+
+class Command(BaseCommand):
+    help = (
+        "Converts a JSON database into the compact binary format, or a binary "
+        "database back into JSON."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("source_path", help="database file to convert")
+        parser.add_argument("target_path", help="converted database file")
+
+    def handle(self, *args, **options):
+        # pylint: disable=import-outside-toplevel
+        from pathtagger import db_operations
+
+        serializer = get_serializer(params.DB_JSON_SERIALIZER)
+        try:
+            # read through the storage engine, with the journal or shards in use
+            data = db_operations.read_db_data(options["source_path"])
+            if db_binary_format.is_binary_file(options["source_path"]):
+                with open(options["target_path"], "wb") as target_file:
+                    target_file.write(serializer.dumps(data))
+                target_format = "JSON"
+            else:
+                with open(options["target_path"], "wb") as target_file:
+                    db_binary_format.dump(data, target_file)
+                target_format = "binary"
+        except (OSError, ValueError) as exc:
+            raise CommandError(str(exc)) from exc
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Converted {options['source_path']!r} to {target_format} "
+                f"database {options['target_path']!r}"
+            )
+        )
@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from pathtagger.db_serializers import PrettyJSONSerializer
+from Tagger import params
+
+
+class Command(BaseCommand):
+    help = (
+        "Exports the TinyDB database, including its journal and shards, into a "
+        "single human-readable JSON file, e.g. for inspection or backup."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("target_path", help="exported JSON file")
+
+    def handle(self, *args, **options):
+        # pylint: disable=import-outside-toplevel
+        from pathtagger import db_operations
+
+        try:
+            with open(options["target_path"], "wb") as target_file:
+                target_file.write(
+                    PrettyJSONSerializer.dumps(db_operations.get_db_data())
+                )
+        except OSError as exc:
+            raise CommandError(str(exc)) from exc
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Exported {str(params.DB_PATH)!r} to {options['target_path']!r}"
+            )
+        )
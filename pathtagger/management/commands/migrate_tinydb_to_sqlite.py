@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from Tagger import params
+
+
+class Command(BaseCommand):
+    help = (
+        "Copies favorites, tags and mappings from the TinyDB JSON database into "
+        "an empty SQLite database."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--json-path",
+            default=str(params.DB_PATH),
+            help="TinyDB JSON database to migrate (default: DB_PATH)",
+        )
+
+    def handle(self, *args, **options):
+        # pylint: disable=import-outside-toplevel
+        from pathtagger import sqlite_db_operations
+
+        try:
+            sqlite_db_operations.migrate_from_tinydb(options["json_path"])
+        except (OSError, ValueError) as exc:
+            raise CommandError(str(exc)) from exc
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Migrated {options['json_path']!r} to "
+                f"{sqlite_db_operations.DB.path!r}"
+            )
+        )
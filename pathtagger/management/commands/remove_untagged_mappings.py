@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from pathtagger import db_backends
+
+
+class Command(BaseCommand):
+    help = (
+        "Removes all mappings without tags, e.g. ones left behind by older "
+        "versions of Tagger."
+    )
+
+    def handle(self, *args, **options):
+        db_operations = db_backends.get_db_operations()
+        mappings_count = db_operations.get_mappings_count()
+        db_operations.remove_mappings_without_tags()
+        removed_count = mappings_count - db_operations.get_mappings_count()
+        self.stdout.write(
+            self.style.SUCCESS(f"Removed {removed_count} mappings without tags")
+        )
@@ -0,0 +1,898 @@
+import contextlib
+import functools
+import json
+import logging
+import sqlite3
+import threading
+from typing import (
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    NamedTuple,
+    Optional,
+    Tuple,
+    Union,
+)
+
+from tinydb.database import Document
+
+from pathtagger import db_operations, db_query
+from pathtagger.db_utils import (
+    MappingsBatch,
+    classify_doc_ids,
+    get_valid_page,
+    is_valid_hex_color,
+)
+from Tagger import params
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS favorite_paths (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    path TEXT NOT NULL UNIQUE
+);
+CREATE TABLE IF NOT EXISTS tags (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    name TEXT NOT NULL UNIQUE,
+    color TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS mappings (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    path TEXT NOT NULL UNIQUE
+);
+CREATE TABLE IF NOT EXISTS mapping_tags (
+    tag_id INTEGER NOT NULL REFERENCES tags (id) ON DELETE CASCADE,
+    mapping_id INTEGER NOT NULL REFERENCES mappings (id) ON DELETE CASCADE,
+    PRIMARY KEY (tag_id, mapping_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS mapping_tags_mapping_id_tag_id
+    ON mapping_tags (mapping_id, tag_id);
+"""
+
+MAPPING_SELECT = """
+SELECT mappings.id, mappings.path, group_concat(mapping_tags.tag_id)
+FROM mappings LEFT JOIN mapping_tags ON mapping_tags.mapping_id = mappings.id
+"""
+
+
+class SqliteDB:
+    def __init__(self, path):
+        self.path = str(path)
+        self._local = threading.local()
+        self.connection.executescript(SCHEMA)
+
+    @property
+    def connection(self) -> sqlite3.Connection:
+        if (connection := getattr(self._local, "connection", None)) is None:
+            connection = sqlite3.connect(self.path, check_same_thread=False)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA foreign_keys=ON")
+            # sqlite's lower() only folds ASCII letters
+            connection.create_function("py_lower", 1, str.lower, deterministic=True)
+            self._local.connection = connection
+        return connection
+
+    def execute(self, sql: str, parameters=()) -> sqlite3.Cursor:
+        return self.connection.execute(sql, parameters)
+
+    def close(self):
+        if (connection := getattr(self._local, "connection", None)) is not None:
+            connection.close()
+            self._local.connection = None
+
+
+# opened on first use, or on startup by warm_up_db()
+DB: Optional[SqliteDB] = None
+_DB_OPEN_LOCK = threading.Lock()
+
+
+def load_db(path):
+    return SqliteDB(path)
+
+
+def _open_db() -> SqliteDB:
+    global DB  # pylint: disable=global-statement
+    if DB is None:
+        with _DB_OPEN_LOCK:
+            if DB is None:
+                db = load_db(params.DB_SQLITE_PATH)
+                logger.info(
+                    "Loaded database at %r. "
+                    "Found %d tags, %d mappings, and %d favorites.",
+                    params.DB_SQLITE_PATH,
+                    *db.execute(
+                        "SELECT (SELECT COUNT(*) FROM tags), "
+                        "(SELECT COUNT(*) FROM mappings), "
+                        "(SELECT COUNT(*) FROM favorite_paths)"
+                    ).fetchone(),
+                )
+                DB = db
+    return DB
+
+
+def _opened(func):
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        _open_db()
+        return func(*args, **kwargs)
+
+    return wrapper
+
+
+def flush_db():
+    # every operation commits its own transaction
+    logger.debug("Nothing to flush")
+
+
+@_opened
+def warm_up_db():
+    # opening the database is all there is to it, as sqlite keeps its own indexes
+    logger.debug("Warmed up database")
+
+
+@contextlib.contextmanager
+@_opened
+def snapshot():
+    # in WAL mode, all reads of a transaction see the database as it was on the
+    # first one; a write within commits the transaction and ends the snapshot
+    connection = DB.connection
+    if connection.in_transaction:
+        yield
+        return
+    connection.execute("BEGIN")
+    try:
+        yield
+    finally:
+        if connection.in_transaction:
+            connection.commit()
+
+
+def _json_ids(doc_ids: Iterable[int]) -> str:
+    return json.dumps(sorted(doc_ids))
+
+
+def _classify_doc_ids(doc_ids: List[int], table_name: str) -> NamedTuple:
+    valid_doc_ids = [doc_id for doc_id in doc_ids or [] if doc_id]
+    return classify_doc_ids(
+        doc_ids,
+        {
+            row[0]
+            for row in DB.execute(
+                f"SELECT id FROM {table_name} "
+                "WHERE id IN (SELECT value FROM json_each(?))",
+                (_json_ids(valid_doc_ids),),
+            )
+        },
+    )
+
+
+def _log_doc_id_classification(parameter_name: str, classification: NamedTuple):
+    if classification.invalid_doc_ids:
+        logger.warning(
+            "Argument for parameter %r contains invalid ids: %r",
+            parameter_name,
+            classification.invalid_doc_ids,
+        )
+    else:
+        logger.debug("Invalid %s: %r", parameter_name, classification.invalid_doc_ids)
+    if classification.nonexistent_doc_ids:
+        logger.warning(
+            "Argument for parameter %r contains nonexistent ids: %r",
+            parameter_name,
+            classification.nonexistent_doc_ids,
+        )
+    else:
+        logger.debug(
+            "Nonexistent %s: %r", parameter_name, classification.nonexistent_doc_ids
+        )
+
+
+def _favorite_document(row) -> Document:
+    return Document({"path": row[1]}, row[0])
+
+
+def _tag_document(row) -> Document:
+    return Document({"name": row[1], "color": row[2]}, row[0])
+
+
+def _mapping_document(row) -> Document:
+    return Document(
+        {
+            "path": row[1],
+            "tag_ids": sorted(map(int, row[2].split(","))) if row[2] else [],
+        },
+        row[0],
+    )
+
+
+def _select_mappings(where_clause: str = "", parameters=()) -> List[Document]:
+    return [
+        _mapping_document(row)
+        for row in DB.execute(
+            f"{MAPPING_SELECT} {where_clause} GROUP BY mappings.id ORDER BY mappings.id",
+            parameters,
+        )
+    ]
+
+
+def _iter_mappings(
+    conditions: List[str],
+    parameters: list,
+    limit: Optional[int],
+    offset: int,
+    after_mapping_id: Optional[int],
+) -> Iterator[Document]:
+    # the rows are fetched as the iterator is consumed
+    limit, offset = get_valid_page(limit, offset)
+    logger.debug(
+        "Iterating mappings (limit=%r, offset=%r, after_mapping_id=%r)...",
+        limit,
+        offset,
+        after_mapping_id,
+    )
+    if after_mapping_id is not None:
+        conditions = [*conditions, "mappings.id > ?"]
+        parameters = [*parameters, after_mapping_id]
+    where_clause = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+    return map(
+        _mapping_document,
+        DB.execute(
+            f"{MAPPING_SELECT} {where_clause} GROUP BY mappings.id "
+            "ORDER BY mappings.id LIMIT ? OFFSET ?",
+            (*parameters, -1 if limit is None else limit, offset),
+        ),
+    )
+
+
+@_opened
+def get_all_favorites():
+    favorites = [
+        _favorite_document(row)
+        for row in DB.execute("SELECT id, path FROM favorite_paths ORDER BY id")
+    ]
+    logger.debug("Returning %d favorites...", len(favorites))
+    return favorites
+
+
+@_opened
+def get_favorite(db_path_str: str):
+    if not db_path_str:
+        logger.warning("Invalid argument for parameter 'db_path_str': %r", db_path_str)
+        return None
+    logger.debug("DB path string: %r", db_path_str)
+    if row := DB.execute(
+        "SELECT id, path FROM favorite_paths WHERE path = ?", (db_path_str,)
+    ).fetchone():
+        favorite = _favorite_document(row)
+        logger.debug("Returning favorite (doc_id=%d)...", favorite.doc_id)
+        return favorite
+    logger.debug("Returning favorite None...")
+    return None
+
+
+@_opened
+def insert_favorite(db_path_str: str):
+    if not db_path_str:
+        logger.warning("Invalid argument for parameter 'db_path_str': %r", db_path_str)
+        return None
+    logger.debug("DB path string: %r", db_path_str)
+    if get_favorite(db_path_str):
+        logger.info("Favorite (path=%r) already exists", db_path_str)
+        return None
+    with DB.connection:
+        inserted_favorite_id = DB.execute(
+            "INSERT INTO favorite_paths (path) VALUES (?)", (db_path_str,)
+        ).lastrowid
+    logger.info("Inserted new favorite (doc_id=%d)", inserted_favorite_id)
+    return inserted_favorite_id
+
+
+@_opened
+def delete_favorite(db_path_str: str):
+    if not db_path_str:
+        logger.warning("Invalid argument for parameter 'db_path_str': %r", db_path_str)
+    logger.debug("DB path string: %r", db_path_str)
+    with DB.connection:
+        if DB.execute(
+            "DELETE FROM favorite_paths WHERE path = ?", (db_path_str,)
+        ).rowcount:
+            logger.info("Deleted favorite (path=%r)", db_path_str)
+        else:
+            logger.warning("No favorite (path=%r) found", db_path_str)
+
+
+@_opened
+def get_all_tags():
+    tags = [
+        _tag_document(row)
+        for row in DB.execute("SELECT id, name, color FROM tags ORDER BY id")
+    ]
+    logger.debug("Returning %d tags...", len(tags))
+    return tags
+
+
+@_opened
+def get_tag(*, tag_id: int = None, name: str = None):
+    if name == "":  # pylint:disable=compare-to-empty-string
+        logger.warning("Invalid argument for parameter 'name': %r", name)
+        return None
+    if not (tag_id or name):
+        logger.error("Either truthy tag id or truthy tag name is required")
+        return None
+    if tag_id:
+        row = DB.execute(
+            "SELECT id, name, color FROM tags WHERE id = ?", (tag_id,)
+        ).fetchone()
+    else:
+        row = DB.execute(
+            "SELECT id, name, color FROM tags WHERE name = ?", (name,)
+        ).fetchone()
+    if row and name and row[1] != name:
+        row = None
+    if row:
+        tag = _tag_document(row)
+        logger.debug("Returning tag (doc_id=%d)...", tag.doc_id)
+        return tag
+    logger.debug("Returning tag None...")
+    return None
+
+
+@_opened
+def insert_tag(name: str, color: str) -> Optional[int]:
+    if not name:
+        logger.error("Invalid argument for parameter 'name': %r", name)
+        return None
+    logger.debug("Name: %r", name)
+    if not (color and is_valid_hex_color(color)):
+        logger.error("Invalid argument for parameter 'color': %r", color)
+        return None
+    logger.debug("Color: %r", color)
+    if get_tag(name=name):
+        logger.error("Tag (name=%r) already exists", name)
+        return None
+    with DB.connection:
+        inserted_tag_id = DB.execute(
+            "INSERT INTO tags (name, color) VALUES (?, ?)", (name, color)
+        ).lastrowid
+    logger.info("Inserted new tag (doc_id=%d)", inserted_tag_id)
+    return inserted_tag_id
+
+
+@_opened
+def delete_tags(tag_ids: List[int]):
+    classification = _classify_doc_ids(tag_ids, "tags")
+    _log_doc_id_classification("tag_ids", classification)
+    logger.info(
+        "Deleting tags with the following doc_ids: %r...",
+        classification.existing_doc_ids,
+    )
+    with DB.connection:
+        mapping_ids = [
+            mapping_id
+            for (mapping_id,) in DB.execute(
+                "SELECT DISTINCT mapping_id FROM mapping_tags "
+                "WHERE tag_id IN (SELECT value FROM json_each(?))",
+                (_json_ids(classification.existing_doc_ids),),
+            )
+        ]
+        DB.execute(
+            "DELETE FROM tags WHERE id IN (SELECT value FROM json_each(?))",
+            (_json_ids(classification.existing_doc_ids),),
+        )
+        _delete_mappings_without_tags(mapping_ids)
+
+
+@_opened
+def get_tag_mappings(tag_id: int):
+    if not tag_id:
+        logger.warning("Invalid argument for parameter 'tag_id': %r", tag_id)
+    else:
+        logger.debug("Tag id: %r", tag_id)
+    mappings = _select_mappings(
+        "WHERE mappings.id IN "
+        "(SELECT mapping_id FROM mapping_tags WHERE tag_id = ?)",
+        (tag_id,),
+    )
+    logger.debug("Returning %d mappings...", len(mappings))
+    return mappings
+
+
+@_opened
+def iter_tag_mappings(
+    tag_id: int,
+    limit: Optional[int] = None,
+    offset: int = 0,
+    after_mapping_id: Optional[int] = None,
+) -> Iterator[Document]:
+    if not tag_id:
+        logger.warning("Invalid argument for parameter 'tag_id': %r", tag_id)
+    else:
+        logger.debug("Tag id: %r", tag_id)
+    return _iter_mappings(
+        ["mappings.id IN (SELECT mapping_id FROM mapping_tags WHERE tag_id = ?)"],
+        [tag_id],
+        limit,
+        offset,
+        after_mapping_id,
+    )
+
+
+@_opened
+def get_tag_occurrence_counts() -> Dict[int, int]:
+    occurrence_counts = dict(
+        DB.execute(
+            "SELECT tags.id, count(mapping_tags.mapping_id) FROM tags "
+            "LEFT JOIN mapping_tags ON mapping_tags.tag_id = tags.id "
+            "GROUP BY tags.id"
+        )
+    )
+    logger.debug("Returning occurrence counts of %d tags...", len(occurrence_counts))
+    return occurrence_counts
+
+
+@_opened
+def update_tag(tag_id: int, name: str, color: str):
+    if not tag_id:
+        logger.error("Invalid argument for parameter 'tag_id': %r", tag_id)
+        return
+    logger.debug("Tag id: %r", tag_id)
+    if not name:
+        logger.error("Invalid argument for parameter 'name': %r", name)
+        return
+    logger.debug("Name: %r", name)
+    if not color:
+        logger.error("Invalid argument for parameter 'color': %r", color)
+        return
+    logger.debug("Color: %r", color)
+    if not is_valid_hex_color(color):
+        logger.error("Invalid color: %r", color)
+        return
+    if (tag := get_tag(name=name)) and tag.doc_id != tag_id:
+        logger.error("Tag (name=%r) already exists", name)
+        return
+    with DB.connection:
+        if DB.execute(
+            "UPDATE tags SET name = ?, color = ? WHERE id = ?", (name, color, tag_id)
+        ).rowcount:
+            logger.info("Updated tag (doc_id=%r)", tag_id)
+        else:
+            logger.error("Nonexistent tag (doc_id=%r)", tag_id)
+
+
+@_opened
+def get_mapping(*, mapping_id: int = None, db_path_str: str = None):
+    if db_path_str == "":  # pylint:disable=compare-to-empty-string
+        logger.warning("Invalid argument for parameter 'db_path_str': %r", db_path_str)
+        return None
+    if not (mapping_id or db_path_str):
+        logger.error("Either truthy mapping id or truthy mapping path is required")
+        return None
+    if mapping_id:
+        mappings = _select_mappings("WHERE mappings.id = ?", (mapping_id,))
+    else:
+        mappings = _select_mappings("WHERE mappings.path = ?", (db_path_str,))
+    mapping = mappings[0] if mappings else None
+    if mapping and db_path_str and mapping["path"] != db_path_str:
+        mapping = None
+    if mapping:
+        logger.debug("Returning mapping (doc_id=%d)...", mapping.doc_id)
+    else:
+        logger.debug("Returning mapping %r...", mapping)
+    return mapping
+
+
+@_opened
+def remove_tags_from_mappings(tag_ids: List[int], mapping_ids: List[int]):
+    tag_classification = _classify_doc_ids(tag_ids, "tags")
+    _log_doc_id_classification("tag_ids", tag_classification)
+    mapping_classification = _classify_doc_ids(mapping_ids, "mappings")
+    _log_doc_id_classification("mapping_ids", mapping_classification)
+    if mapping_classification.existing_doc_ids:
+        logger.info(
+            "Updating mappings with the following doc_ids: %r...",
+            mapping_classification.existing_doc_ids,
+        )
+        with DB.connection:
+            DB.execute(
+                "DELETE FROM mapping_tags "
+                "WHERE tag_id IN (SELECT value FROM json_each(?)) "
+                "AND mapping_id IN (SELECT value FROM json_each(?))",
+                (
+                    _json_ids(tag_classification.existing_doc_ids),
+                    _json_ids(mapping_classification.existing_doc_ids),
+                ),
+            )
+            _delete_mappings_without_tags(mapping_classification.existing_doc_ids)
+
+
+def _delete_mappings_without_tags(mapping_ids: Iterable[int]):
+    # only the mappings touched by a change are checked rather than the whole table
+    DB.execute(
+        "DELETE FROM mappings WHERE id IN (SELECT value FROM json_each(?)) "
+        "AND NOT EXISTS (SELECT 1 FROM mapping_tags WHERE mapping_id = mappings.id)",
+        (_json_ids(mapping_ids),),
+    )
+
+
+@_opened
+def remove_mappings_without_tags():
+    logger.debug("Removing mappings without tags...")
+    with DB.connection:
+        DB.execute(
+            "DELETE FROM mappings WHERE NOT EXISTS "
+            "(SELECT 1 FROM mapping_tags WHERE mapping_id = mappings.id)"
+        )
+
+
+@_opened
+def get_all_mappings():
+    mappings = _select_mappings()
+    logger.debug("Returning %d mappings...", len(mappings))
+    return mappings
+
+
+@_opened
+def iter_all_mappings(
+    limit: Optional[int] = None,
+    offset: int = 0,
+    after_mapping_id: Optional[int] = None,
+) -> Iterator[Document]:
+    return _iter_mappings([], [], limit, offset, after_mapping_id)
+
+
+@_opened
+def get_mappings_count() -> int:
+    (mappings_count,) = DB.execute("SELECT COUNT(*) FROM mappings").fetchone()
+    logger.debug("Returning mappings count %d...", mappings_count)
+    return mappings_count
+
+
+@_opened
+def insert_mapping(
+    db_path_str: str, tag_ids: Union[List[int], None] = None
+) -> Optional[int]:
+    if not db_path_str:
+        logger.error("Invalid argument for parameter 'db_path_str': %r", db_path_str)
+        return None
+    logger.debug("Db path string: %r", db_path_str)
+    if get_mapping(db_path_str=db_path_str):
+        logger.info("Mapping (path=%r) already exists", db_path_str)
+        return None
+    logger.debug("Tag ids: %r", tag_ids)
+    if tag_ids is not None and not isinstance(tag_ids, list):
+        logger.error("Invalid argument for parameter 'tag_ids': %r", tag_ids)
+        return None
+    tag_classification = _classify_doc_ids(tag_ids, "tags")
+    _log_doc_id_classification("tag_ids", tag_classification)
+    with DB.connection:
+        inserted_mapping_id = DB.execute(
+            "INSERT INTO mappings (path) VALUES (?)", (db_path_str,)
+        ).lastrowid
+        DB.connection.executemany(
+            "INSERT INTO mapping_tags (tag_id, mapping_id) VALUES (?, ?)",
+            [
+                (tag_id, inserted_mapping_id)
+                for tag_id in tag_classification.existing_doc_ids
+            ],
+        )
+    logger.info("Inserted new mapping (doc_id=%d)", inserted_mapping_id)
+    return inserted_mapping_id
+
+
+@_opened
+def delete_mappings(mapping_ids: List[int]):
+    classification = _classify_doc_ids(mapping_ids, "mappings")
+    _log_doc_id_classification("mapping_ids", classification)
+    logger.info(
+        "Deleting mappings with the following doc_ids: %r...",
+        classification.existing_doc_ids,
+    )
+    with DB.connection:
+        DB.execute(
+            "DELETE FROM mappings WHERE id IN (SELECT value FROM json_each(?))",
+            (_json_ids(classification.existing_doc_ids),),
+        )
+
+
+@_opened
+def update_mapping_path(mapping_id: int, db_path_str: str) -> None:
+    if not mapping_id:
+        logger.error("Invalid argument for parameter 'mapping_id': %r", mapping_id)
+        return
+    logger.debug("Mapping id: %r", mapping_id)
+    if not db_path_str:
+        logger.error("Invalid argument for parameter 'db_path_str': %r", db_path_str)
+        return
+    logger.debug("Db path string: %r", db_path_str)
+    if (
+        mapping := get_mapping(db_path_str=db_path_str)
+    ) and mapping.doc_id != mapping_id:
+        logger.error("Mapping (path=%r) already exists", mapping)
+        return
+    with DB.connection:
+        if DB.execute(
+            "UPDATE mappings SET path = ? WHERE id = ?", (db_path_str, mapping_id)
+        ).rowcount:
+            logger.info("Updated mapping (doc_id=%r)", mapping_id)
+        else:
+            logger.error("Nonexistent mapping (doc_id=%r)", mapping_id)
+
+
+@_opened
+def get_filtered_mappings(
+    tag_ids_to_include: List[int],
+    tag_ids_to_exclude: List[int],
+    db_path_str_like: Optional[str] = None,
+    within_db_path_str: Optional[str] = None,
+    query_str: Optional[str] = None,
+):
+    conditions, parameters = _get_filter_conditions(
+        tag_ids_to_include, tag_ids_to_exclude, within_db_path_str, query_str
+    )
+    mappings = _select_mappings(
+        f"WHERE {' AND '.join(conditions)}" if conditions else "", parameters
+    )
+    if db_path_str_like:
+        db_path_str_like_lower = db_path_str_like.lower()
+        mappings = [
+            mapping
+            for mapping in mappings
+            if mapping["path"].lower().find(db_path_str_like_lower) > -1
+        ]
+    logger.debug("Returning %d mappings...", len(mappings))
+    return mappings
+
+
+@_opened
+def iter_filtered_mappings(
+    tag_ids_to_include: List[int],
+    tag_ids_to_exclude: List[int],
+    db_path_str_like: Optional[str] = None,
+    within_db_path_str: Optional[str] = None,
+    query_str: Optional[str] = None,
+    limit: Optional[int] = None,
+    offset: int = 0,
+    after_mapping_id: Optional[int] = None,
+) -> Iterator[Document]:
+    conditions, parameters = _get_filter_conditions(
+        tag_ids_to_include, tag_ids_to_exclude, within_db_path_str, query_str
+    )
+    # the limit and offset apply to the mappings left by all filters
+    if db_path_str_like:
+        conditions.append("instr(py_lower(mappings.path), ?) > 0")
+        parameters.append(db_path_str_like.lower())
+    return _iter_mappings(conditions, parameters, limit, offset, after_mapping_id)
+
+
+def _get_filter_conditions(
+    tag_ids_to_include: List[int],
+    tag_ids_to_exclude: List[int],
+    within_db_path_str: Optional[str],
+    query_str: Optional[str],
+) -> Tuple[List[str], list]:
+    include_classification = _classify_doc_ids(tag_ids_to_include, "tags")
+    _log_doc_id_classification("tag_ids_to_include", include_classification)
+    exclude_classification = _classify_doc_ids(tag_ids_to_exclude, "tags")
+    _log_doc_id_classification("tag_ids_to_exclude", exclude_classification)
+    conditions = []
+    parameters = []
+    if include_classification.existing_doc_ids:
+        conditions.append(
+            "mappings.id IN (SELECT mapping_id FROM mapping_tags "
+            "WHERE tag_id IN (SELECT value FROM json_each(?)) "
+            "GROUP BY mapping_id HAVING count(*) = ?)"
+        )
+        parameters.extend(
+            (
+                _json_ids(include_classification.existing_doc_ids),
+                len(include_classification.existing_doc_ids),
+            )
+        )
+    if exclude_classification.existing_doc_ids:
+        conditions.append(
+            "mappings.id NOT IN (SELECT mapping_id FROM mapping_tags "
+            "WHERE tag_id IN (SELECT value FROM json_each(?)))"
+        )
+        parameters.append(_json_ids(exclude_classification.existing_doc_ids))
+    if within_db_path_str:
+        logger.debug("Within DB path string: %r", within_db_path_str)
+        conditions.append("mappings.path > ? AND mappings.path < ?")
+        parameters.extend(_get_path_prefix_range(within_db_path_str))
+    if query_str:
+        logger.debug("Query string: %r", query_str)
+        query_condition, query_parameters = _get_query_condition(
+            db_query.parse_query(query_str)
+        )
+        # a top-level OR must not take in the other conditions
+        conditions.append(f"({query_condition})")
+        parameters.extend(query_parameters)
+    return conditions, parameters
+
+
+def _get_query_condition(expr) -> Tuple[str, list]:
+    if isinstance(expr, db_query.TagTerm):
+        return (
+            "mappings.id IN (SELECT mapping_id FROM mapping_tags "
+            "JOIN tags ON tags.id = mapping_tags.tag_id WHERE tags.name = ?)",
+            [expr.name],
+        )
+    if isinstance(expr, db_query.PathContainsTerm):
+        return "instr(py_lower(mappings.path), ?) > 0", [expr.value.lower()]
+    if isinstance(expr, db_query.PathUnderTerm):
+        return (
+            "mappings.path > ? AND mappings.path < ?",
+            list(_get_path_prefix_range(expr.value)),
+        )
+    if isinstance(expr, db_query.NotExpr):
+        condition, parameters = _get_query_condition(expr.operand)
+        return f"NOT ({condition})", parameters
+    conditions, parameters = [], []
+    for operand in expr.operands:
+        condition, operand_parameters = _get_query_condition(operand)
+        conditions.append(f"({condition})")
+        parameters.extend(operand_parameters)
+    operator = " AND " if isinstance(expr, db_query.AndExpr) else " OR "
+    return operator.join(conditions), parameters
+
+
+def _get_path_prefix_range(db_path_str: str) -> Tuple[str, str]:
+    # paths under the prefix sort after it and before the prefix with the
+    # trailing "/" replaced by "0", the next character, so the path index can be
+    # used; the prefix itself is the folder stored with a trailing "/"
+    prefix = db_path_str.rstrip("/") + "/"
+    return prefix, prefix[:-1] + "0"
+
+
+@_opened
+def get_mappings_under(db_path_str: str, recursive: bool = True):
+    if not db_path_str:
+        logger.warning("Invalid argument for parameter 'db_path_str': %r", db_path_str)
+        return []
+    logger.debug("DB path string: %r", db_path_str)
+    lower_bound, upper_bound = _get_path_prefix_range(db_path_str)
+    if recursive:
+        mappings = _select_mappings(
+            "WHERE mappings.path > ? AND mappings.path < ?",
+            (lower_bound, upper_bound),
+        )
+    else:
+        # children may be stored with a trailing "/"
+        mappings = _select_mappings(
+            "WHERE mappings.path > ? AND mappings.path < ? "
+            "AND instr(rtrim(substr(mappings.path, ?), '/'), '/') = 0",
+            (lower_bound, upper_bound, len(lower_bound) + 1),
+        )
+    logger.debug("Returning %d mappings...", len(mappings))
+    return mappings
+
+
+@_opened
+def append_tags_to_mappings(tag_ids: List[int], mapping_ids: List[int]):
+    tag_classification = _classify_doc_ids(tag_ids, "tags")
+    _log_doc_id_classification("tag_ids", tag_classification)
+    mapping_classification = _classify_doc_ids(mapping_ids, "mappings")
+    _log_doc_id_classification("mapping_ids", mapping_classification)
+    if mapping_classification.existing_doc_ids:
+        logger.info(
+            "Updating mappings with the following doc_ids: %r...",
+            mapping_classification.existing_doc_ids,
+        )
+        with DB.connection:
+            DB.connection.executemany(
+                "INSERT OR IGNORE INTO mapping_tags (tag_id, mapping_id) "
+                "VALUES (?, ?)",
+                [
+                    (tag_id, mapping_id)
+                    for tag_id in tag_classification.existing_doc_ids
+                    for mapping_id in mapping_classification.existing_doc_ids
+                ],
+            )
+
+
+@contextlib.contextmanager
+def batch():
+    mappings_batch = MappingsBatch()
+    yield mappings_batch
+    commit_batch(mappings_batch)
+
+
+@_opened
+def commit_batch(mappings_batch: MappingsBatch):
+    if not mappings_batch:
+        logger.debug("Nothing to commit")
+        return
+    tag_classification = _classify_doc_ids(mappings_batch.tag_ids, "tags")
+    _log_doc_id_classification("tag_ids", tag_classification)
+    mapping_classification = _classify_doc_ids(mappings_batch.mapping_ids, "mappings")
+    _log_doc_id_classification("mapping_ids", mapping_classification)
+    mappings = _select_mappings(
+        "WHERE mappings.id IN (SELECT value FROM json_each(?)) "
+        "OR mappings.path IN (SELECT value FROM json_each(?))",
+        (
+            _json_ids(mapping_classification.existing_doc_ids),
+            json.dumps(mappings_batch.db_path_strs),
+        ),
+    )
+    changes = mappings_batch.resolve(mappings, tag_classification.existing_doc_ids)
+    logger.info(
+        "Committing batch: updating %d, deleting %d and inserting %d mappings...",
+        len(changes.updated_mappings),
+        len(changes.deleted_mapping_ids),
+        len(changes.inserted_mappings),
+    )
+    inserted_mapping_ids = []
+    with DB.connection:
+        DB.execute(
+            "DELETE FROM mappings WHERE id IN (SELECT value FROM json_each(?))",
+            (_json_ids(changes.deleted_mapping_ids),),
+        )
+        DB.execute(
+            "DELETE FROM mapping_tags "
+            "WHERE mapping_id IN (SELECT value FROM json_each(?))",
+            (_json_ids(changes.updated_mappings),),
+        )
+        for db_path_str in changes.inserted_mappings:
+            inserted_mapping_ids.append(
+                DB.execute(
+                    "INSERT INTO mappings (path) VALUES (?)", (db_path_str,)
+                ).lastrowid
+            )
+        DB.connection.executemany(
+            "INSERT INTO mapping_tags (tag_id, mapping_id) VALUES (?, ?)",
+            [
+                (tag_id, mapping_id)
+                for mapping_id, tag_ids in (
+                    *changes.updated_mappings.items(),
+                    *zip(inserted_mapping_ids, changes.inserted_mappings.values()),
+                )
+                for tag_id in tag_ids
+            ],
+        )
+    mappings_batch.inserted_mapping_ids = inserted_mapping_ids
+
+
+@_opened
+def migrate_from_tinydb(json_path):
+    data = db_operations.read_db_data(json_path)
+    if any(
+        DB.execute(f"SELECT 1 FROM {table_name} LIMIT 1").fetchone()
+        for table_name in ("favorite_paths", "tags", "mappings")
+    ):
+        raise ValueError(f"Database {DB.path!r} is not empty")
+    tags = data.get("tags", {})
+    mappings = data.get("_default", {})
+    with DB.connection:
+        DB.connection.executemany(
+            "INSERT OR IGNORE INTO favorite_paths (id, path) VALUES (?, ?)",
+            [
+                (int(doc_id), favorite["path"])
+                for doc_id, favorite in data.get("favorite_paths", {}).items()
+            ],
+        )
+        DB.connection.executemany(
+            "INSERT OR IGNORE INTO tags (id, name, color) VALUES (?, ?, ?)",
+            [(int(doc_id), tag["name"], tag["color"]) for doc_id, tag in tags.items()],
+        )
+        DB.connection.executemany(
+            "INSERT OR IGNORE INTO mappings (id, path) VALUES (?, ?)",
+            [(int(doc_id), mapping["path"]) for doc_id, mapping in mappings.items()],
+        )
+        DB.connection.executemany(
+            "INSERT OR IGNORE INTO mapping_tags (tag_id, mapping_id) VALUES (?, ?)",
+            [
+                (int(tag_id), int(doc_id))
+                for doc_id, mapping in mappings.items()
+                for tag_id in mapping.get("tag_ids", [])
+                if str(tag_id) in tags
+            ],
+        )
+    logger.info(
+        "Migrated %r to %r. Found %d tags, %d mappings, and %d favorites.",
+        str(json_path),
+        DB.path,
+        len(get_all_tags()),
+        len(get_all_mappings()),
+        len(get_all_favorites()),
+    )
@@ -0,0 +1,139 @@
+import json
+import logging
+import os
+import shutil
+import unittest
+from io import StringIO
+from tempfile import NamedTemporaryFile
+
+from django.apps import apps
+from django.core.management import CommandError, call_command
+from parameterized import parameterized
+
+from pathtagger import db_binary_format, db_operations, urls
+from Tagger import params
+
+
+class TestDbBinaryFormat(unittest.TestCase):
+    def setUp(self):
+        test_db_path_str = (
+            apps.get_app_config(urls.app_name).path + "/test/resources/TaggerDB.json"
+        )
+        with open(test_db_path_str, "rt", encoding="utf-8") as ref_db_file:
+            self.data = json.load(ref_db_file)
+
+    def test_round_trip(self):
+        self.assertEqual(
+            db_binary_format.loads(db_binary_format.dumps(self.data)), self.data
+        )
+
+    @parameterized.expand(
+        [
+            ("empty database", {}),
+            ("empty table", {"_default": {}}),
+            ("empty document", {"_default": {"1": {}}}),
+            ("empty list", {"_default": {"1": {"path": "/foo", "tag_ids": []}}}),
+            ("unicode", {"_default": {"1": {"path": "/čćšđž", "tag_ids": ["ß"]}}}),
+            ("separator in str", {"tags": {"1": {"name": "a\x00b"}}}),
+            ("non str values", {"t": {"1": {"a": 1, "b": None, "c": [1, {"d": 2}]}}}),
+            ("many lists", {"t": {"1": {"a": ["x"], "b": [], "c": ["y", "x"]}}}),
+            ("uint list", {"_default": {"1": {"path": "/foo", "tag_ids": [1, 2]}}}),
+            (
+                "mixed lists",
+                {"t": {"1": {"a": [3], "b": ["x"], "c": [0, 2**32 - 1], "d": []}}},
+            ),
+            ("non uint list", {"t": {"1": {"a": [-1], "b": [2**32], "c": [True]}}}),
+            (
+                "mixed shapes",
+                {"t": {"1": {"a": "x"}, "2": {"a": ["x"]}, "3": {"a": 1, "b": "y"}}},
+            ),
+        ]
+    )
+    def test_round_trip_values(self, _, data):
+        self.assertEqual(db_binary_format.loads(db_binary_format.dumps(data)), data)
+
+    def test_dictionary_encoding(self):
+        data = {"_default": {str(i): {"tag_ids": ["1", "2"]} for i in range(1, 101)}}
+        self.assertLess(
+            len(db_binary_format.dumps(data)), len(json.dumps(data, indent=None))
+        )
+
+    def test_decode_record(self):
+        buffer = db_binary_format.dumps(self.data)
+        table_reader = next(
+            table_reader
+            for table_reader in db_binary_format.iter_tables(buffer)
+            if table_reader.name == "_default"
+        )
+        for doc_id, offset in table_reader.iter_record_offsets():
+            with self.subTest(doc_id):
+                self.assertEqual(
+                    table_reader.decode_record(offset),
+                    (doc_id, self.data["_default"][str(doc_id)]),
+                )
+
+    @parameterized.expand(
+        [
+            ("empty", b""),
+            ("bad magic", b"JSON\x01\x00\x00\x00\x00"),
+            ("bad version", b"TGDB\x03\x00\x00\x00\x00"),
+        ]
+    )
+    def test_loads_invalid_header(self, _, buffer):
+        with self.assertRaises(db_binary_format.BinaryFormatError):
+            db_binary_format.loads(buffer)
+
+    def test_loads_truncated(self):
+        buffer = db_binary_format.dumps(self.data)
+        with self.assertRaises(db_binary_format.BinaryFormatError):
+            db_binary_format.loads(buffer[:-10])
+
+
+class TestConvertDbCommand(unittest.TestCase):
+    def setUp(self):
+        logging.disable(logging.CRITICAL)
+        self.test_db_path_str = (
+            apps.get_app_config(urls.app_name).path + "/test/resources/TaggerDB.json"
+        )
+        self.tmp_file_names = []
+        for _ in range(2):
+            with NamedTemporaryFile(delete=False) as tmp_file:
+                self.tmp_file_names.append(tmp_file.name)
+
+    def tearDown(self):
+        for tmp_file_name in self.tmp_file_names:
+            os.remove(tmp_file_name)
+        logging.disable(logging.NOTSET)
+
+    def test_convert_db(self):
+        binary_path, json_path = self.tmp_file_names
+        call_command(
+            "convert_db", self.test_db_path_str, binary_path, stdout=StringIO()
+        )
+        self.assertTrue(db_binary_format.is_binary_file(binary_path))
+        call_command("convert_db", binary_path, json_path, stdout=StringIO())
+        with open(self.test_db_path_str, "rt", encoding="utf-8") as ref_db_file:
+            with open(json_path, "rt", encoding="utf-8") as json_file:
+                self.assertEqual(json.load(json_file), json.load(ref_db_file))
+
+    def test_convert_db_journal_source(self):
+        journal_path, binary_path = self.tmp_file_names
+        shutil.copyfile(self.test_db_path_str, journal_path)
+        db_storage_prev = params.DB_STORAGE
+        params.DB_STORAGE = "journal"
+        self.addCleanup(setattr, params, "DB_STORAGE", db_storage_prev)
+        self.addCleanup(os.remove, journal_path + ".journal")
+        db_operations.DB = db_operations.load_db(journal_path)
+        db_operations.insert_tag("Foo", "#000000")
+        call_command("convert_db", journal_path, binary_path, stdout=StringIO())
+        with open(binary_path, "rb") as binary_file:
+            data = db_binary_format.load(binary_file)
+        self.assertEqual(data["tags"]["4"], {"name": "Foo", "color": "#000000"})
+        self.assertEqual(data, db_operations.get_db_data())
+
+    def test_convert_db_invalid_source(self):
+        invalid_path, target_path = self.tmp_file_names
+        with open(invalid_path, "wt", encoding="utf-8") as invalid_file:
+            invalid_file.write("{")
+        with self.assertRaises(CommandError):
+            call_command("convert_db", invalid_path, target_path, stdout=StringIO())
@@ -0,0 +1,125 @@
+import random
+import unittest
+from io import StringIO
+
+from django.core.management import call_command
+from parameterized import parameterized
+
+from pathtagger import db_bitmaps
+from pathtagger.db_bitmaps import ArrayContainer, BitsetContainer, RoaringBitmap
+
+SPARSE_VALUES = {0, 3, 65535, 65536, 70000, 2**32 - 1}
+DENSE_VALUES = set(range(10000, 20000)) | set(range(65536, 65536 + 5000))
+
+
+class TestRoaringBitmap(unittest.TestCase):
+    def setUp(self):
+        random.seed(0)
+
+    @parameterized.expand(
+        [
+            ("empty", set()),
+            ("sparse", SPARSE_VALUES),
+            ("dense", DENSE_VALUES),
+            ("mixed", SPARSE_VALUES | DENSE_VALUES),
+        ]
+    )
+    def test_construct(self, _, values):
+        bitmap = RoaringBitmap(values)
+        self.assertEqual(list(bitmap), sorted(values))
+        self.assertEqual(len(bitmap), len(values))
+        self.assertEqual(bool(bitmap), bool(values))
+        self.assertTrue(all(value in bitmap for value in values))
+        self.assertFalse(any(value in bitmap for value in (1, 9999, 2**20, -1, "1")))
+
+    def test_container_types(self):
+        bitmap = RoaringBitmap(SPARSE_VALUES | DENSE_VALUES)
+        self.assertIsInstance(bitmap._containers[0], BitsetContainer)
+        self.assertIsInstance(bitmap._containers[1], BitsetContainer)
+        self.assertIsInstance(bitmap._containers[2**16 - 1], ArrayContainer)
+
+    def test_add_and_discard_convert_containers(self):
+        bitmap = RoaringBitmap()
+        for value in range(db_bitmaps.ARRAY_CONTAINER_MAX_SIZE + 1):
+            bitmap.add(value)
+        bitmap.add(0)
+        self.assertIsInstance(bitmap._containers[0], BitsetContainer)
+        self.assertEqual(len(bitmap), db_bitmaps.ARRAY_CONTAINER_MAX_SIZE + 1)
+        bitmap.discard(0)
+        bitmap.discard(0)
+        self.assertIsInstance(bitmap._containers[0], ArrayContainer)
+        self.assertEqual(
+            list(bitmap), list(range(1, db_bitmaps.ARRAY_CONTAINER_MAX_SIZE + 1))
+        )
+        for value in range(1, db_bitmaps.ARRAY_CONTAINER_MAX_SIZE + 1):
+            bitmap.discard(value)
+        self.assertFalse(bitmap)
+        self.assertEqual(bitmap._containers, {})
+
+    @parameterized.expand(
+        [
+            ("sparse and sparse", 100, 100),
+            ("sparse and dense", 100, 20000),
+            ("dense and dense", 20000, 30000),
+        ]
+    )
+    def test_set_operations(self, _, size, other_size):
+        values = set(random.sample(range(200000), size))
+        other_values = set(random.sample(range(200000), other_size))
+        bitmap, other_bitmap = RoaringBitmap(values), RoaringBitmap(other_values)
+        for act_result, exp_result in (
+            (bitmap & other_bitmap, values & other_values),
+            (other_bitmap & bitmap, values & other_values),
+            (bitmap | other_bitmap, values | other_values),
+            (bitmap - other_bitmap, values - other_values),
+            (other_bitmap - bitmap, other_values - values),
+        ):
+            self.assertEqual(list(act_result), sorted(exp_result))
+            self.assertEqual(len(act_result), len(exp_result))
+        self.assertEqual(list(bitmap), sorted(values))
+
+    def test_copy(self):
+        bitmap = RoaringBitmap(DENSE_VALUES)
+        bitmap_copy = bitmap.copy()
+        bitmap_copy.discard(10000)
+        self.assertEqual(bitmap, RoaringBitmap(DENSE_VALUES))
+        self.assertNotEqual(bitmap, bitmap_copy)
+
+    @parameterized.expand(
+        [
+            ("none", [], set()),
+            ("one", [{1, 2}], {1, 2}),
+            ("many", [{1, 2, 3}, {2, 3}, {3, 4}], {3}),
+        ]
+    )
+    def test_intersection(self, _, values_list, exp_values):
+        bitmaps = [db_bitmaps.Bitmap(values) for values in values_list]
+        result = db_bitmaps.intersection(bitmaps)
+        self.assertEqual(set(result), exp_values)
+        if bitmaps:
+            result.add(100)
+            self.assertNotIn(100, bitmaps[0])
+
+    @parameterized.expand(
+        [
+            ("none", [], set()),
+            ("one", [{1, 2}], {1, 2}),
+            ("many", [{1}, {2}, {70000}], {1, 2, 70000}),
+        ]
+    )
+    def test_union(self, _, values_list, exp_values):
+        self.assertEqual(
+            set(db_bitmaps.union(db_bitmaps.Bitmap(values) for values in values_list)),
+            exp_values,
+        )
+
+
+class TestBenchmarkTagIndexCommand(unittest.TestCase):
+    def test_benchmark_tag_index(self):
+        stdout = StringIO()
+        call_command(
+            "benchmark_tag_index", mappings=200, tags=5, repeat=1, stdout=stdout
+        )
+        self.assertIn("get_filtered_mappings", stdout.getvalue())
+        # the implementations are checked to find the same mappings
+        self.assertRegex(stdout.getvalue(), r"get_tag_mappings \([1-9]\d* mappings\)")
@@ -0,0 +1,457 @@
+import logging
+import os
+import unittest
+from io import StringIO
+from tempfile import NamedTemporaryFile
+from unittest import mock
+
+from django.apps import apps
+from django.core.management import call_command
+from parameterized import parameterized
+
+from pathtagger import db_indexes, db_operations, urls
+from pathtagger.db_bitmaps import Bitmap
+from Tagger import params
+
+
+def _get_index_state(index) -> dict:
+    # locks only guard lazy builds and do not compare equal
+    return {
+        name: value for name, value in vars(index).items() if not name.endswith("_lock")
+    }
+
+
+class TestBitmapIndex(unittest.TestCase):
+    def setUp(self):
+        self.index = db_indexes.BitmapIndex("tag_ids")
+        self.index.add(1, {"tag_ids": [1]})
+        self.index.add(2, {"tag_ids": [1, 2]})
+        self.index.add(3, {"tag_ids": []})
+
+    def test_add(self):
+        self.assertEqual(set(self.index.doc_ids), {1, 2, 3})
+        self.assertEqual(set(self.index.get_doc_ids(1)), {1, 2})
+        self.assertEqual(set(self.index.get_doc_ids(2)), {2})
+        self.assertEqual(set(self.index.get_doc_ids(3)), set())
+
+    def test_discard(self):
+        self.index.discard(2)
+        self.index.discard(4)
+        self.assertEqual(set(self.index.doc_ids), {1, 3})
+        self.assertEqual(set(self.index.get_doc_ids(1)), {1})
+        self.assertEqual(set(self.index.get_doc_ids(2)), set())
+
+    def test_clear(self):
+        self.index.clear()
+        self.assertEqual(set(self.index.doc_ids), set())
+        self.assertEqual(set(self.index.get_doc_ids(1)), set())
+
+    def test_get_count(self):
+        self.assertEqual(
+            [self.index.get_count(value) for value in (1, 2, 3)], [2, 1, 0]
+        )
+
+    def test_intersect_and_subtract(self):
+        doc_ids = Bitmap({1, 2, 3})
+        self.assertEqual(set(self.index.intersect(doc_ids, 2)), {2})
+        self.assertEqual(set(self.index.intersect(doc_ids, 3)), set())
+        self.assertEqual(set(self.index.subtract(doc_ids, 1)), {3})
+        self.assertEqual(set(self.index.subtract(doc_ids, 3)), {1, 2, 3})
+        self.assertEqual(set(doc_ids), {1, 2, 3})
+        self.assertEqual(set(self.index.get_doc_ids(1)), {1, 2})
+
+    def test_get_doc_ids_returns_copy(self):
+        self.index.get_doc_ids(1).discard(1)
+        self.assertEqual(set(self.index.get_doc_ids(1)), {1, 2})
+
+    @parameterized.expand(
+        [
+            ("no values", [], {1, 2, 3}),
+            ("single value", [1], {1, 2}),
+            ("many values", [1, 2], {2}),
+            ("unknown value", [1, 3], set()),
+        ]
+    )
+    def test_get_doc_ids_with_all(self, _, values, exp_doc_ids):
+        self.assertEqual(set(self.index.get_doc_ids_with_all(values)), exp_doc_ids)
+
+    @parameterized.expand(
+        [
+            ("no values", [], set()),
+            ("single value", [2], {2}),
+            ("many values", [1, 2], {1, 2}),
+            ("unknown value", [3], set()),
+        ]
+    )
+    def test_get_doc_ids_with_any(self, _, values, exp_doc_ids):
+        self.assertEqual(set(self.index.get_doc_ids_with_any(values)), exp_doc_ids)
+
+    def test_get_doc_ids_with_none(self):
+        self.assertEqual(set(self.index.get_doc_ids_with_none()), {3})
+        self.index.discard(3)
+        self.index.discard(2)
+        self.index.add(2, {"tag_ids": []})
+        self.assertEqual(set(self.index.get_doc_ids_with_none()), {2})
+
+
+class TestUniqueIndex(unittest.TestCase):
+    def setUp(self):
+        logging.disable(logging.CRITICAL)
+        self.index = db_indexes.UniqueIndex("path")
+        self.index.add(1, {"path": "/foo"})
+        self.index.add(2, {"path": "/bar"})
+
+    def tearDown(self):
+        logging.disable(logging.NOTSET)
+
+    def test_add(self):
+        self.assertEqual(self.index.doc_ids, {1, 2})
+        self.assertEqual(self.index.get_doc_id("/foo"), 1)
+        self.assertEqual(self.index.get_doc_id("/bar"), 2)
+        self.assertIsNone(self.index.get_doc_id("/baz"))
+
+    def test_add_duplicate(self):
+        self.index.add(3, {"path": "/foo"})
+        self.assertEqual(self.index.get_doc_id("/foo"), 1)
+        self.assertEqual(self.index.doc_ids, {1, 2})
+
+    def test_add_missing_field(self):
+        self.index.add(3, {})
+        self.assertEqual(self.index.doc_ids, {1, 2})
+
+    def test_discard(self):
+        self.index.discard(1)
+        self.index.discard(4)
+        self.assertEqual(self.index.doc_ids, {2})
+        self.assertIsNone(self.index.get_doc_id("/foo"))
+
+    def test_clear(self):
+        self.index.clear()
+        self.assertEqual(self.index.doc_ids, set())
+        self.assertIsNone(self.index.get_doc_id("/bar"))
+
+
+class TestPathIndex(unittest.TestCase):
+    def setUp(self):
+        logging.disable(logging.CRITICAL)
+        self.index = db_indexes.PathIndex("path")
+        for doc_id, path in enumerate(
+            ("/foo", "/foo/bar", "/foo/bar/baz", "/foo/qux", "/quux"), 1
+        ):
+            self.index.add(doc_id, {"path": path})
+
+    def tearDown(self):
+        logging.disable(logging.NOTSET)
+
+    @parameterized.expand(
+        [
+            ("root, recursive", "/", True, {1, 2, 3, 4, 5}),
+            ("root, nonrecursive", "/", False, {1, 5}),
+            ("folder, recursive", "/foo", True, {2, 3, 4}),
+            ("folder, nonrecursive", "/foo", False, {2, 4}),
+            ("trailing slash", "/foo/", False, {2, 4}),
+            ("leaf", "/foo/bar/baz", True, set()),
+            ("partial component", "/fo", True, set()),
+            ("nonexistent", "/foo/baz", True, set()),
+        ]
+    )
+    def test_get_doc_ids_under(self, _, value, recursive, exp_doc_ids):
+        self.assertEqual(self.index.get_doc_ids_under(value, recursive), exp_doc_ids)
+
+    def test_add_duplicate(self):
+        self.index.add(6, {"path": "/foo/bar"})
+        self.assertEqual(self.index.get_doc_ids_under("/foo", False), {2, 4})
+
+    def test_discard(self):
+        self.index.discard(3)
+        self.index.discard(2)
+        self.index.discard(7)
+        self.assertEqual(self.index.get_doc_ids_under("/foo"), {4})
+        self.assertEqual(
+            self.index._trie,
+            {"": {"foo": {None: 1, "qux": {None: 4}}, "quux": {None: 5}}},
+        )
+
+    def test_trailing_slash(self):
+        self.index.add(6, {"path": "/foo/bar/"})
+        self.assertEqual(self.index.get_doc_ids_under("/foo", False), {2, 4, 6})
+        self.assertEqual(self.index.get_doc_ids_under("/"), {1, 2, 3, 4, 5, 6})
+        self.index.discard(2)
+        self.assertEqual(self.index.get_doc_ids_under("/foo", False), {4, 6})
+        self.index.discard(3)
+        self.index.discard(6)
+        self.assertEqual(self.index.get_doc_ids_under("/foo"), {4})
+        self.assertEqual(
+            self.index._trie,
+            {"": {"foo": {None: 1, "qux": {None: 4}}, "quux": {None: 5}}},
+        )
+
+    def test_discard_keeps_descendants(self):
+        self.index.discard(1)
+        self.assertEqual(self.index.get_doc_ids_under("/", False), {5})
+        self.assertEqual(self.index.get_doc_ids_under("/foo"), {2, 3, 4})
+
+    def test_get_candidate_doc_ids_like(self):
+        self.assertEqual(set(self.index.get_candidate_doc_ids_like("BAZ")), {3})
+        self.index.discard(3)
+        self.index.add(6, {"path": "/quux/baz2"})
+        self.assertEqual(set(self.index.get_candidate_doc_ids_like("BAZ")), {6})
+        self.index.clear()
+        self.assertIsNone(self.index._trigram_index)
+
+    def test_clear(self):
+        self.index.clear()
+        self.assertEqual(self.index.get_doc_ids_under("/"), set())
+        self.assertEqual(self.index._trie, {})
+
+
+class TestPathTrigramIndex(unittest.TestCase):
+    def setUp(self):
+        logging.disable(logging.CRITICAL)
+        self.values = {
+            doc_id: f"/data/Folder{doc_id % 4}/File{doc_id}.TXT"
+            for doc_id in range(1, 41)
+        }
+        self.values[41] = "/data/Über/Straße/file41.txt"
+        self.values[42] = "/data/a/a/a"
+        self.index = db_indexes.PathTrigramIndex.build(self.values)
+
+    def tearDown(self):
+        logging.disable(logging.NOTSET)
+
+    def _get_matching_doc_ids(self, value):
+        return {
+            doc_id
+            for doc_id, path in self.values.items()
+            if path.lower().find(value.lower()) > -1
+        }
+
+    @parameterized.expand(
+        [
+            ("unique component", "file12.", True),
+            ("prefix of components", "FILE4", True),
+            ("case insensitive", "file41.TXT", True),
+            ("non-ascii", "STRASSE", True),
+            ("non-ascii lowercase", "über", True),
+            ("short", "ü", True),
+            ("no match", "foo", True),
+            ("across components", "folder1/file1", False),
+            ("across components, no match", "folder1/file2", False),
+        ]
+    )
+    def test_get_candidate_doc_ids(self, _, value, exp_exact):
+        doc_ids = self.index.get_candidate_doc_ids(value)
+        exp_doc_ids = self._get_matching_doc_ids(value)
+        self.assertIsNotNone(doc_ids)
+        if exp_exact:
+            self.assertEqual(set(doc_ids), exp_doc_ids)
+        else:
+            self.assertTrue(exp_doc_ids.issubset(doc_ids))
+
+    @parameterized.expand(
+        [
+            ("no component", "/"),
+            ("most paths", ".txt"),
+            ("short, most paths", "a/a/a"),
+        ]
+    )
+    def test_get_candidate_doc_ids_no_candidates(self, _, value):
+        self.assertIsNone(self.index.get_candidate_doc_ids(value))
+
+    def test_add_and_discard(self):
+        index = db_indexes.PathTrigramIndex()
+        for doc_id, value in self.values.items():
+            index.add(doc_id, value)
+        for doc_id in (3, 7, 41, 42):
+            index.discard(doc_id, self.values.pop(doc_id))
+        exp_index = db_indexes.PathTrigramIndex.build(self.values)
+        for value in ("file3.", "folder3", "straße", "a", "txt", "/data/"):
+            with self.subTest(value=value):
+                self.assertEqual(
+                    index.get_candidate_doc_ids(value),
+                    exp_index.get_candidate_doc_ids(value),
+                )
+        self.assertEqual(set(index._component_ids), set(exp_index._component_ids))
+        self.assertEqual(
+            index._component_ids_by_trigram.keys(),
+            exp_index._component_ids_by_trigram.keys(),
+        )
+
+
+class TestIndexedTable(unittest.TestCase):
+    def setUp(self):
+        logging.disable(logging.CRITICAL)
+        test_db_path_str = (
+            apps.get_app_config(urls.app_name).path + "/test/resources/TaggerDB.json"
+        )
+        with NamedTemporaryFile(mode="wt", delete=False) as db_tmp_file:
+            with open(test_db_path_str, "rt", encoding="utf-8") as ref_db_file:
+                self.db_tmp_file_name = db_tmp_file.name
+                db_tmp_file.write(ref_db_file.read())
+        db_operations.DB = db_operations.load_db(self.db_tmp_file_name)
+        params.DB_PATH = self.db_tmp_file_name
+        params.BASE_PATH = None
+
+    def tearDown(self):
+        os.remove(self.db_tmp_file_name)
+        logging.disable(logging.NOTSET)
+
+    def assertIndexesConsistent(self):  # pylint: disable=invalid-name
+        exp_db = db_operations.load_db(self.db_tmp_file_name)
+        for table_name in db_indexes.TABLE_INDEXES:
+            with self.subTest(table_name):
+                exp_table = exp_db.table(table_name)
+                act_table = db_operations.DB.table(table_name)
+                fields = [field for field, _ in db_indexes.TABLE_INDEXES[table_name]]
+                self.assertEqual(
+                    {
+                        field: _get_index_state(act_table.index(field))
+                        for field in fields
+                    },
+                    {
+                        field: _get_index_state(exp_table.index(field))
+                        for field in fields
+                    },
+                )
+
+    def test_index_built_on_load(self):
+        self.assertEqual(
+            set(db_operations.DB.index("tag_ids").get_doc_ids(1)), {1, 4, 5}
+        )
+        self.assertIndexesConsistent()
+
+    def test_path_index_built_on_load(self):
+        self.assertEqual(db_operations.DB.index("path").get_doc_id("/media"), 5)
+        self.assertIsNone(db_operations.DB.index("path").get_doc_id("/foo"))
+
+    def test_tag_name_index_built_on_load(self):
+        tags = db_operations.DB.table("tags")
+        self.assertEqual(tags.index("name").get_doc_id("Videos"), 2)
+        self.assertIsNone(tags.index("name").get_doc_id("videos"))
+
+    def test_favorite_path_index_built_on_load(self):
+        favorites = db_operations.DB.table("favorite_paths")
+        self.assertEqual(favorites.index("path").get_doc_id("/"), 2)
+        self.assertIsNone(favorites.index("path").get_doc_id("/foo"))
+
+    def test_get_multiple(self):
+        self.assertEqual(
+            [mapping.doc_id for mapping in db_operations.DB.get_multiple({5, 1, 11})],
+            [1, 5],
+        )
+
+    def test_get_by_doc_id_without_reading_table(self):
+        db_operations.DB.insert({"path": "/foo", "tag_ids": [1]})
+        with mock.patch.object(db_operations.DB, "_read", side_effect=AssertionError):
+            self.assertEqual(
+                [
+                    mapping.doc_id
+                    for mapping in db_operations.DB.get_multiple({7, 5, 11})
+                ],
+                [5, 7],
+            )
+            self.assertEqual(db_operations.DB.get(doc_id=7)["path"], "/foo")
+            self.assertIsNone(db_operations.DB.get(doc_id=11))
+            self.assertEqual(db_operations.DB.get_doc_ids(), {1, 2, 3, 4, 5, 6, 7})
+            self.assertEqual(
+                db_operations.get_mapping(mapping_id=1)["path"], "/home/dino/Music"
+            )
+
+    def test_insert_mapping(self):
+        db_operations.insert_mapping("/foo", [1, 3])
+        self.assertIndexesConsistent()
+
+    def test_append_tags_to_mappings(self):
+        db_operations.append_tags_to_mappings([1, 2], [1, 3, 6])
+        self.assertIndexesConsistent()
+
+    def test_remove_tags_from_mappings(self):
+        db_operations.remove_tags_from_mappings([1, 3], [1, 2, 4, 5, 6])
+        self.assertIndexesConsistent()
+
+    @parameterized.expand(
+        [
+            (
+                "append tags",
+                lambda: db_operations.append_tags_to_mappings([2], [1, 6]),
+            ),
+            (
+                "remove tags",
+                lambda: db_operations.remove_tags_from_mappings([1], [4, 5]),
+            ),
+            ("update", lambda: db_operations.DB.update({"tag_ids": [3]}, doc_ids=[1])),
+        ]
+    )
+    def test_tag_change_keeps_path_indexed(self, _, change):
+        path_index = db_operations.DB.index("path")
+        with (
+            mock.patch.object(path_index, "discard", side_effect=AssertionError),
+            mock.patch.object(path_index, "add", side_effect=AssertionError),
+        ):
+            change()
+        self.assertIndexesConsistent()
+
+    def test_delete_tags(self):
+        db_operations.delete_tags([1, 2])
+        self.assertIndexesConsistent()
+
+    def test_insert_tag(self):
+        tag_id = db_operations.insert_tag("Foo", "#000000")
+        self.assertIndexesConsistent()
+        self.assertEqual(
+            db_operations.DB.table("tags").index("name").get_doc_id("Foo"), tag_id
+        )
+
+    def test_update_tag(self):
+        db_operations.update_tag(1, "Foo", "#000000")
+        self.assertIndexesConsistent()
+        self.assertEqual(
+            db_operations.DB.table("tags").index("name").get_doc_id("Foo"), 1
+        )
+        self.assertIsNone(
+            db_operations.DB.table("tags").index("name").get_doc_id("Music")
+        )
+
+    def test_insert_favorite(self):
+        favorite_id = db_operations.insert_favorite("/foo")
+        self.assertIndexesConsistent()
+        self.assertEqual(
+            db_operations.DB.table("favorite_paths").index("path").get_doc_id("/foo"),
+            favorite_id,
+        )
+
+    def test_delete_favorite(self):
+        db_operations.delete_favorite("/")
+        self.assertIndexesConsistent()
+        self.assertIsNone(
+            db_operations.DB.table("favorite_paths").index("path").get_doc_id("/")
+        )
+
+    def test_delete_mappings(self):
+        db_operations.delete_mappings([2, 4])
+        self.assertIndexesConsistent()
+
+    def test_update_mapping_path(self):
+        db_operations.update_mapping_path(1, "/foo")
+        self.assertIndexesConsistent()
+        self.assertEqual(db_operations.DB.index("path").get_doc_id("/foo"), 1)
+        self.assertIsNone(db_operations.DB.index("path").get_doc_id("/home/dino/Music"))
+
+    def test_update(self):
+        db_operations.DB.update({"tag_ids": [3]}, doc_ids=[1])
+        self.assertIndexesConsistent()
+
+    def test_purge(self):
+        db_operations.DB.purge()
+        self.assertEqual(set(db_operations.DB.index("tag_ids").doc_ids), set())
+        self.assertEqual(db_operations.DB.index("path").doc_ids, set())
+        db_operations.DB.purge_tables()
+        self.assertEqual(set(db_operations.DB.index("tag_ids").doc_ids), set())
+        self.assertEqual(db_operations.DB.index("path").doc_ids, set())
+
+
+class TestBenchmarkPathSearchCommand(unittest.TestCase):
+    def test_benchmark_path_search(self):
+        stdout = StringIO()
+        call_command("benchmark_path_search", mappings=200, repeat=1, stdout=stdout)
+        self.assertIn("trigram index build", stdout.getvalue())
@@ -0,0 +1,381 @@
+import json
+import logging
+import multiprocessing
+import os
+import random
+import threading
+import unittest.mock
+from tempfile import NamedTemporaryFile
+
+from django.apps import apps
+from parameterized import parameterized
+
+from pathtagger import db_binary_format, db_operations, urls
+from pathtagger.db_locks import FileLock, ReadWriteLock, fcntl
+from Tagger import params
+
+
+class TestReadWriteLock(unittest.TestCase):
+    def setUp(self):
+        self.lock = ReadWriteLock()
+
+    def _run_in_thread(self, func) -> threading.Thread:
+        thread = threading.Thread(target=func, daemon=True)
+        thread.start()
+        return thread
+
+    def test_concurrent_readers(self):
+        barrier = threading.Barrier(3, timeout=5)
+
+        def read():
+            with self.lock.read_locked():
+                barrier.wait()
+
+        threads = [self._run_in_thread(read) for _ in range(2)]
+        # every reader must be inside the lock at the same time to pass the barrier
+        barrier.wait()
+        for thread in threads:
+            thread.join(5)
+            self.assertFalse(thread.is_alive())
+
+    def test_writer_excludes_readers(self):
+        events = []
+        writing = threading.Event()
+
+        def read():
+            writing.wait(5)
+            with self.lock.read_locked():
+                events.append("read")
+
+        with self.lock.write_locked():
+            thread = self._run_in_thread(read)
+            writing.set()
+            thread.join(0.2)
+            self.assertTrue(thread.is_alive())
+            events.append("write")
+        thread.join(5)
+        self.assertEqual(events, ["write", "read"])
+
+    def test_waiting_writer_goes_before_new_readers(self):
+        events = []
+        writer_waiting = threading.Event()
+
+        def write():
+            writer_waiting.set()
+            with self.lock.write_locked():
+                events.append("write")
+
+        def read():
+            with self.lock.read_locked():
+                events.append("read")
+
+        with self.lock.read_locked():
+            writer = self._run_in_thread(write)
+            writer_waiting.wait(5)
+            writer.join(0.2)
+            reader = self._run_in_thread(read)
+            reader.join(0.2)
+            self.assertEqual(events, [])
+        writer.join(5)
+        reader.join(5)
+        self.assertEqual(events, ["write", "read"])
+
+    def test_reentrant(self):
+        with self.lock.write_locked():
+            with self.lock.write_locked():
+                with self.lock.read_locked():
+                    pass
+            self.assertEqual(self.lock._writer, threading.get_ident())
+        with self.lock.read_locked():
+            with self.lock.read_locked():
+                pass
+            self.assertEqual(self.lock._readers_count, 1)
+        self.assertIsNone(self.lock._writer)
+        self.assertEqual(self.lock._readers_count, 0)
+
+    def test_upgrade(self):
+        with self.lock.read_locked():
+            with self.assertRaises(RuntimeError):
+                self.lock.acquire_write()
+        with self.lock.write_locked():
+            pass
+
+    def test_release_unacquired(self):
+        with self.assertRaises(RuntimeError):
+            self.lock.release_read()
+        with self.assertRaises(RuntimeError):
+            self.lock.release_write()
+
+    def test_decorator(self):
+        @self.lock.read_locked()
+        def read():
+            return self.lock._readers_count
+
+        self.assertEqual(read(), 1)
+        self.assertEqual(read(), 1)
+        self.assertEqual(self.lock._readers_count, 0)
+
+
+class TestDbOperationsStress(unittest.TestCase):
+    THREADS_COUNT = 8
+    OPERATIONS_COUNT = 150
+
+    def setUp(self):
+        logging.disable(logging.CRITICAL)
+        test_db_path_str = (
+            apps.get_app_config(urls.app_name).path + "/test/resources/TaggerDB.json"
+        )
+        with NamedTemporaryFile(mode="wt", delete=False) as db_tmp_file:
+            with open(test_db_path_str, "rt", encoding="utf-8") as ref_db_file:
+                self.db_tmp_file_name = db_tmp_file.name
+                db_tmp_file.write(ref_db_file.read())
+        db_operations.DB = db_operations.load_db(self.db_tmp_file_name)
+        params.DB_PATH = self.db_tmp_file_name
+        params.BASE_PATH = None
+
+    def tearDown(self):
+        os.remove(self.db_tmp_file_name)
+        logging.disable(logging.NOTSET)
+
+    def _read(self, rng: random.Random):
+        tag_id = rng.randint(1, 3)
+        for mapping in db_operations.get_filtered_mappings([tag_id], []):
+            self.assertIn(tag_id, mapping["tag_ids"])
+        for mapping in db_operations.get_filtered_mappings([], [tag_id]):
+            self.assertNotIn(tag_id, mapping["tag_ids"])
+        for mapping in db_operations.get_filtered_mappings(
+            [],
+            [],
+            query_str=f"{rng.choice(['Music', 'Videos', 'Documents'])} | path:stress",
+        ):
+            self.assertTrue(mapping["tag_ids"])
+        mappings = db_operations.get_all_mappings()
+        self.assertEqual(len({mapping.doc_id for mapping in mappings}), len(mappings))
+        for mapping in db_operations.get_mappings_under("/stress"):
+            self.assertTrue(mapping["path"].startswith("/stress/"))
+        self.assertEqual(set(db_operations.get_tag_occurrence_counts()), {1, 2, 3})
+
+    def _write(self, rng: random.Random, thread_index: int, operation_index: int):
+        tag_ids = rng.sample([1, 2, 3], rng.randint(1, 3))
+        mapping_ids = rng.sample(
+            sorted(mapping.doc_id for mapping in db_operations.get_all_mappings()), 2
+        )
+        operation = rng.randrange(4)
+        if operation == 0:
+            db_operations.insert_mapping(
+                f"/stress/{thread_index}/{operation_index}", tag_ids
+            )
+        elif operation == 1:
+            db_operations.append_tags_to_mappings(tag_ids, mapping_ids)
+        elif operation == 2:
+            db_operations.remove_tags_from_mappings(tag_ids[:1], mapping_ids)
+        else:
+            with db_operations.batch() as mappings_batch:
+                mappings_batch.insert_mapping(
+                    f"/stress/batch/{thread_index}/{operation_index}", tag_ids
+                )
+                mappings_batch.append_tags_to_mappings(tag_ids, mapping_ids[:1])
+
+    def test_concurrent_reads_and_writes(self):
+        errors = []
+        barrier = threading.Barrier(self.THREADS_COUNT, timeout=30)
+
+        def run(thread_index):
+            rng = random.Random(thread_index)
+            try:
+                barrier.wait()
+                for operation_index in range(self.OPERATIONS_COUNT):
+                    if thread_index % 2 and operation_index % 4 == 0:
+                        self._write(rng, thread_index, operation_index)
+                    else:
+                        self._read(rng)
+            except Exception as exc:  # pylint: disable=broad-except
+                errors.append(exc)
+                barrier.abort()
+
+        threads = [
+            threading.Thread(target=run, args=(thread_index,), daemon=True)
+            for thread_index in range(self.THREADS_COUNT)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(120)
+            self.assertFalse(thread.is_alive())
+        if errors:
+            raise errors[0]
+        self.assertFalse(db_operations.DB_LOCK._readers_count)
+        self.assertIsNone(db_operations.DB_LOCK._writer)
+        # the indexes maintained during the run must match a fresh load
+        exp_db = db_operations.load_db(self.db_tmp_file_name)
+        exp_mappings = exp_db.all()
+        self.assertEqual(
+            [dict(mapping) for mapping in db_operations.get_all_mappings()],
+            [dict(mapping) for mapping in exp_mappings],
+        )
+        for tag_id in (1, 2, 3):
+            self.assertEqual(
+                db_operations.get_tag_mappings(tag_id),
+                exp_db.get_multiple(exp_db.index("tag_ids").get_doc_ids(tag_id)),
+            )
+        self.assertEqual(
+            [
+                db_operations.DB.index("path").get_doc_id(mapping["path"])
+                for mapping in exp_mappings
+            ],
+            [mapping.doc_id for mapping in exp_mappings],
+        )
+
+
+class TestFileLock(unittest.TestCase):
+    def setUp(self):
+        with NamedTemporaryFile(delete=False) as lock_file:
+            self.lock_path = lock_file.name
+        self.file_lock = FileLock(self.lock_path)
+
+    def tearDown(self):
+        os.remove(self.lock_path)
+
+    def test_generation(self):
+        self.assertEqual(self.file_lock.get_generation(), 0)
+        self.assertEqual(self.file_lock.increment_generation(), 1)
+        self.assertEqual(self.file_lock.increment_generation(), 2)
+        self.assertEqual(FileLock(self.lock_path).get_generation(), 2)
+
+    @unittest.skipIf(fcntl is None, "file locks are not supported")
+    def test_locked(self):
+        other_fd = os.open(self.lock_path, os.O_RDWR)
+        try:
+            with self.file_lock.locked():
+                with self.file_lock.locked():
+                    pass
+                with self.assertRaises(BlockingIOError):
+                    fcntl.flock(other_fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            fcntl.flock(other_fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            fcntl.flock(other_fd, fcntl.LOCK_UN)
+        finally:
+            os.close(other_fd)
+        with self.assertRaises(RuntimeError):
+            self.file_lock.release()
+
+
+def _insert_mappings(worker_index: int, mappings_count: int):
+    for mapping_index in range(mappings_count):
+        db_operations.insert_mapping(
+            f"/worker{worker_index}/{mapping_index}", [worker_index % 3 + 1]
+        )
+
+
+@unittest.skipIf(fcntl is None, "file locks are not supported")
+class TestDbOperationsMultiprocess(unittest.TestCase):
+    def setUp(self):
+        logging.disable(logging.CRITICAL)
+        test_db_path_str = (
+            apps.get_app_config(urls.app_name).path + "/test/resources/TaggerDB.json"
+        )
+        with open(test_db_path_str, "rt", encoding="utf-8") as ref_db_file:
+            self.data = json.load(ref_db_file)
+        with NamedTemporaryFile(delete=False) as db_tmp_file:
+            self.db_tmp_file_name = db_tmp_file.name
+        self.params_prev = (
+            params.DB_STORAGE,
+            params.DB_MULTIPROCESS,
+            params.DB_JOURNAL_COMPACTION_THRESHOLD_KB,
+        )
+        params.DB_MULTIPROCESS = True
+        params.DB_PATH = self.db_tmp_file_name
+        params.BASE_PATH = None
+
+    def tearDown(self):
+        (
+            params.DB_STORAGE,
+            params.DB_MULTIPROCESS,
+            params.DB_JOURNAL_COMPACTION_THRESHOLD_KB,
+        ) = self.params_prev
+        for suffix in ("", ".lock", ".journal"):
+            if os.path.exists(self.db_tmp_file_name + suffix):
+                os.remove(self.db_tmp_file_name + suffix)
+        logging.disable(logging.NOTSET)
+
+    def _load_dbs(self, db_storage: str):
+        params.DB_STORAGE = db_storage
+        if db_storage in ("binary", "mmap"):
+            with open(self.db_tmp_file_name, "wb") as db_file:
+                db_binary_format.dump(self.data, db_file)
+        else:
+            with open(self.db_tmp_file_name, "wt", encoding="utf-8") as db_file:
+                json.dump(self.data, db_file)
+        # each instance locks the database file like a separate process would
+        return tuple(db_operations.load_db(self.db_tmp_file_name) for _ in range(2))
+
+    @parameterized.expand([("json",), ("journal",), ("binary",), ("mmap",)])
+    def test_writes_visible_to_other_instances(self, db_storage):
+        db, other_db = self._load_dbs(db_storage)
+        db_operations.DB = other_db
+        tag_index = other_db.index("tag_ids")
+        db_operations.DB = db
+        self.assertEqual(db_operations.insert_mapping("/foo", [1]), 7)
+        db_operations.DB = other_db
+        self.assertEqual(db_operations.get_mapping(db_path_str="/foo").doc_id, 7)
+        self.assertIn(
+            "/foo",
+            [
+                mapping["path"]
+                for mapping in db_operations.get_filtered_mappings([1], [])
+            ],
+        )
+        if db_storage != "mmap":
+            # only the changed documents were reindexed
+            self.assertIs(other_db.index("tag_ids"), tag_index)
+        self.assertEqual(db_operations.insert_mapping("/bar", [2]), 8)
+        db_operations.delete_tags([3])
+        db_operations.DB = db
+        self.assertEqual(db_operations.get_mapping(db_path_str="/bar").doc_id, 8)
+        self.assertEqual(db_operations.get_tag_occurrence_counts(), {1: 4, 2: 4})
+        self.assertEqual(
+            [dict(mapping) for mapping in db_operations.get_all_mappings()],
+            [dict(mapping) for mapping in other_db.all()],
+        )
+
+    def test_unchanged_database_not_reloaded(self):
+        db, _ = self._load_dbs("json")
+        db_operations.DB = db
+        db_operations.get_all_mappings()
+        with unittest.mock.patch.object(
+            db.storage, "reload", wraps=db.storage.reload
+        ) as mock_reload:
+            db_operations.insert_mapping("/foo", [1])
+            db_operations.get_all_mappings()
+            mock_reload.assert_not_called()
+
+    @parameterized.expand(
+        [("json", 16384), ("journal", 16384), ("compacted journal", 1)]
+    )
+    def test_forked_workers(self, db_storage, compaction_threshold_kb):
+        workers_count = 4
+        mappings_count = 15
+        params.DB_JOURNAL_COMPACTION_THRESHOLD_KB = compaction_threshold_kb
+        db_operations.DB, _ = self._load_dbs(db_storage.split()[-1])
+        db_operations.get_all_mappings()
+        context = multiprocessing.get_context("fork")
+        workers = [
+            context.Process(
+                target=_insert_mappings, args=(worker_index, mappings_count)
+            )
+            for worker_index in range(workers_count)
+        ]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join(60)
+        self.assertEqual([worker.exitcode for worker in workers], [0] * workers_count)
+        mappings = db_operations.get_all_mappings()
+        self.assertEqual(len(mappings), 6 + workers_count * mappings_count)
+        self.assertEqual(
+            sorted(mapping.doc_id for mapping in mappings),
+            list(range(1, len(mappings) + 1)),
+        )
+        self.assertEqual(
+            db_operations.get_tag_occurrence_counts(),
+            {1: 3 + 2 * mappings_count, 2: 3 + mappings_count, 3: 2 + mappings_count},
+        )
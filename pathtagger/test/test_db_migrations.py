@@ -0,0 +1,95 @@
+import json
+import logging
+import os
+import unittest.mock
+from tempfile import NamedTemporaryFile
+
+from django.apps import apps
+
+from pathtagger import db_migrations, db_operations, urls
+
+
+class TestDbMigrations(unittest.TestCase):
+    def setUp(self):
+        logging.disable(logging.CRITICAL)
+        test_db_path_str = (
+            apps.get_app_config(urls.app_name).path + "/test/resources/TaggerDB.json"
+        )
+        with open(test_db_path_str, "rt", encoding="utf-8") as ref_db_file:
+            self.data = json.load(ref_db_file)
+        with NamedTemporaryFile(mode="wt", delete=False) as db_tmp_file:
+            self.db_tmp_file_name = db_tmp_file.name
+            json.dump(self.data, db_tmp_file)
+
+    def tearDown(self):
+        os.remove(self.db_tmp_file_name)
+        logging.disable(logging.NOTSET)
+
+    def _write_data(self, data):
+        with open(self.db_tmp_file_name, "wt", encoding="utf-8") as db_file:
+            json.dump(data, db_file)
+
+    def _read_data(self):
+        with open(self.db_tmp_file_name, "rt", encoding="utf-8") as db_file:
+            return json.load(db_file)
+
+    def test_migrate_initial_schema(self):
+        db = db_operations.load_db(self.db_tmp_file_name)
+        db.storage.flush()
+        self.assertEqual(
+            db_migrations.get_schema_version(db), db_migrations.SCHEMA_VERSION
+        )
+        data = self._read_data()
+        self.assertEqual(
+            data[db_migrations.META_TABLE_NAME],
+            {"1": {"schema_version": db_migrations.SCHEMA_VERSION}},
+        )
+        self.assertEqual(
+            data["_default"],
+            {
+                doc_id: {
+                    **mapping,
+                    "tag_ids": sorted(int(tag_id) for tag_id in mapping["tag_ids"]),
+                }
+                for doc_id, mapping in self.data["_default"].items()
+            },
+        )
+        self.assertEqual(data["tags"], self.data["tags"])
+
+    def test_migrate_current_schema(self):
+        db_operations.load_db(self.db_tmp_file_name).storage.flush()
+        with unittest.mock.patch.dict(
+            db_migrations.MIGRATIONS,
+            {version: unittest.mock.Mock() for version in db_migrations.MIGRATIONS},
+        ):
+            db = db_operations.load_db(self.db_tmp_file_name)
+            for migration in db_migrations.MIGRATIONS.values():
+                migration.assert_not_called()
+        self.assertEqual(
+            db_migrations.get_schema_version(db), db_migrations.SCHEMA_VERSION
+        )
+
+    def test_migrate_newer_schema(self):
+        data = {
+            **self.data,
+            db_migrations.META_TABLE_NAME: {"1": {"schema_version": 99}},
+        }
+        self._write_data(data)
+        db = db_operations.load_db(self.db_tmp_file_name)
+        db.storage.flush()
+        self.assertEqual(db_migrations.get_schema_version(db), 99)
+        self.assertEqual(self._read_data(), data)
+
+    def test_migrate_empty_db(self):
+        self._write_data({})
+        db = db_operations.load_db(self.db_tmp_file_name)
+        db.storage.flush()
+        self.assertEqual(
+            self._read_data(),
+            {
+                "_default": {},
+                db_migrations.META_TABLE_NAME: {
+                    "1": {"schema_version": db_migrations.SCHEMA_VERSION}
+                },
+            },
+        )
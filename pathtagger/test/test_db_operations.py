@@ -1,12 +1,25 @@
+import glob
+import json
 import logging
 import os
-import unittest
+import shutil
+import threading
+import unittest.mock
+from io import StringIO
 from tempfile import NamedTemporaryFile
 
 from django.apps import apps
+from django.core.management import call_command
 from parameterized import parameterized
 
-from pathtagger import db_operations, urls
+from pathtagger import (
+    db_backends,
+    db_binary_format,
+    db_operations,
+    db_storages,
+    db_utils,
+    urls,
+)
 from Tagger import params
 
 
@@ -132,7 +145,7 @@ class TestDbOperations(unittest.TestCase):
             act_invalid_doc_ids,
             act_nonexistent_doc_ids,
             act_existing_doc_ids,
-        ) = db_operations._classify_doc_ids(doc_ids, reference_doc_ids)
+        ) = db_utils.classify_doc_ids(doc_ids, reference_doc_ids)
         self.assertEqual(act_invalid_doc_ids, exp_invalid_doc_ids)
         self.assertEqual(act_nonexistent_doc_ids, exp_nonexistent_doc_ids)
         self.assertEqual(act_existing_doc_ids, exp_existing_doc_ids)
@@ -240,7 +253,7 @@ class TestDbOperations(unittest.TestCase):
             act_invalid_doc_ids,
             act_nonexistent_doc_ids,
             act_existing_doc_ids,
-        ) = db_operations._classify_doc_ids(doc_ids, reference_doc_ids)
+        ) = db_utils.classify_doc_ids(doc_ids, reference_doc_ids)
         self.assertEqual(act_invalid_doc_ids, exp_invalid_doc_ids)
         self.assertEqual(act_nonexistent_doc_ids, exp_nonexistent_doc_ids)
         self.assertEqual(act_existing_doc_ids, exp_existing_doc_ids)
@@ -391,7 +404,30 @@ class TestDbOperations(unittest.TestCase):
         ]
     )
     def test__is_valid_hex_color(self, _, color, exp_is_valid):
-        self.assertEqual(db_operations._is_valid_hex_color(color), exp_is_valid)
+        self.assertEqual(db_utils.is_valid_hex_color(color), exp_is_valid)
+
+    @parameterized.expand(
+        [
+            ("no prefixes", "/media/foo", [], None),
+            ("prefix", "/media/foo", ["/media"], "media"),
+            ("prefix itself", "/media", ["/media/"], "media"),
+            ("partial component", "/media2/foo", ["/media"], None),
+            (
+                "longest prefix",
+                "/mnt/photos/foo",
+                ["/mnt", "/mnt/photos"],
+                "mnt_photos",
+            ),
+            ("top-level directory", "/home/dino/foo", ["/media", "*"], "home"),
+            ("relative path", "Music/foo", ["*"], "Music"),
+            ("root", "/", ["*"], None),
+            ("empty", "", ["*"], None),
+        ]
+    )
+    def test_get_shard_name(self, _, db_path_str, shard_prefixes, exp_shard_name):
+        self.assertEqual(
+            db_utils.get_shard_name(db_path_str, shard_prefixes), exp_shard_name
+        )
 
     @parameterized.expand(
         [
@@ -430,10 +466,10 @@ class TestDbOperations(unittest.TestCase):
 
     @parameterized.expand(
         (
-            ("none", [], 3, 5),
-            ("one", [1], 2, 4),
-            ("two", [1, 2], 1, 2),
-            ("all", [1, 2, 3], 0, 0),
+            ("none", [], 3, 6),
+            ("one", [1], 2, 5),
+            ("two", [1, 2], 1, 3),
+            ("all", [1, 2, 3], 0, 1),
         )
     )
     def test_delete_tags(
@@ -449,6 +485,11 @@ class TestDbOperations(unittest.TestCase):
         self.assertEqual(
             len(db_operations.get_all_mappings()), exp_remaining_mappings_count
         )
+        # untagged mappings that were not touched are left to the full sweep
+        self.assertIsNotNone(db_operations.get_mapping(mapping_id=6))
+        self.assertEqual(
+            set(db_operations.DB.index("tag_ids").get_doc_ids_with_none()), {6}
+        )
         self.assertTrue(
             all(db_operations.get_tag(tag_id=tag_id) is None for tag_id in tag_ids)
         )
@@ -477,6 +518,31 @@ class TestDbOperations(unittest.TestCase):
                     exp_mapping_ids,
                 )
 
+    def test_get_tag_occurrence_counts(self):
+        self.assertEqual(db_operations.get_tag_occurrence_counts(), {1: 3, 2: 3, 3: 2})
+        tag_id = db_operations.insert_tag("Pictures", "#000000")
+        db_operations.append_tags_to_mappings([tag_id, 3], [5, 6])
+        db_operations.remove_tags_from_mappings([1], [1, 4])
+        db_operations.insert_mapping("/home/dino/Pictures", [tag_id])
+        db_operations.delete_mappings([2])
+        db_operations.delete_tags([2])
+        with db_operations.batch() as mappings_batch:
+            mappings_batch.append_tags_to_mappings([1], [3])
+        self.assertEqual(
+            db_operations.get_tag_occurrence_counts(),
+            {
+                tag.doc_id: len(db_operations.get_tag_mappings(tag.doc_id))
+                for tag in db_operations.get_all_tags()
+            },
+        )
+        self.assertEqual(
+            db_operations.get_tag_occurrence_counts(), {1: 2, 3: 4, tag_id: 3}
+        )
+        db_operations.DB = db_operations.load_db(self.db_tmp_file_name)
+        self.assertEqual(
+            db_operations.get_tag_occurrence_counts(), {1: 2, 3: 4, tag_id: 3}
+        )
+
     @parameterized.expand(
         (
             ("name is None, color is None", 2, None, None, False),
@@ -530,10 +596,10 @@ class TestDbOperations(unittest.TestCase):
                 True,
                 3,
                 "/home/dino/Documents",
-                ["3"],
+                [3],
             ),
             ("id is None, nonexistint path", None, "/foo", False, None, None, None),
-            ("existing id, path is None", 1, None, True, 1, "/home/dino/Music", ["1"]),
+            ("existing id, path is None", 1, None, True, 1, "/home/dino/Music", [1]),
             ("existing id, empty path", 1, "", False, None, None, None),
             (
                 "existing id, correct path",
@@ -542,7 +608,7 @@ class TestDbOperations(unittest.TestCase):
                 True,
                 1,
                 "/home/dino/Music",
-                ["1"],
+                [1],
             ),
             ("existing id, wrong path", 1, "/foo", False, None, None, None),
             ("nonexistent id, path is None", 1001, None, False, None, None, None),
@@ -593,7 +659,7 @@ class TestDbOperations(unittest.TestCase):
         self.assertEqual(len(db_operations.get_all_mappings()), 6)
         self.assertTrue(
             all(
-                any(str(tag_id) in mapping["tag_ids"] for mapping in mappings)
+                any(tag_id in mapping["tag_ids"] for mapping in mappings)
                 for tag_id in tag_ids
             )
         )
@@ -606,37 +672,57 @@ class TestDbOperations(unittest.TestCase):
         ]
         self.assertTrue(
             all(
-                all(str(tag_id) not in mapping["tag_ids"] for mapping in mappings)
+                all(tag_id not in mapping["tag_ids"] for mapping in mappings)
                 for tag_id in tag_ids
             )
         )
-        self.assertTrue("3" in db_operations.get_mapping(mapping_id=3)["tag_ids"])
+        self.assertTrue(3 in db_operations.get_mapping(mapping_id=3)["tag_ids"])
+
+    def test_remove_tags_from_mappings_deletes_untagged_mappings(self):
+        db_operations.remove_tags_from_mappings([1, 2], [1, 2, 4])
+        self.assertIsNone(db_operations.get_mapping(mapping_id=1))
+        self.assertIsNone(db_operations.get_mapping(mapping_id=2))
+        self.assertEqual(db_operations.get_mapping(mapping_id=4)["tag_ids"], [3])
+        self.assertIsNotNone(db_operations.get_mapping(mapping_id=6))
+        self.assertEqual(
+            set(db_operations.DB.index("tag_ids").get_doc_ids_with_none()), {6}
+        )
 
     def test_remove_mappings_without_tags(self):
         self.assertEqual(len(db_operations.get_all_mappings()), 6)
         db_operations.remove_mappings_without_tags()
         self.assertEqual(len(db_operations.get_all_mappings()), 5)
+        self.assertIsNone(db_operations.get_mapping(mapping_id=6))
         db_operations.remove_mappings_without_tags()
         self.assertEqual(len(db_operations.get_all_mappings()), 5)
 
+    def test_remove_untagged_mappings_command(self):
+        stdout = StringIO()
+        with unittest.mock.patch.object(
+            db_backends, "get_db_operations", return_value=db_operations
+        ):
+            call_command("remove_untagged_mappings", stdout=stdout)
+        self.assertIn("Removed 1 mappings without tags", stdout.getvalue())
+        self.assertEqual(len(db_operations.get_all_mappings()), 5)
+
     def test_get_all_mappings(self):
         mappings = db_operations.get_all_mappings()
         self.assertEqual(len(mappings), 6)
         self.assertEqual(mappings[0].doc_id, 1)
         self.assertEqual(mappings[0]["path"], "/home/dino/Music")
-        self.assertEqual(set(mappings[0]["tag_ids"]), {"1"})
+        self.assertEqual(set(mappings[0]["tag_ids"]), {1})
         self.assertEqual(mappings[1].doc_id, 2)
         self.assertEqual(mappings[1]["path"], "/home/dino/Videos")
-        self.assertEqual(set(mappings[1]["tag_ids"]), {"2"})
+        self.assertEqual(set(mappings[1]["tag_ids"]), {2})
         self.assertEqual(mappings[2].doc_id, 3)
         self.assertEqual(mappings[2]["path"], "/home/dino/Documents")
-        self.assertEqual(set(mappings[2]["tag_ids"]), {"3"})
+        self.assertEqual(set(mappings[2]["tag_ids"]), {3})
         self.assertEqual(mappings[3].doc_id, 4)
         self.assertEqual(mappings[3]["path"], "/home/dino/Downloads")
-        self.assertEqual(set(mappings[3]["tag_ids"]), {"1", "2", "3"})
+        self.assertEqual(set(mappings[3]["tag_ids"]), {1, 2, 3})
         self.assertEqual(mappings[4].doc_id, 5)
         self.assertEqual(mappings[4]["path"], "/media")
-        self.assertEqual(set(mappings[4]["tag_ids"]), {"1", "2"})
+        self.assertEqual(set(mappings[4]["tag_ids"]), {1, 2})
         self.assertEqual(mappings[5].doc_id, 6)
         self.assertEqual(mappings[5]["path"], "/home/dino/Pictures/wallpaper.jpg")
         self.assertEqual(set(mappings[5]["tag_ids"]), set())
@@ -644,6 +730,108 @@ class TestDbOperations(unittest.TestCase):
         db_operations.DB.purge_tables()
         self.assertEqual(len(db_operations.get_all_mappings()), 0)
 
+    @parameterized.expand(
+        [
+            ("all", {}, [1, 2, 3, 4, 5, 6]),
+            ("limit", {"limit": 2}, [1, 2]),
+            ("offset", {"offset": 4}, [5, 6]),
+            ("limit and offset", {"limit": 2, "offset": 3}, [4, 5]),
+            ("cursor", {"after_mapping_id": 4}, [5, 6]),
+            ("limit and cursor", {"limit": 1, "after_mapping_id": 2}, [3]),
+            ("cursor past the end", {"after_mapping_id": 6}, []),
+            ("zero limit", {"limit": 0}, []),
+            ("negative limit", {"limit": -1}, []),
+            ("negative offset", {"offset": -1}, [1, 2, 3, 4, 5, 6]),
+        ]
+    )
+    def test_iter_all_mappings(self, _, kwargs, exp_mapping_ids):
+        mappings = db_operations.iter_all_mappings(**kwargs)
+        self.assertNotIsInstance(mappings, list)
+        self.assertEqual([mapping.doc_id for mapping in mappings], exp_mapping_ids)
+
+    @parameterized.expand(
+        [
+            (1, {}, [1, 4, 5]),
+            (1, {"limit": 2, "offset": 1}, [4, 5]),
+            (2, {"after_mapping_id": 2}, [4, 5]),
+            (4, {}, []),
+        ]
+    )
+    def test_iter_tag_mappings(self, tag_id, kwargs, exp_mapping_ids):
+        self.assertEqual(
+            [
+                mapping.doc_id
+                for mapping in db_operations.iter_tag_mappings(tag_id, **kwargs)
+            ],
+            exp_mapping_ids,
+        )
+
+    @parameterized.expand(
+        [
+            ([1], [], None, None, None, {}),
+            ([], [3], "dino", None, None, {"limit": 2}),
+            ([], [], "O", None, None, {"offset": 1, "limit": 2}),
+            ([], [], None, "/home", None, {"after_mapping_id": 2}),
+            ([], [], None, None, "Music | !Videos", {"after_mapping_id": 1}),
+            ([11], [], None, None, None, {}),
+        ]
+    )
+    def test_iter_filtered_mappings(
+        self,
+        tag_ids_to_include,
+        tag_ids_to_exclude,
+        db_path_str_like,
+        within_db_path_str,
+        query_str,
+        kwargs,
+    ):
+        exp_mappings = [
+            mapping
+            for mapping in db_operations.get_filtered_mappings(
+                tag_ids_to_include,
+                tag_ids_to_exclude,
+                db_path_str_like,
+                within_db_path_str,
+                query_str,
+            )
+            if mapping.doc_id > kwargs.get("after_mapping_id", 0)
+        ]
+        offset = kwargs.get("offset", 0)
+        exp_mappings = exp_mappings[offset : offset + kwargs.get("limit", 6)]
+        mappings = list(
+            db_operations.iter_filtered_mappings(
+                tag_ids_to_include,
+                tag_ids_to_exclude,
+                db_path_str_like,
+                within_db_path_str,
+                query_str,
+                **kwargs,
+            )
+        )
+        self.assertEqual(mappings, exp_mappings)
+        self.assertEqual(
+            [mapping.doc_id for mapping in mappings],
+            [mapping.doc_id for mapping in exp_mappings],
+        )
+
+    def test_iter_mappings_isolated_from_writes(self):
+        mappings = db_operations.iter_filtered_mappings([1], [])
+        tag_mappings = db_operations.iter_tag_mappings(1)
+        self.assertEqual(next(mappings).doc_id, 1)
+        # the iterators hold no lock
+        db_operations.delete_mappings([4])
+        db_operations.insert_mapping("/foo", [1])
+        db_operations.update_mapping_path(5, "/bar")
+        self.assertEqual(
+            [(mapping.doc_id, mapping["path"]) for mapping in mappings],
+            [(4, "/home/dino/Downloads"), (5, "/media")],
+        )
+        self.assertEqual([mapping.doc_id for mapping in tag_mappings], [1, 4, 5])
+        self.assertEqual(
+            [mapping.doc_id for mapping in db_operations.iter_tag_mappings(1)],
+            [1, 5, 7],
+        )
+
     @parameterized.expand(
         (
             ("path is None, tag_ids is None", None, None, False, None),
@@ -658,9 +846,9 @@ class TestDbOperations(unittest.TestCase):
             ("empty path, valid and invalid tag_ids", "", [1, 12], False, None),
             ("new path, tag_ids is None", "/foo", None, True, []),
             ("new path, empty tag_ids", "/foo", [], True, []),
-            ("new path, all valid tag_ids", "/foo", [1, 3], True, ["1", "3"]),
+            ("new path, all valid tag_ids", "/foo", [1, 3], True, [1, 3]),
             ("new path, all invalid tag_ids", "/foo", [11, 12], True, []),
-            ("new path, valid and invalid tag_ids", "/foo", [1, 12], True, ["1"]),
+            ("new path, valid and invalid tag_ids", "/foo", [1, 12], True, [1]),
             ("existing path, tag_ids is None", "/home/dino/Videos", None, False, None),
             ("existing path, empty tag_ids", "/home/dino/Videos", [], False, None),
             (
@@ -709,8 +897,8 @@ class TestDbOperations(unittest.TestCase):
 
     @parameterized.expand(
         (
-            ([2, 3, 4], 2),
-            ([5], 4),
+            ([2, 3, 4], 3),
+            ([5], 5),
             ([6], 5),
         )
     )
@@ -785,6 +973,195 @@ class TestDbOperations(unittest.TestCase):
             exp_mapping_ids,
         )
 
+    @parameterized.expand(
+        (
+            ("tag", [], [], "Music", {1, 4, 5}),
+            ("or", [], [], "Music | Documents", {1, 3, 4, 5}),
+            ("and not", [], [], "(Music | Documents) & !Videos", {1, 3}),
+            ("not", [], [], "!Music", {2, 3, 6}),
+            ("path", [], [], 'Music & path:"DINO"', {1, 4}),
+            ("under", [], [], "!Videos & under:/home", {1, 3, 6}),
+            ("nonexistent tag", [], [], "Music & !foo", {1, 4, 5}),
+            ("with tag filters", [2], [3], "Music | Documents", {5}),
+        )
+    )
+    def test_get_filtered_mappings_query(
+        self, _, tag_ids_to_include, tag_ids_to_exclude, query_str, exp_mapping_ids
+    ):
+        self.assertEqual(
+            {
+                mapping.doc_id
+                for mapping in db_operations.get_filtered_mappings(
+                    tag_ids_to_include, tag_ids_to_exclude, query_str=query_str
+                )
+            },
+            exp_mapping_ids,
+        )
+
+    def test_get_filtered_mappings_plan(self):
+        tag_index = db_operations.DB.index("tag_ids")
+        with (
+            unittest.mock.patch.object(
+                tag_index, "get_doc_ids", wraps=tag_index.get_doc_ids
+            ) as mock_get_doc_ids,
+            unittest.mock.patch.object(
+                tag_index, "intersect", wraps=tag_index.intersect
+            ) as mock_intersect,
+            unittest.mock.patch.object(
+                tag_index, "subtract", wraps=tag_index.subtract
+            ) as mock_subtract,
+        ):
+            self.assertEqual(
+                [
+                    mapping.doc_id
+                    for mapping in db_operations.get_filtered_mappings([1, 3], [])
+                ],
+                [4],
+            )
+            self.assertEqual(
+                [
+                    mapping.doc_id
+                    for mapping in db_operations.get_filtered_mappings([1], [2, 3])
+                ],
+                [1],
+            )
+        self.assertEqual(
+            [call.args[0] for call in mock_get_doc_ids.call_args_list], [3, 1]
+        )
+        self.assertEqual([call.args[1] for call in mock_intersect.call_args_list], [1])
+        self.assertEqual(
+            [call.args[1] for call in mock_subtract.call_args_list], [3, 2]
+        )
+
+    def test_get_filtered_mappings_plan_short_circuit(self):
+        db_operations.insert_tag("Empty", "#000000")
+        path_index = db_operations.DB.index("path")
+        with (
+            unittest.mock.patch.object(
+                path_index, "get_candidate_doc_ids_like"
+            ) as mock_get_candidate_doc_ids_like,
+            unittest.mock.patch.object(
+                path_index, "get_doc_ids_under"
+            ) as mock_get_doc_ids_under,
+        ):
+            mappings = db_operations.get_filtered_mappings(
+                [1, 4], [], "dino", "/home", "Videos"
+            )
+        self.assertEqual(mappings, [])
+        mock_get_candidate_doc_ids_like.assert_not_called()
+        mock_get_doc_ids_under.assert_not_called()
+
+    @parameterized.expand([("few mappings", 2000, False), ("many mappings", 0, True)])
+    def test_get_filtered_mappings_plan_path_index(
+        self, _, min_mapping_count, exp_path_index_used
+    ):
+        path_index = db_operations.DB.index("path")
+        with (
+            unittest.mock.patch.object(
+                db_operations, "PATH_INDEX_MIN_MAPPING_COUNT", min_mapping_count
+            ),
+            unittest.mock.patch.object(
+                path_index,
+                "get_candidate_doc_ids_like",
+                wraps=path_index.get_candidate_doc_ids_like,
+            ) as mock_get_candidate_doc_ids_like,
+        ):
+            mappings = db_operations.get_filtered_mappings([1], [], "DINO")
+        self.assertEqual([mapping.doc_id for mapping in mappings], [1, 4])
+        self.assertEqual(mock_get_candidate_doc_ids_like.called, exp_path_index_used)
+
+    def test_get_filtered_mappings_after_update(self):
+        self.assertEqual(
+            [
+                mapping.doc_id
+                for mapping in db_operations.get_filtered_mappings([], [], "JPG")
+            ],
+            [6],
+        )
+        db_operations.update_mapping_path(6, "/home/dino/Pictures/wallpaper.png")
+        db_operations.insert_mapping("/home/dino/Pictures/photo.jpg", [])
+        self.assertEqual(
+            [
+                mapping["path"]
+                for mapping in db_operations.get_filtered_mappings([], [], "JPG")
+            ],
+            ["/home/dino/Pictures/photo.jpg"],
+        )
+
+    @parameterized.expand(
+        (
+            ([], [], None, "/home/dino", {1, 2, 3, 4, 6}),
+            ([1], [], None, "/home/dino", {1, 4}),
+            ([], [3], "o", "/home", {1, 2, 6}),
+            ([1], [], None, "/home/din", set()),
+            ([1], [], None, "", {1, 4, 5}),
+        )
+    )
+    def test_get_filtered_mappings_within(
+        self,
+        tag_ids_to_include,
+        tag_ids_to_exclude,
+        mapping_path_like,
+        within_db_path_str,
+        exp_mapping_ids,
+    ):
+        self.assertEqual(
+            {
+                mapping.doc_id
+                for mapping in db_operations.get_filtered_mappings(
+                    tag_ids_to_include,
+                    tag_ids_to_exclude,
+                    mapping_path_like,
+                    within_db_path_str,
+                )
+            },
+            exp_mapping_ids,
+        )
+
+    @parameterized.expand(
+        (
+            ("root, recursive", "/", True, {1, 2, 3, 4, 5, 6}),
+            ("root, nonrecursive", "/", False, {5}),
+            ("folder, recursive", "/home/dino", True, {1, 2, 3, 4, 6}),
+            ("folder, nonrecursive", "/home/dino", False, {1, 2, 3, 4}),
+            ("trailing slash", "/home/dino/", False, {1, 2, 3, 4}),
+            ("parent of file", "/home/dino/Pictures", False, {6}),
+            ("partial component", "/home/din", True, set()),
+            ("mapped path", "/media", True, set()),
+            ("nonexistent path", "/foo", True, set()),
+            ("empty path", "", True, set()),
+        )
+    )
+    def test_get_mappings_under(self, _, db_path_str, recursive, exp_mapping_ids):
+        self.assertEqual(
+            {
+                mapping.doc_id
+                for mapping in db_operations.get_mappings_under(db_path_str, recursive)
+            },
+            exp_mapping_ids,
+        )
+
+    def test_get_mappings_under_after_update(self):
+        db_operations.update_mapping_path(5, "/home/dino/media")
+        db_operations.delete_mappings([1])
+        db_operations.insert_mapping("/home/dino/Music/song.mp3", [1])
+        self.assertEqual(
+            {
+                mapping["path"]
+                for mapping in db_operations.get_mappings_under("/home/dino", False)
+            },
+            {"/home/dino/Videos", "/home/dino/Documents", "/home/dino/Downloads"}
+            | {"/home/dino/media"},
+        )
+        self.assertEqual(
+            [
+                mapping["path"]
+                for mapping in db_operations.get_mappings_under("/home/dino/Music")
+            ],
+            ["/home/dino/Music/song.mp3"],
+        )
+        self.assertEqual(db_operations.get_mappings_under("/media"), [])
+
     def test_append_tags_to_mappings(
         self,
     ):
@@ -795,10 +1172,265 @@ class TestDbOperations(unittest.TestCase):
         db_operations.append_tags_to_mappings(tag_ids, mapping_ids)
         self.assertTrue(
             all(
-                str(tag_id)
-                in db_operations.get_mapping(mapping_id=mapping_id)["tag_ids"]
+                tag_id in db_operations.get_mapping(mapping_id=mapping_id)["tag_ids"]
                 for mapping_id in mapping_ids
                 for tag_id in tag_ids
             )
         )
-        self.assertTrue("1" not in db_operations.get_mapping(mapping_id=2)["tag_ids"])
+        self.assertTrue(1 not in db_operations.get_mapping(mapping_id=2)["tag_ids"])
+
+    @parameterized.expand(
+        [
+            (
+                "append and remove",
+                [
+                    ("append_tags_to_mappings", [2], [1, 3]),
+                    ("remove_tags_from_mappings", [1], [1, 4]),
+                ],
+                {1: [2], 3: [2, 3], 4: [2, 3]},
+                0,
+            ),
+            (
+                "remove all tags",
+                [("remove_tags_from_mappings", [1, 2], [5])],
+                {5: None},
+                0,
+            ),
+            (
+                "delete and append",
+                [("delete_mappings", [2]), ("append_tags_to_mappings", [1], [2])],
+                {2: None},
+                0,
+            ),
+            (
+                "remove and append",
+                [
+                    ("remove_tags_from_mappings", [1], [1]),
+                    ("append_tags_to_mappings", [1], [1]),
+                ],
+                {1: [1]},
+                0,
+            ),
+            (
+                "nonexistent ids",
+                [("append_tags_to_mappings", [11], [1, 17])],
+                {1: [1]},
+                0,
+            ),
+            ("insert", [("insert_mapping", "/foo", [1, 11])], {7: [1]}, 1),
+            ("insert existing path", [("insert_mapping", "/media", [3])], {}, 0),
+            ("insert without tags", [("insert_mapping", "/foo", [11])], {}, 0),
+        ]
+    )
+    def test_batch(self, _, operations, exp_tag_ids_by_mapping_id, exp_inserted_count):
+        mappings_before = {
+            mapping.doc_id: mapping["tag_ids"]
+            for mapping in db_operations.get_all_mappings()
+        }
+        with db_operations.batch() as mappings_batch:
+            for method_name, *args in operations:
+                getattr(mappings_batch, method_name)(*args)
+        self.assertEqual(len(mappings_batch.inserted_mapping_ids), exp_inserted_count)
+        self.assertEqual(
+            {
+                mapping.doc_id: mapping["tag_ids"]
+                for mapping in db_operations.get_all_mappings()
+            },
+            {
+                mapping_id: tag_ids
+                for mapping_id, tag_ids in {
+                    **mappings_before,
+                    **exp_tag_ids_by_mapping_id,
+                }.items()
+                if tag_ids is not None
+            },
+        )
+        self.assertEqual(
+            db_operations.get_tag_mappings(1),
+            db_operations.get_filtered_mappings([1], []),
+        )
+
+    def test_batch_single_write(self):
+        storage = db_operations.DB._storage
+        with unittest.mock.patch.object(
+            storage, "write", wraps=storage.write
+        ) as mock_write:
+            with db_operations.batch() as mappings_batch:
+                mappings_batch.append_tags_to_mappings([2], [1, 3])
+                mappings_batch.remove_tags_from_mappings([1], [4, 5])
+                mappings_batch.delete_mappings([2])
+                mappings_batch.insert_mapping("/foo", [1])
+                mappings_batch.insert_mapping("/bar", [2, 3])
+                mock_write.assert_not_called()
+        mock_write.assert_called_once()
+
+    def test_batch_exception(self):
+        mappings_before = db_operations.get_all_mappings()
+        with self.assertRaises(ValueError):
+            with db_operations.batch() as mappings_batch:
+                mappings_batch.delete_mappings([1, 2, 3])
+                raise ValueError
+        self.assertEqual(db_operations.get_all_mappings(), mappings_before)
+
+
+class TestDbOperationsMmapStorage(TestDbOperations):
+    def setUp(self):
+        super().setUp()
+        with open(self.db_tmp_file_name, "rt", encoding="utf-8") as db_file:
+            data = json.load(db_file)
+        with open(self.db_tmp_file_name, "wb") as db_file:
+            db_binary_format.dump(data, db_file)
+        self.db_storage_prev = params.DB_STORAGE
+        params.DB_STORAGE = "mmap"
+        db_operations.DB = db_operations.load_db(self.db_tmp_file_name)
+
+    def tearDown(self):
+        params.DB_STORAGE = self.db_storage_prev
+        super().tearDown()
+
+
+class TestDbOperationsShardedStorage(TestDbOperations):
+    def setUp(self):
+        super().setUp()
+        self.db_shard_prefixes_prev = params.DB_SHARD_PREFIXES
+        params.DB_SHARD_PREFIXES = ["/media", "*"]
+        db_operations.DB = db_operations.load_db(self.db_tmp_file_name)
+
+    def tearDown(self):
+        params.DB_SHARD_PREFIXES = self.db_shard_prefixes_prev
+        for path in glob.glob(glob.escape(self.db_tmp_file_name) + ".shard-*"):
+            os.remove(path)
+        super().tearDown()
+
+    def _read_json(self, path):
+        with open(path, "rt", encoding="utf-8") as db_file:
+            return json.load(db_file)
+
+    def test_shard_files(self):
+        db_operations.insert_mapping("/media/foo", [1])
+        self.assertEqual(
+            {
+                doc_id: mapping["path"]
+                for doc_id, mapping in self._read_json(
+                    self.db_tmp_file_name + ".shard-media"
+                )["_default"].items()
+            },
+            {"5": "/media", "7": "/media/foo"},
+        )
+        self.assertEqual(
+            len(self._read_json(self.db_tmp_file_name + ".shard-home")["_default"]), 5
+        )
+        main_data = self._read_json(self.db_tmp_file_name)
+        self.assertEqual(main_data["_default"], {})
+        self.assertEqual(len(main_data["tags"]), 3)
+        db_operations.DB = db_operations.load_db(self.db_tmp_file_name)
+        self.assertEqual(db_operations.get_mapping(db_path_str="/media/foo").doc_id, 7)
+        self.assertEqual(db_operations.get_mappings_count(), 7)
+
+
+class TestDbOperationsGroupCommit(TestDbOperations):
+    def setUp(self):
+        super().setUp()
+        self.db_group_commit_window_ms_prev = params.DB_GROUP_COMMIT_WINDOW_MS
+        params.DB_GROUP_COMMIT_WINDOW_MS = 1
+        db_operations.DB = db_operations.load_db(self.db_tmp_file_name)
+
+    def tearDown(self):
+        params.DB_GROUP_COMMIT_WINDOW_MS = self.db_group_commit_window_ms_prev
+        super().tearDown()
+
+    def _read_tag_names(self):
+        with open(self.db_tmp_file_name, "rt", encoding="utf-8") as db_file:
+            return sorted(tag["name"] for tag in json.load(db_file)["tags"].values())
+
+    def test_write_is_flushed_on_return(self):
+        db_operations.insert_tag("Pictures", "#000000")
+        self.assertFalse(db_operations.DB.storage.is_dirty)
+        self.assertIn("Pictures", self._read_tag_names())
+
+    def test_concurrent_writes_committed_together(self):
+        db_operations.DB.storage.group_commit_window_ms = 200
+        tag_names = [f"Tag {i}" for i in range(8)]
+        writers = [
+            threading.Thread(
+                target=db_operations.insert_tag, args=(tag_name, "#000000")
+            )
+            for tag_name in tag_names
+        ]
+        with unittest.mock.patch.object(
+            db_storages.JSONFileStorage,
+            "write",
+            autospec=True,
+            side_effect=db_storages.JSONFileStorage.write,
+        ) as write_mock:
+            for writer in writers:
+                writer.start()
+            for writer in writers:
+                writer.join()
+        self.assertEqual(write_mock.call_count, 1)
+        self.assertEqual(
+            self._read_tag_names(),
+            sorted(["Documents", "Music", "Videos", *tag_names]),
+        )
+
+    def test_failed_commit_is_retried(self):
+        write = db_storages.JSONFileStorage.write
+        errors = [OSError]
+
+        def write_failing_once(storage, data):
+            if errors:
+                raise errors.pop()
+            write(storage, data)
+
+        with unittest.mock.patch.object(
+            db_storages.JSONFileStorage,
+            "write",
+            autospec=True,
+            side_effect=write_failing_once,
+        ):
+            with self.assertRaises(OSError):
+                db_operations.insert_tag("Pictures", "#000000")
+            self.assertTrue(db_operations.DB.storage.is_dirty)
+            db_operations.insert_tag("Photos", "#000000")
+        self.assertEqual(
+            self._read_tag_names(),
+            ["Documents", "Music", "Photos", "Pictures", "Videos"],
+        )
+
+
+class TestOpenDb(unittest.TestCase):
+    def setUp(self):
+        with NamedTemporaryFile(delete=False) as db_tmp_file:
+            self.db_tmp_file_name = db_tmp_file.name
+        shutil.copyfile(
+            apps.get_app_config(urls.app_name).path + "/test/resources/TaggerDB.json",
+            self.db_tmp_file_name,
+        )
+        params.DB_PATH = self.db_tmp_file_name
+        db_operations.DB = None
+
+    def tearDown(self):
+        os.remove(self.db_tmp_file_name)
+
+    def test_open_on_first_use(self):
+        db_operations.flush_db()
+        self.assertIsNone(db_operations.DB)
+        with self.assertLogs("pathtagger.db_operations", "INFO") as logs:
+            self.assertEqual(db_operations.get_mappings_count(), 6)
+        self.assertIsNotNone(db_operations.DB)
+        self.assertIn("Found 3 tags, 6 mappings, and 2 favorites.", logs.output[-1])
+
+    def test_count_without_documents(self):
+        db_operations.warm_up_db()
+        with unittest.mock.patch.object(
+            db_storages.LazyStorageProxy, "read", autospec=True
+        ) as read_mock:
+            self.assertEqual(len(db_operations.DB.table()), 6)
+            self.assertEqual(len(db_operations.DB.table("tags")), 3)
+        read_mock.assert_not_called()
+
+    def test_warm_up_db(self):
+        with self.assertLogs("pathtagger.db_operations", "DEBUG"):
+            db_operations.warm_up_db()
+        for table_name in ("_default", "tags", "favorite_paths"):
+            self.assertIsNotNone(db_operations.DB.table(table_name)._indexes)
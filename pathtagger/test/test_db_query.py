@@ -0,0 +1,140 @@
+import logging
+import unittest
+
+from parameterized import parameterized
+
+from pathtagger import db_query
+from pathtagger.db_bitmaps import Bitmap
+from pathtagger.db_query import (
+    AndExpr,
+    NotExpr,
+    OrExpr,
+    PathContainsTerm,
+    PathUnderTerm,
+    TagTerm,
+)
+
+
+class TestDbQuery(unittest.TestCase):
+    def setUp(self):
+        logging.disable(logging.CRITICAL)
+
+    def tearDown(self):
+        logging.disable(logging.NOTSET)
+
+    @parameterized.expand(
+        [
+            ("tag", "comedy", TagTerm("comedy")),
+            ("quoted tag", '"science fiction"', TagTerm("science fiction")),
+            ("escaped quote", r'"say \"hi\""', TagTerm('say "hi"')),
+            ("tag with colon", "rating:5", TagTerm("rating:5")),
+            ("predicate name as tag", "path", TagTerm("path")),
+            (
+                "example",
+                '(comedy | romance) & !horror & path:"/movies"',
+                AndExpr(
+                    (
+                        OrExpr((TagTerm("comedy"), TagTerm("romance"))),
+                        NotExpr(TagTerm("horror")),
+                        PathContainsTerm("/movies"),
+                    )
+                ),
+            ),
+            (
+                "keywords",
+                "a AND NOT b OR c",
+                OrExpr((AndExpr((TagTerm("a"), NotExpr(TagTerm("b")))), TagTerm("c"))),
+            ),
+            (
+                "precedence",
+                "a | b & c",
+                OrExpr((TagTerm("a"), AndExpr((TagTerm("b"), TagTerm("c"))))),
+            ),
+            (
+                "flattened",
+                "a & (b & (c & a))",
+                AndExpr((TagTerm("a"), TagTerm("b"), TagTerm("c"))),
+            ),
+            ("double negation", "!!a", TagTerm("a")),
+            ("unquoted predicate", "under:/home/dino", PathUnderTerm("/home/dino")),
+            ("spaced predicate", 'under: "/home/dino"', PathUnderTerm("/home/dino")),
+        ]
+    )
+    def test_parse_query(self, _, query_str, exp_expr):
+        self.assertEqual(db_query.parse_query(query_str), exp_expr)
+
+    @parameterized.expand(
+        [
+            ("empty", "  "),
+            ("trailing operator", "a &"),
+            ("missing operator", "a b"),
+            ("unbalanced opening parenthesis", "(a | b"),
+            ("unbalanced closing parenthesis", "a)"),
+            ("unterminated string", 'a & "b'),
+            ("missing predicate argument", "path:"),
+            ("operator as predicate argument", "path: !a"),
+        ]
+    )
+    def test_parse_query_invalid(self, _, query_str):
+        with self.assertRaises(db_query.QuerySyntaxError):
+            db_query.parse_query(query_str)
+
+    @parameterized.expand(
+        [
+            ("tag", "a", {1, 2}),
+            ("or", "a | c", {1, 2, 4}),
+            ("and", "a & b", {2}),
+            ("and not", "a & !b", {1}),
+            ("not", "!a", {3, 4, 5}),
+            ("not or", "!(a | b)", {4, 5}),
+            ("nested", "(a | c) & !(b & path:x)", {1, 4}),
+            ("unknown", "a & !z", {1, 2}),
+        ]
+    )
+    def test_evaluate_query(self, _, query_str, exp_doc_ids):
+        doc_ids_by_term = {
+            TagTerm("a"): Bitmap({1, 2}),
+            TagTerm("b"): Bitmap({2, 3}),
+            TagTerm("c"): Bitmap({4}),
+            PathContainsTerm("x"): Bitmap({1, 2, 3}),
+        }
+        all_doc_ids_calls = []
+
+        def get_all_doc_ids():
+            all_doc_ids_calls.append(None)
+            return Bitmap({1, 2, 3, 4, 5})
+
+        doc_ids = db_query.evaluate_query(
+            db_query.parse_query(query_str),
+            lambda term: doc_ids_by_term.get(term, Bitmap()),
+            get_all_doc_ids,
+        )
+        self.assertEqual(set(doc_ids), exp_doc_ids)
+        self.assertEqual(bool(all_doc_ids_calls), query_str.startswith("!"))
+        self.assertEqual(set(doc_ids_by_term[TagTerm("a")]), {1, 2})
+
+    def test_evaluate_query_estimates(self):
+        evaluated_terms = []
+
+        def get_term_doc_ids(term):
+            evaluated_terms.append(term.name)
+            return Bitmap({1, 2, 3}) if term.name != "empty" else Bitmap()
+
+        counts = {"rare": 1, "common": 100, "empty": 0, "rare2": 2, "common2": 50}
+        doc_ids = db_query.evaluate_query(
+            db_query.parse_query("common & rare & !common2 & !rare2"),
+            get_term_doc_ids,
+            Bitmap,
+            lambda term: counts.get(term.name, 10),
+        )
+        self.assertEqual(set(doc_ids), set())
+        self.assertEqual(evaluated_terms, ["rare", "common", "rare2"])
+        evaluated_terms.clear()
+        doc_ids = db_query.evaluate_query(
+            db_query.parse_query("common & (rare | common) & empty"),
+            get_term_doc_ids,
+            Bitmap,
+            lambda term: counts.get(term.name, 10),
+        )
+        self.assertEqual(set(doc_ids), set())
+        self.assertEqual(evaluated_terms, ["empty"])
@@ -0,0 +1,118 @@
+import json
+import logging
+import os
+import shutil
+import unittest
+from io import StringIO
+from tempfile import NamedTemporaryFile
+from unittest import mock
+
+from django.apps import apps
+from django.core.management import CommandError, call_command
+from parameterized import parameterized
+
+from pathtagger import db_operations, db_serializers, urls
+from Tagger import params
+
+
+class TestDbSerializers(unittest.TestCase):
+    def setUp(self):
+        logging.disable(logging.CRITICAL)
+        self.data = {
+            "_default": {1: {"path": "/foo/čćž", "tag_ids": [2, 1]}},
+            "tags": {"1": {"name": "Foo", "color": "#000000"}},
+        }
+
+    def tearDown(self):
+        logging.disable(logging.NOTSET)
+
+    @parameterized.expand(
+        [
+            ("json", db_serializers.JSONSerializer),
+            ("pretty", db_serializers.PrettyJSONSerializer),
+            ("orjson", db_serializers.OrjsonSerializer),
+        ]
+    )
+    def test_round_trip(self, name, serializer_cls):
+        if name == "orjson" and db_serializers.orjson is None:
+            self.skipTest("orjson is not installed")
+        serializer = serializer_cls()
+        self.assertEqual(
+            serializer.loads(serializer.dumps(self.data)),
+            {
+                "_default": {"1": {"path": "/foo/čćž", "tag_ids": [2, 1]}},
+                "tags": {"1": {"name": "Foo", "color": "#000000"}},
+            },
+        )
+
+    def test_compact(self):
+        self.assertEqual(
+            db_serializers.JSONSerializer.dumps(self.data).decode("utf-8"),
+            '{"_default":{"1":{"path":"/foo/čćž","tag_ids":[2,1]}},'
+            '"tags":{"1":{"name":"Foo","color":"#000000"}}}',
+        )
+
+    def test_pretty(self):
+        self.assertTrue(
+            db_serializers.PrettyJSONSerializer.dumps(self.data)
+            .decode("utf-8")
+            .startswith('{\n    "_default": {\n        "1": {\n            "path": ')
+        )
+
+    @parameterized.expand(
+        [
+            ("auto", True, db_serializers.OrjsonSerializer),
+            ("auto", False, db_serializers.JSONSerializer),
+            ("json", True, db_serializers.JSONSerializer),
+            # pretty-printed records would span several lines of the journal
+            ("pretty", True, db_serializers.JSONSerializer),
+            ("orjson", True, db_serializers.OrjsonSerializer),
+            ("orjson", False, db_serializers.JSONSerializer),
+            ("foo", True, db_serializers.JSONSerializer),
+        ]
+    )
+    def test_get_serializer(self, name, orjson_installed, exp_serializer_cls):
+        with mock.patch.object(
+            db_serializers, "orjson", mock.sentinel.orjson if orjson_installed else None
+        ):
+            self.assertIs(type(db_serializers.get_serializer(name)), exp_serializer_cls)
+
+
+class TestExportDbCommand(unittest.TestCase):
+    def setUp(self):
+        logging.disable(logging.CRITICAL)
+        self.tmp_file_names = []
+        for _ in range(2):
+            with NamedTemporaryFile(delete=False) as tmp_file:
+                self.tmp_file_names.append(tmp_file.name)
+        shutil.copyfile(
+            apps.get_app_config(urls.app_name).path + "/test/resources/TaggerDB.json",
+            self.tmp_file_names[0],
+        )
+        self.db_path_prev = params.DB_PATH
+        params.DB_PATH = self.tmp_file_names[0]
+        db_operations.DB = db_operations.load_db(self.tmp_file_names[0])
+
+    def tearDown(self):
+        params.DB_PATH = self.db_path_prev
+        for tmp_file_name in self.tmp_file_names:
+            os.remove(tmp_file_name)
+        logging.disable(logging.NOTSET)
+
+    def test_export_db(self):
+        db_operations.insert_tag("Pictures", "#000000")
+        export_path = self.tmp_file_names[1]
+        call_command("export_db", export_path, stdout=StringIO())
+        with open(export_path, "rt", encoding="utf-8") as export_file:
+            content = export_file.read()
+        self.assertTrue(content.startswith('{\n    "'))
+        data = json.loads(content)
+        self.assertEqual(data, db_operations.get_db_data())
+        self.assertEqual(data["tags"]["4"], {"name": "Pictures", "color": "#000000"})
+        self.assertEqual(data["_default"]["1"]["path"], "/home/dino/Music")
+
+    def test_export_db_invalid_target(self):
+        with self.assertRaises(CommandError):
+            call_command(
+                "export_db", self.tmp_file_names[1] + "/foo.json", stdout=StringIO()
+            )
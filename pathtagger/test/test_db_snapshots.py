@@ -0,0 +1,165 @@
+import json
+import logging
+import os
+import threading
+import unittest.mock
+from tempfile import NamedTemporaryFile
+
+from django.apps import apps
+from parameterized import parameterized
+
+from pathtagger import db_binary_format, db_operations, urls
+from pathtagger.db_snapshots import Snapshot
+from Tagger import params
+
+
+class TestSnapshot(unittest.TestCase):
+    @parameterized.expand([("read", str), ("written", int)])
+    def test_table(self, _, key_type):
+        snapshot = Snapshot(
+            1,
+            {
+                "_default": {
+                    key_type(3): {"path": "/baz", "tag_ids": [2]},
+                    key_type(1): {"path": "/foo", "tag_ids": [1]},
+                    key_type(2): {"path": "/bar", "tag_ids": [1, 2]},
+                }
+            },
+        )
+        table = snapshot.table()
+        self.assertEqual(len(table), 3)
+        self.assertEqual(table.get_doc_ids(), {1, 2, 3})
+        self.assertEqual(table.get(2), {"path": "/bar", "tag_ids": [1, 2]})
+        self.assertEqual(table.get(2).doc_id, 2)
+        self.assertIsNone(table.get(4))
+        self.assertEqual([doc.doc_id for doc in table.get_multiple([3, 1, 4])], [1, 3])
+        self.assertEqual([doc.doc_id for doc in table.all()], [3, 1, 2])
+        self.assertEqual(len(snapshot.table("tags")), 0)
+
+    def test_documents_are_copies(self):
+        record = {"path": "/foo", "tag_ids": [1]}
+        table = Snapshot(1, {"_default": {"1": record}}).table()
+        table.get(1)["path"] = "/bar"
+        self.assertEqual(record, {"path": "/foo", "tag_ids": [1]})
+
+    def test_index(self):
+        snapshot = Snapshot(
+            1,
+            {
+                "_default": {
+                    "1": {"path": "/foo", "tag_ids": [1]},
+                    "2": {"path": "/foo/bar", "tag_ids": [1, 2]},
+                }
+            },
+        )
+        tag_index = snapshot.table().index("tag_ids")
+        self.assertEqual(set(tag_index.get_doc_ids(1)), {1, 2})
+        self.assertEqual(snapshot.table().index("path").get_doc_ids_under("/foo"), {2})
+        # the indexes are built once per snapshot
+        self.assertIs(snapshot.table().index("tag_ids"), tag_index)
+
+    def test_index_of_live_table(self):
+        live_table = unittest.mock.Mock()
+        table = Snapshot(1, {"_default": {}}).table("_default", live_table)
+        self.assertIs(table.index("tag_ids"), live_table.index.return_value)
+        live_table.index.assert_called_once_with("tag_ids")
+
+
+class TestDbOperationsSnapshot(unittest.TestCase):
+    def setUp(self):
+        logging.disable(logging.CRITICAL)
+        test_db_path_str = (
+            apps.get_app_config(urls.app_name).path + "/test/resources/TaggerDB.json"
+        )
+        with open(test_db_path_str, "rt", encoding="utf-8") as ref_db_file:
+            self.data = json.load(ref_db_file)
+        with NamedTemporaryFile(delete=False) as db_tmp_file:
+            self.db_tmp_file_name = db_tmp_file.name
+        self.db_storage_prev = params.DB_STORAGE
+        params.DB_PATH = self.db_tmp_file_name
+        params.BASE_PATH = None
+
+    def tearDown(self):
+        params.DB_STORAGE = self.db_storage_prev
+        for suffix in ("", ".journal"):
+            if os.path.exists(self.db_tmp_file_name + suffix):
+                os.remove(self.db_tmp_file_name + suffix)
+        logging.disable(logging.NOTSET)
+
+    def _load_db(self, db_storage: str):
+        params.DB_STORAGE = db_storage
+        if db_storage in ("binary", "mmap"):
+            with open(self.db_tmp_file_name, "wb") as db_file:
+                db_binary_format.dump(self.data, db_file)
+        else:
+            with open(self.db_tmp_file_name, "wt", encoding="utf-8") as db_file:
+                json.dump(self.data, db_file)
+        db_operations.DB = db_operations.load_db(self.db_tmp_file_name)
+
+    def _get_state(self):
+        return (
+            [
+                mapping.doc_id
+                for mapping in db_operations.get_filtered_mappings([1], [])
+            ],
+            [mapping.doc_id for mapping in db_operations.get_all_mappings()],
+            db_operations.get_tag(name="Music"),
+            db_operations.get_mapping(db_path_str="/foo"),
+            db_operations.get_tag_occurrence_counts(),
+            db_operations.get_mappings_count(),
+        )
+
+    @parameterized.expand([("json",), ("journal",), ("binary",), ("mmap",)])
+    def test_snapshot_isolated_from_writes(self, db_storage):
+        self._load_db(db_storage)
+
+        def write():
+            db_operations.insert_mapping("/foo", [1])
+            db_operations.update_tag(1, "Audio", "#000000")
+            db_operations.delete_mappings([1, 2])
+
+        with db_operations.snapshot():
+            exp_state = self._get_state()
+            self.assertEqual(exp_state[0], [1, 4, 5])
+            writer = threading.Thread(target=write)
+            writer.start()
+            writer.join()
+            self.assertEqual(self._get_state(), exp_state)
+        self.assertEqual(
+            [
+                mapping.doc_id
+                for mapping in db_operations.get_filtered_mappings([1], [])
+            ],
+            [4, 5, 7],
+        )
+        self.assertIsNone(db_operations.get_tag(name="Music"))
+
+    def test_writes_within_snapshot(self):
+        self._load_db("json")
+        with db_operations.snapshot():
+            tag_id = db_operations.insert_tag("Pictures", "#000000")
+            # writes see the live data
+            self.assertIsNone(db_operations.insert_tag("Pictures", "#000000"))
+            self.assertIsNone(db_operations.get_tag(tag_id=tag_id))
+        self.assertEqual(db_operations.get_tag(tag_id=tag_id)["name"], "Pictures")
+
+    @parameterized.expand([("json",), ("mmap",)])
+    def test_get_snapshot(self, db_storage):
+        self._load_db(db_storage)
+        snapshot = db_operations.get_snapshot()
+        self.assertIs(db_operations.get_snapshot(), snapshot)
+        db_operations.insert_tag("Pictures", "#000000")
+        db_operations.update_mapping_path(1, "/foo")
+        other_snapshot = db_operations.get_snapshot()
+        self.assertGreater(other_snapshot.version, snapshot.version)
+        self.assertEqual(len(snapshot.table("tags")), 3)
+        self.assertEqual(len(other_snapshot.table("tags")), 4)
+        self.assertEqual(snapshot.table().get(1)["path"], "/home/dino/Music")
+        self.assertEqual(other_snapshot.table().get(1)["path"], "/foo")
+        # pylint: disable=protected-access
+        if db_storage == "json":
+            # the tables that did not change are shared
+            self.assertIs(
+                other_snapshot._tables["favorite_paths"],
+                snapshot._tables["favorite_paths"],
+            )
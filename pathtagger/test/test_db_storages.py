@@ -0,0 +1,641 @@
+import glob
+import json
+import logging
+import os
+import time
+import unittest
+from tempfile import NamedTemporaryFile
+from unittest import mock
+
+from django.core.signals import request_finished
+from parameterized import parameterized
+from tinydb import TinyDB
+from tinydb.storages import JSONStorage
+
+from pathtagger import apps, db_binary_format, db_operations, db_serializers
+from pathtagger.db_indexes import IndexedTable
+from pathtagger.db_locks import FileLock
+from pathtagger.db_serializers import (
+    JSONSerializer,
+    OrjsonSerializer,
+    PrettyJSONSerializer,
+)
+from pathtagger.db_storages import (
+    BinaryStorage,
+    JournalStorage,
+    JSONFileStorage,
+    LazyStorageProxy,
+    MmapStorage,
+    ShardedStorage,
+    WriteBehindCachingMiddleware,
+)
+
+
+# pylint: disable=protected-access
+class TestWriteBehindCachingMiddleware(unittest.TestCase):
+    def setUp(self):
+        logging.disable(logging.CRITICAL)
+        with NamedTemporaryFile(mode="wt", delete=False) as db_tmp_file:
+            self.db_tmp_file_name = db_tmp_file.name
+
+    def tearDown(self):
+        os.remove(self.db_tmp_file_name)
+        logging.disable(logging.NOTSET)
+
+    def _load_db(self, **kwargs):
+        return TinyDB(
+            self.db_tmp_file_name,
+            storage=WriteBehindCachingMiddleware(JSONStorage, **kwargs),
+        )
+
+    def _stored_paths(self):
+        with open(self.db_tmp_file_name, "rt", encoding="utf-8") as db_file:
+            if not (content := db_file.read()):
+                return []
+        return sorted(doc["path"] for doc in json.loads(content)["_default"].values())
+
+    def test_flush_every_write(self):
+        tiny_db = self._load_db()
+        tiny_db.insert({"path": "/foo"})
+        self.assertEqual(self._stored_paths(), ["/foo"])
+        self.assertFalse(tiny_db.storage.is_dirty)
+
+    def test_flush_every_n_writes(self):
+        tiny_db = self._load_db(flush_every_n_writes=3)
+        tiny_db.insert({"path": "/foo"})  # also counts the default table creation
+        self.assertEqual(self._stored_paths(), [])
+        self.assertTrue(tiny_db.storage.is_dirty)
+        self.assertEqual([doc["path"] for doc in tiny_db.all()], ["/foo"])
+        tiny_db.insert({"path": "/bar"})
+        self.assertEqual(self._stored_paths(), ["/bar", "/foo"])
+        self.assertFalse(tiny_db.storage.is_dirty)
+
+    def test_flush_interval(self):
+        tiny_db = self._load_db(flush_every_n_writes=0, flush_interval_ms=50)
+        tiny_db.insert({"path": "/foo"})
+        self.assertEqual(self._stored_paths(), [])
+        deadline = time.monotonic() + 5
+        while tiny_db.storage.is_dirty and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(self._stored_paths(), ["/foo"])
+
+    def test_flush(self):
+        tiny_db = self._load_db(flush_every_n_writes=0)
+        tiny_db.insert({"path": "/foo"})
+        self.assertEqual(self._stored_paths(), [])
+        tiny_db.storage.flush()
+        self.assertEqual(self._stored_paths(), ["/foo"])
+
+    def test_close(self):
+        tiny_db = self._load_db(flush_every_n_writes=0, flush_interval_ms=60000)
+        tiny_db.insert({"path": "/foo"})
+        tiny_db.close()
+        self.assertEqual(self._stored_paths(), ["/foo"])
+        self.assertIsNone(tiny_db.storage._flush_timer)
+
+    def test_reload(self):
+        tiny_db = self._load_db()
+        other_tiny_db = self._load_db()
+        tiny_db.insert({"path": "/foo"})
+        tiny_db.insert({"path": "/bar"})
+        self.assertEqual(other_tiny_db.all(), [])
+        self.assertEqual(other_tiny_db.storage.reload(), {"_default": {"1", "2"}})
+        self.assertEqual([doc["path"] for doc in other_tiny_db.all()], ["/foo", "/bar"])
+        tiny_db.update({"path": "/baz"}, doc_ids=[2])
+        self.assertEqual(other_tiny_db.storage.reload(), {"_default": {"2"}})
+        self.assertEqual(other_tiny_db.get(doc_id=2), {"path": "/baz"})
+
+    def test_generation(self):
+        file_lock = FileLock(self.db_tmp_file_name + ".lock")
+        other_file_lock = FileLock(self.db_tmp_file_name + ".lock")
+        try:
+            tiny_db = self._load_db(flush_every_n_writes=0, file_lock=file_lock)
+            other_tiny_db = self._load_db(file_lock=other_file_lock)
+            tiny_db.storage.flush()
+            other_tiny_db.storage.reload()
+            generation = file_lock.get_generation()
+            tiny_db.insert({"path": "/foo"})
+            self.assertFalse(other_tiny_db.storage.is_stale)
+            tiny_db.storage.flush()
+            self.assertEqual(file_lock.synced_generation, generation + 1)
+            self.assertFalse(tiny_db.storage.is_stale)
+            self.assertTrue(other_tiny_db.storage.is_stale)
+            other_tiny_db.storage.reload()
+            self.assertFalse(other_tiny_db.storage.is_stale)
+            self.assertEqual(other_file_lock.synced_generation, generation + 1)
+        finally:
+            os.remove(file_lock.path)
+
+
+class TestFlushDbOnRequestFinished(unittest.TestCase):
+    def setUp(self):
+        logging.disable(logging.CRITICAL)
+        with NamedTemporaryFile(mode="wt", delete=False) as db_tmp_file:
+            self.db_tmp_file_name = db_tmp_file.name
+        self.db_prev = db_operations.DB
+        db_operations.DB = TinyDB(
+            self.db_tmp_file_name,
+            storage=WriteBehindCachingMiddleware(JSONStorage, flush_every_n_writes=0),
+        )
+
+    def tearDown(self):
+        request_finished.disconnect(dispatch_uid="pathtagger_flush_db")
+        db_operations.DB = self.db_prev
+        os.remove(self.db_tmp_file_name)
+        logging.disable(logging.NOTSET)
+
+    def test_flush_db_on_request_finished(self):
+        request_finished.connect(
+            apps.flush_db_on_request_finished, dispatch_uid="pathtagger_flush_db"
+        )
+        db_operations.DB.insert({"path": "/foo"})
+        self.assertTrue(db_operations.DB.storage.is_dirty)
+        request_finished.send(sender=self.__class__)
+        self.assertFalse(db_operations.DB.storage.is_dirty)
+
+
+class TestJSONFileStorage(unittest.TestCase):
+    def setUp(self):
+        logging.disable(logging.CRITICAL)
+        with NamedTemporaryFile(delete=False) as db_tmp_file:
+            self.db_tmp_file_name = db_tmp_file.name
+
+    def tearDown(self):
+        os.remove(self.db_tmp_file_name)
+        logging.disable(logging.NOTSET)
+
+    def test_write_compact(self):
+        tiny_db = TinyDB(self.db_tmp_file_name, storage=JSONFileStorage)
+        tiny_db.insert({"path": "/foo/čćž", "tag_ids": [1, 2]})
+        with open(self.db_tmp_file_name, "rt", encoding="utf-8") as db_file:
+            self.assertEqual(
+                db_file.read(),
+                '{"_default":{"1":{"path":"/foo/čćž","tag_ids":[1,2]}}}',
+            )
+
+    @parameterized.expand(
+        [
+            ("json", JSONSerializer()),
+            ("pretty", PrettyJSONSerializer()),
+            ("orjson", OrjsonSerializer()),
+        ]
+    )
+    def test_read_written(self, _, serializer):
+        if serializer.name == "orjson" and db_serializers.orjson is None:
+            self.skipTest("orjson is not installed")
+        storage = JSONFileStorage(self.db_tmp_file_name, serializer=serializer)
+        storage.write({"_default": {1: {"path": "/foo"}}, "tags": {}})
+        # files written by any serializer are read by the others
+        self.assertEqual(
+            JSONFileStorage(self.db_tmp_file_name).read(),
+            {"_default": {"1": {"path": "/foo"}}, "tags": {}},
+        )
+
+    def test_read_empty(self):
+        self.assertIsNone(JSONFileStorage(self.db_tmp_file_name).read())
+
+
+class TestJournalStorage(unittest.TestCase):
+    def setUp(self):
+        logging.disable(logging.CRITICAL)
+        with NamedTemporaryFile(mode="wt", delete=False) as db_tmp_file:
+            db_tmp_file.write(
+                json.dumps({"_default": {"1": {"path": "/foo"}, "2": {"path": "/bar"}}})
+            )
+            self.db_tmp_file_name = db_tmp_file.name
+        self.journal_path = self.db_tmp_file_name + JournalStorage.JOURNAL_SUFFIX
+        self.compacting_journal_path = (
+            self.db_tmp_file_name + JournalStorage.COMPACTING_JOURNAL_SUFFIX
+        )
+
+    def tearDown(self):
+        for path in (
+            self.db_tmp_file_name,
+            self.journal_path,
+            self.compacting_journal_path,
+        ):
+            if os.path.exists(path):
+                os.remove(path)
+        logging.disable(logging.NOTSET)
+
+    def _load_db(self, **kwargs):
+        return TinyDB(self.db_tmp_file_name, storage=JournalStorage, **kwargs)
+
+    def _journal_records(self):
+        with open(self.journal_path, "rt", encoding="utf-8") as journal_file:
+            return [json.loads(line) for line in journal_file]
+
+    def test_read_snapshot(self):
+        tiny_db = self._load_db()
+        self.assertEqual([doc["path"] for doc in tiny_db.all()], ["/foo", "/bar"])
+        tiny_db.close()
+        self.assertEqual(self._journal_records(), [])
+
+    def test_write_appends_changed_documents_only(self):
+        tiny_db = self._load_db()
+        tiny_db.insert({"path": "/baz"})
+        tiny_db.update({"path": "/qux"}, doc_ids=[1])
+        tiny_db.remove(doc_ids=[2])
+        tiny_db.table("tags")
+        tiny_db.close()
+        self.assertEqual(
+            self._journal_records(),
+            [
+                {
+                    "op": "upsert",
+                    "table": "_default",
+                    "doc_id": "3",
+                    "doc": {"path": "/baz"},
+                },
+                {
+                    "op": "upsert",
+                    "table": "_default",
+                    "doc_id": "1",
+                    "doc": {"path": "/qux"},
+                },
+                {"op": "remove", "table": "_default", "doc_id": "2"},
+                {"op": "create", "table": "tags"},
+            ],
+        )
+
+    def test_replay_other_serializer(self):
+        if db_serializers.orjson is None:
+            self.skipTest("orjson is not installed")
+        tiny_db = self._load_db(serializer=OrjsonSerializer())
+        tiny_db.insert({"path": "/čćž"})
+        tiny_db.close()
+        tiny_db = self._load_db(serializer=JSONSerializer())
+        self.assertEqual(
+            [doc["path"] for doc in tiny_db.all()], ["/foo", "/bar", "/čćž"]
+        )
+        tiny_db.close()
+
+    @parameterized.expand(
+        [(name,) for name in db_serializers.SERIALIZERS],
+    )
+    def test_replay_serializer(self, name):
+        if name == "orjson" and db_serializers.orjson is None:
+            self.skipTest("orjson is not installed")
+        tiny_db = self._load_db(serializer=db_serializers.get_serializer(name))
+        tiny_db.insert({"path": "/baz", "tag_ids": [1, 2]})
+        tiny_db.table("tags").insert({"name": "Foo", "color": "#000000"})
+        tiny_db.close()
+        journal_size = os.path.getsize(self.journal_path)
+        tiny_db = self._load_db(serializer=db_serializers.get_serializer(name))
+        self.assertEqual(
+            [doc["path"] for doc in tiny_db.all()], ["/foo", "/bar", "/baz"]
+        )
+        self.assertEqual(
+            tiny_db.table("tags").all(), [{"name": "Foo", "color": "#000000"}]
+        )
+        tiny_db.close()
+        self.assertEqual(os.path.getsize(self.journal_path), journal_size)
+
+    def test_replay(self):
+        tiny_db = self._load_db()
+        tiny_db.insert({"path": "/baz"})
+        tiny_db.remove(doc_ids=[1])
+        tiny_db.purge_table("tags")
+        tiny_db.close()
+        tiny_db = self._load_db()
+        self.assertEqual(
+            {doc.doc_id: doc["path"] for doc in tiny_db.all()}, {2: "/bar", 3: "/baz"}
+        )
+        tiny_db.close()
+
+    def test_replay_truncates_incomplete_record(self):
+        tiny_db = self._load_db()
+        tiny_db.insert({"path": "/baz"})
+        tiny_db.close()
+        with open(self.journal_path, "at", encoding="utf-8") as journal_file:
+            journal_file.write('{"op": "remove", "table": "_def')
+        tiny_db = self._load_db()
+        tiny_db.insert({"path": "/qux"})
+        tiny_db.close()
+        tiny_db = self._load_db()
+        self.assertEqual(
+            [doc["path"] for doc in tiny_db.all()], ["/foo", "/bar", "/baz", "/qux"]
+        )
+        tiny_db.close()
+
+    def test_compaction(self):
+        tiny_db = self._load_db(compaction_threshold=1)
+        tiny_db.insert({"path": "/baz"})
+        tiny_db.close()
+        self.assertFalse(os.path.exists(self.compacting_journal_path))
+        self.assertEqual(os.path.getsize(self.journal_path), 0)
+        with open(self.db_tmp_file_name, "rt", encoding="utf-8") as db_file:
+            self.assertEqual(
+                json.load(db_file),
+                {
+                    "_default": {
+                        "1": {"path": "/foo"},
+                        "2": {"path": "/bar"},
+                        "3": {"path": "/baz"},
+                    }
+                },
+            )
+
+    def test_interrupted_compaction(self):
+        tiny_db = self._load_db()
+        tiny_db.insert({"path": "/baz"})
+        tiny_db.close()
+        os.replace(self.journal_path, self.compacting_journal_path)
+        with open(self.journal_path, "wt", encoding="utf-8") as journal_file:
+            journal_file.write(
+                json.dumps({"op": "remove", "table": "_default", "doc_id": "1"}) + "\n"
+            )
+        tiny_db = self._load_db()
+        self.assertFalse(os.path.exists(self.compacting_journal_path))
+        self.assertEqual([doc["path"] for doc in tiny_db.all()], ["/bar", "/baz"])
+        tiny_db.close()
+
+    def test_reload(self):
+        storage = JournalStorage(self.db_tmp_file_name)
+        other_storage = JournalStorage(self.db_tmp_file_name)
+        data = storage.read()
+        data["_default"]["3"] = {"path": "/baz"}
+        del data["_default"]["1"]
+        data["tags"] = {"1": {"name": "foo"}}
+        storage.write(data)
+        self.assertEqual(
+            other_storage.reload(), {"_default": {"1", "3"}, "tags": {"1"}}
+        )
+        self.assertEqual(other_storage.read(), data)
+        data = other_storage.read()
+        del data["tags"]
+        other_storage.write(data)
+        self.assertEqual(storage.reload(), {"tags": {"1"}})
+        self.assertEqual(storage.reload(), {})
+        self.assertEqual(storage.read(), data)
+        storage.close()
+        other_storage.close()
+
+    def test_reload_after_compaction(self):
+        storage = JournalStorage(
+            self.db_tmp_file_name,
+            compaction_threshold=1,
+            compact_in_background=False,
+        )
+        other_storage = JournalStorage(self.db_tmp_file_name)
+        data = storage.read()
+        data["_default"]["3"] = {"path": "/baz"}
+        storage.write(data)
+        self.assertFalse(os.path.exists(self.compacting_journal_path))
+        self.assertEqual(os.path.getsize(self.journal_path), 0)
+        self.assertIsNone(other_storage.reload())
+        self.assertEqual(other_storage.read(), data)
+        data["_default"]["4"] = {"path": "/qux"}
+        other_storage.write(data)
+        self.assertEqual(storage.reload(), {"_default": {"4"}})
+        storage.close()
+        other_storage.close()
+
+
+class TestShardedStorage(unittest.TestCase):
+    def setUp(self):
+        logging.disable(logging.CRITICAL)
+        with NamedTemporaryFile(suffix=".json", delete=False) as db_tmp_file:
+            self.db_tmp_file_name = db_tmp_file.name
+        self.media_shard_path = self.db_tmp_file_name[: -len(".json")] + (
+            ".shard-media.json"
+        )
+        self.data = {
+            "_default": {
+                "1": {"path": "/media/foo", "tag_ids": [1]},
+                "2": {"path": "/home/bar", "tag_ids": [1]},
+            },
+            "tags": {"1": {"name": "Foo"}},
+        }
+
+    def tearDown(self):
+        for path in glob.glob(
+            glob.escape(self.db_tmp_file_name[: -len(".json")]) + "*"
+        ):
+            os.remove(path)
+        logging.disable(logging.NOTSET)
+
+    def _get_storage(self, storage_cls=JSONStorage):
+        return ShardedStorage(
+            self.db_tmp_file_name,
+            storage_cls=storage_cls,
+            get_shard_name=lambda db_path_str: (
+                db_path_str.split("/")[1]
+                if db_path_str.startswith(("/media/", "/mnt/"))
+                else None
+            ),
+        )
+
+    def _read_json(self, path):
+        with open(path, "rt", encoding="utf-8") as db_file:
+            return json.load(db_file)
+
+    def test_write_and_read(self):
+        self._get_storage().write(self.data)
+        self.assertEqual(
+            self._read_json(self.db_tmp_file_name),
+            {
+                "_default": {"2": {"path": "/home/bar", "tag_ids": [1]}},
+                "tags": {"1": {"name": "Foo"}},
+            },
+        )
+        self.assertEqual(
+            self._read_json(self.media_shard_path),
+            {"_default": {"1": {"path": "/media/foo", "tag_ids": [1]}}},
+        )
+        self.assertEqual(self._get_storage().read(), self.data)
+
+    def test_write_changed_files_only(self):
+        storage = self._get_storage()
+        storage.write(self.data)
+        with mock.patch.object(
+            JSONStorage, "write", autospec=True, side_effect=JSONStorage.write
+        ) as write:
+            storage.write(
+                {
+                    **self.data,
+                    "_default": {**self.data["_default"], "3": {"path": "/media/baz"}},
+                }
+            )
+            self.assertEqual(
+                [call.args[0]._handle.name for call in write.call_args_list],
+                [self.media_shard_path],
+            )
+            write.reset_mock()
+            # moving a mapping to another shard writes both files
+            storage.write(
+                {
+                    **self.data,
+                    "_default": {
+                        1: {"path": "/home/foo", "tag_ids": [1]},
+                        2: {"path": "/home/bar", "tag_ids": [1]},
+                    },
+                }
+            )
+            self.assertEqual(
+                [call.args[0]._handle.name for call in write.call_args_list],
+                [self.media_shard_path, self.db_tmp_file_name],
+            )
+        self.assertEqual(self._read_json(self.media_shard_path), {"_default": {}})
+        self.assertEqual(len(self._get_storage().read()["_default"]), 2)
+
+    def test_reload(self):
+        storage = self._get_storage(JournalStorage)
+        storage.write(self.data)
+        self.assertEqual(storage.reload(), {})
+        data = {
+            **self.data,
+            "_default": {
+                **self.data["_default"],
+                "3": {"path": "/home/baz", "tag_ids": [1]},
+            },
+        }
+        self._get_storage(JournalStorage).write(data)
+        self.assertEqual(storage.reload(), {"_default": {"3"}})
+        data["_default"]["4"] = {"path": "/mnt/qux", "tag_ids": [1]}
+        self._get_storage(JournalStorage).write(data)
+        # the documents of a new shard are unknown
+        self.assertIsNone(storage.reload())
+        self.assertEqual(storage.read(), data)
+
+
+class TestBinaryStorage(unittest.TestCase):
+    def setUp(self):
+        with NamedTemporaryFile(mode="wt", delete=False) as db_tmp_file:
+            self.db_tmp_file_name = db_tmp_file.name
+
+    def tearDown(self):
+        os.remove(self.db_tmp_file_name)
+
+    def test_write_and_read(self):
+        tiny_db = TinyDB(self.db_tmp_file_name, storage=BinaryStorage)
+        tiny_db.insert({"path": "/foo", "tag_ids": ["1", "2"]})
+        tiny_db.table("tags").insert({"name": "Foo", "color": "#000000"})
+        self.assertTrue(db_binary_format.is_binary_file(self.db_tmp_file_name))
+        self.assertFalse(os.path.exists(self.db_tmp_file_name + ".tmp"))
+        tiny_db = TinyDB(self.db_tmp_file_name, storage=BinaryStorage)
+        self.assertEqual(tiny_db.all(), [{"path": "/foo", "tag_ids": ["1", "2"]}])
+        self.assertEqual(
+            tiny_db.table("tags").all(), [{"name": "Foo", "color": "#000000"}]
+        )
+
+    def test_read_json_database(self):
+        with open(self.db_tmp_file_name, "wt", encoding="utf-8") as db_file:
+            db_file.write(json.dumps({"_default": {"1": {"path": "/foo"}}}))
+        with self.assertRaises(db_binary_format.BinaryFormatError):
+            TinyDB(self.db_tmp_file_name, storage=BinaryStorage).all()
+
+
+class TestMmapStorage(unittest.TestCase):
+    def setUp(self):
+        with NamedTemporaryFile(mode="wb", delete=False) as db_tmp_file:
+            db_binary_format.dump(
+                {
+                    "_default": {
+                        "1": {"path": "/foo", "tag_ids": ["1"]},
+                        "2": {"path": "/bar", "tag_ids": ["1", "2"]},
+                        "3": {"path": "/baz", "tag_ids": ["2"]},
+                    },
+                    "tags": {"1": {"name": "Foo"}, "2": {"name": "Bar"}},
+                },
+                db_tmp_file,
+            )
+            self.db_tmp_file_name = db_tmp_file.name
+
+    def tearDown(self):
+        os.remove(self.db_tmp_file_name)
+
+    def _load_db(self):
+        return TinyDB(
+            self.db_tmp_file_name,
+            storage=MmapStorage,
+            table_class=IndexedTable,
+            storage_proxy_class=LazyStorageProxy,
+        )
+
+    def test_read_decodes_returned_documents_only(self):
+        with mock.patch.object(
+            db_binary_format.TableReader,
+            "decode_record",
+            autospec=True,
+            side_effect=db_binary_format.TableReader.decode_record,
+        ) as decode_record:
+            tiny_db = self._load_db()
+            self.assertEqual(len(tiny_db), 3)
+            self.assertEqual(tiny_db.get_doc_ids(), {1, 2, 3})
+            self.assertEqual(decode_record.call_count, 0)
+            self.assertEqual(
+                tiny_db.get(doc_id=2), {"path": "/bar", "tag_ids": ["1", "2"]}
+            )
+            self.assertEqual(decode_record.call_count, 1)
+            self.assertEqual(
+                [doc.doc_id for doc in tiny_db.get_multiple([3, 1, 4])], [1, 3]
+            )
+            self.assertEqual(decode_record.call_count, 3)
+
+    def test_write(self):
+        tiny_db = self._load_db()
+        tiny_db.insert({"path": "/qux", "tag_ids": ["3"]})
+        tiny_db.update({"tag_ids": []}, doc_ids=[1])
+        tiny_db.remove(doc_ids=[2])
+        tiny_db.table("favorite_paths").insert({"path": "/"})
+        self.assertEqual(
+            {doc.doc_id: doc for doc in tiny_db.all()},
+            {
+                1: {"path": "/foo", "tag_ids": []},
+                3: {"path": "/baz", "tag_ids": ["2"]},
+                4: {"path": "/qux", "tag_ids": ["3"]},
+            },
+        )
+        with open(self.db_tmp_file_name, "rb") as db_file:
+            self.assertEqual(
+                db_binary_format.load(db_file),
+                {
+                    "_default": {
+                        "1": {"path": "/foo", "tag_ids": []},
+                        "3": {"path": "/baz", "tag_ids": ["2"]},
+                        "4": {"path": "/qux", "tag_ids": ["3"]},
+                    },
+                    "tags": {"1": {"name": "Foo"}, "2": {"name": "Bar"}},
+                    "favorite_paths": {"1": {"path": "/"}},
+                },
+            )
+
+    def test_write_copies_unchanged_records(self):
+        tiny_db = self._load_db()
+        with mock.patch.object(
+            db_binary_format.TableWriter,
+            "add_document",
+            autospec=True,
+            side_effect=db_binary_format.TableWriter.add_document,
+        ) as add_document:
+            tiny_db.update({"path": "/qux"}, doc_ids=[3])
+        self.assertEqual(
+            [call.args[1:] for call in add_document.call_args_list],
+            [(3, {"path": "/qux", "tag_ids": ["2"]})],
+        )
+        self.assertEqual(
+            [doc["path"] for doc in self._load_db().all()], ["/foo", "/bar", "/qux"]
+        )
+
+    def test_copy_records(self):
+        records = MmapStorage(self.db_tmp_file_name).read()["_default"]
+        records.set_document(1, {"path": "/qux", "tag_ids": []})
+        copied_records = records.copy()
+        records.set_document(4, {"path": "/quux", "tag_ids": []})
+        records.remove_document(2)
+        records.set_document(1, {"path": "/foo", "tag_ids": []})
+        self.assertEqual(
+            dict(copied_records.items()),
+            {
+                1: {"path": "/qux", "tag_ids": []},
+                2: {"path": "/bar", "tag_ids": ["1", "2"]},
+                3: {"path": "/baz", "tag_ids": ["2"]},
+            },
+        )
+
+    def test_read_json_database(self):
+        with open(self.db_tmp_file_name, "wt", encoding="utf-8") as db_file:
+            db_file.write(json.dumps({"_default": {"1": {"path": "/foo"}}}))
+        with self.assertRaises(db_binary_format.BinaryFormatError):
+            self._load_db()
@@ -0,0 +1,502 @@
+import json
+import logging
+import os
+import threading
+import unittest
+from io import StringIO
+from tempfile import NamedTemporaryFile, TemporaryDirectory
+
+from django.apps import apps
+from django.core.management import CommandError, call_command
+from parameterized import parameterized
+
+from pathtagger import db_binary_format, db_operations, sqlite_db_operations, urls
+from Tagger import params
+
+
+# pylint: disable=too-many-public-methods
+class TestSqliteDbOperations(unittest.TestCase):
+    def setUp(self):
+        logging.disable(logging.CRITICAL)
+        test_db_path_str = (
+            apps.get_app_config(urls.app_name).path + "/test/resources/TaggerDB.json"
+        )
+        with NamedTemporaryFile(mode="wt", delete=False) as db_tmp_file:
+            with open(test_db_path_str, "rt", encoding="utf-8") as ref_db_file:
+                self.db_tmp_file_name = db_tmp_file.name
+                db_tmp_file.write(ref_db_file.read())
+        with NamedTemporaryFile(suffix=".sqlite3", delete=False) as sqlite_tmp_file:
+            self.sqlite_tmp_file_name = sqlite_tmp_file.name
+        db_operations.DB = db_operations.load_db(self.db_tmp_file_name)
+        sqlite_db_operations.DB = sqlite_db_operations.load_db(
+            self.sqlite_tmp_file_name
+        )
+        sqlite_db_operations.migrate_from_tinydb(self.db_tmp_file_name)
+        params.DB_PATH = self.db_tmp_file_name
+        params.BASE_PATH = None
+
+    def tearDown(self):
+        sqlite_db_operations.DB.close()
+        for path in (
+            self.db_tmp_file_name,
+            self.sqlite_tmp_file_name,
+            self.sqlite_tmp_file_name + "-wal",
+            self.sqlite_tmp_file_name + "-shm",
+        ):
+            if os.path.exists(path):
+                os.remove(path)
+        logging.disable(logging.NOTSET)
+
+    def assertSameState(self):  # pylint: disable=invalid-name
+        for getter_name in ("get_all_favorites", "get_all_tags", "get_all_mappings"):
+            with self.subTest(getter_name):
+                self.assertEqual(
+                    {
+                        doc.doc_id: dict(doc)
+                        for doc in getattr(sqlite_db_operations, getter_name)()
+                    },
+                    {
+                        doc.doc_id: dict(doc)
+                        for doc in getattr(db_operations, getter_name)()
+                    },
+                )
+        self.assertEqual(
+            sqlite_db_operations.get_tag_occurrence_counts(),
+            db_operations.get_tag_occurrence_counts(),
+        )
+
+    def _call_both(self, function_name, *args, **kwargs):
+        exp_result = getattr(db_operations, function_name)(*args, **kwargs)
+        act_result = getattr(sqlite_db_operations, function_name)(*args, **kwargs)
+        self.assertEqual(act_result, exp_result)
+        self.assertEqual(
+            getattr(act_result, "doc_id", None), getattr(exp_result, "doc_id", None)
+        )
+        self.assertSameState()
+        return act_result
+
+    def test_migrate_from_tinydb(self):
+        self.assertSameState()
+
+    def test_migrate_from_tinydb_into_nonempty_db(self):
+        with self.assertRaises(ValueError):
+            sqlite_db_operations.migrate_from_tinydb(self.db_tmp_file_name)
+
+    @parameterized.expand([("journal",), ("binary",), ("mmap",)])
+    def test_migrate_from_tinydb_storage(self, db_storage):
+        db_storage_prev = params.DB_STORAGE
+        params.DB_STORAGE = db_storage
+        self.addCleanup(setattr, params, "DB_STORAGE", db_storage_prev)
+        if db_storage == "journal":
+            self.addCleanup(os.remove, self.db_tmp_file_name + ".journal")
+        else:
+            with open(self.db_tmp_file_name, "rb") as db_tmp_file:
+                data = json.load(db_tmp_file)
+            with open(self.db_tmp_file_name, "wb") as db_tmp_file:
+                db_binary_format.dump(data, db_tmp_file)
+        db_operations.DB = db_operations.load_db(self.db_tmp_file_name)
+        # kept in the journal rather than the JSON file with 'journal' storage
+        db_operations.insert_tag("Foo", "#000000")
+        db_operations.append_tags_to_mappings([4], [1])
+        sqlite_db_operations.DB.close()
+        os.remove(self.sqlite_tmp_file_name)
+        sqlite_db_operations.DB = sqlite_db_operations.load_db(
+            self.sqlite_tmp_file_name
+        )
+        sqlite_db_operations.migrate_from_tinydb(self.db_tmp_file_name)
+        self.assertSameState()
+
+    def test_migrate_tinydb_to_sqlite_command(self):
+        with self.assertRaises(CommandError):
+            call_command(
+                "migrate_tinydb_to_sqlite",
+                json_path=self.db_tmp_file_name,
+                stdout=StringIO(),
+            )
+
+    @parameterized.expand(
+        [
+            ("path is None", None),
+            ("empty path", ""),
+            ("existing path", "/"),
+            ("nonexistent path", "/foo"),
+        ]
+    )
+    def test_favorites(self, _, path_str):
+        self._call_both("get_favorite", path_str)
+        self._call_both("insert_favorite", path_str)
+        self._call_both("delete_favorite", path_str)
+
+    @parameterized.expand(
+        [
+            ("by id", {"tag_id": 2}),
+            ("by name", {"name": "Videos"}),
+            ("by id and name", {"tag_id": 2, "name": "Videos"}),
+            ("by id and other name", {"tag_id": 2, "name": "Music"}),
+            ("nonexistent id", {"tag_id": 11}),
+            ("nonexistent name", {"name": "Foo"}),
+            ("empty name", {"name": ""}),
+            ("no arguments", {}),
+        ]
+    )
+    def test_get_tag(self, _, kwargs):
+        self._call_both("get_tag", **kwargs)
+
+    @parameterized.expand(
+        [
+            ("new tag", "Foo", "#000000"),
+            ("existing name", "Music", "#000000"),
+            ("invalid color", "Foo", "red"),
+            ("empty name", "", "#000000"),
+        ]
+    )
+    def test_insert_and_update_tag(self, _, name, color):
+        self._call_both("insert_tag", name, color)
+        self._call_both("update_tag", 1, name, color)
+        self._call_both("update_tag", 11, name, color)
+
+    @parameterized.expand([([1],), ([1, 2],), ([1, 2, 3],), ([3, 11],), ([],)])
+    def test_delete_tags(self, tag_ids):
+        self._call_both("delete_tags", tag_ids)
+
+    @parameterized.expand([(1,), (3,), (11,)])
+    def test_get_tag_mappings(self, tag_id):
+        self._call_both("get_tag_mappings", tag_id)
+
+    @parameterized.expand(
+        [
+            ("by id", {"mapping_id": 4}),
+            ("by path", {"db_path_str": "/media"}),
+            ("by id and path", {"mapping_id": 5, "db_path_str": "/media"}),
+            ("by id and other path", {"mapping_id": 4, "db_path_str": "/media"}),
+            ("nonexistent id", {"mapping_id": 11}),
+            ("nonexistent path", {"db_path_str": "/foo"}),
+            ("untagged mapping", {"mapping_id": 6}),
+        ]
+    )
+    def test_get_mapping(self, _, kwargs):
+        self._call_both("get_mapping", **kwargs)
+
+    @parameterized.expand(
+        [
+            ("new path, no tag_ids", "/foo", None),
+            ("new path, valid and invalid tag_ids", "/foo", [1, 12]),
+            ("existing path", "/media", [3]),
+            ("empty path", "", [1]),
+        ]
+    )
+    def test_insert_mapping(self, _, path_str, tag_ids):
+        self._call_both("insert_mapping", path_str, tag_ids)
+
+    @parameterized.expand(
+        [
+            ("own path", 1, "/home/dino/Music"),
+            ("other existent path", 1, "/home/dino/Videos"),
+            ("other nonexistent path", 1, "/foo"),
+            ("invalid id", 111, "/foo"),
+        ]
+    )
+    def test_update_mapping_path(self, _, mapping_id, db_path_str):
+        self._call_both("update_mapping_path", mapping_id, db_path_str)
+
+    @parameterized.expand([([2, 3, 4],), ([5],), ([6],), ([11],)])
+    def test_delete_mappings(self, mapping_ids):
+        self._call_both("delete_mappings", mapping_ids)
+
+    def test_remove_mappings_without_tags(self):
+        self._call_both("remove_mappings_without_tags")
+
+    def test_get_mappings_count(self):
+        self.assertEqual(self._call_both("get_mappings_count"), 6)
+        self._call_both("delete_mappings", [2, 3])
+        self.assertEqual(
+            self._call_both("get_mappings_count"),
+            len(db_operations.get_all_mappings()),
+        )
+
+    @parameterized.expand(
+        [
+            ([1, 3], [1, 2, 4, 5, 6]),
+            ([2, 11], [4, 11]),
+            ([], [1]),
+        ]
+    )
+    def test_append_and_remove_tags(self, tag_ids, mapping_ids):
+        self._call_both("append_tags_to_mappings", tag_ids, mapping_ids)
+        self._call_both("remove_tags_from_mappings", tag_ids, mapping_ids)
+
+    @parameterized.expand(
+        [
+            (
+                "append and remove",
+                [
+                    ("append_tags_to_mappings", [2], [1, 3]),
+                    ("remove_tags_from_mappings", [1], [1, 4, 5]),
+                    ("remove_tags_from_mappings", [2], [5]),
+                ],
+            ),
+            (
+                "delete and insert",
+                [
+                    ("delete_mappings", [2, 17]),
+                    ("insert_mapping", "/foo", [1, 11]),
+                    ("insert_mapping", "/media", [3]),
+                    ("insert_mapping", "/bar", [11]),
+                ],
+            ),
+        ]
+    )
+    def test_batch(self, _, operations):
+        inserted_mapping_ids = []
+        for db_ops in (db_operations, sqlite_db_operations):
+            with db_ops.batch() as mappings_batch:
+                for method_name, *args in operations:
+                    getattr(mappings_batch, method_name)(*args)
+            inserted_mapping_ids.append(mappings_batch.inserted_mapping_ids)
+        self.assertEqual(inserted_mapping_ids[1], inserted_mapping_ids[0])
+        self.assertSameState()
+
+    @parameterized.expand(
+        [
+            ([1], [], None),
+            ([1], [], "media"),
+            ([1, 2], [], "MEDIA"),
+            ([], [1], None),
+            ([], [1, 2], "jpg"),
+            ([1, 2], [3], None),
+            ([1], [2, 3], "Music"),
+            ([1], [1], None),
+            ([11], [12], None),
+            ([], [], None),
+            ([], [], None, "/home/dino"),
+            ([1], [], None, "/home/dino/"),
+            ([], [2], "o", "/home"),
+            ([], [], None, "/home/din"),
+            ([], [], None, None, "(Music | Documents) & !Videos"),
+            ([], [], None, None, '!Music | path:"WALL"'),
+            ([2], [3], "dino", None, "Music & under:/home & !path:jpg"),
+            ([], [], None, None, "!foo & !under:/"),
+            ([1], [], None, None, "Videos | Documents"),
+        ]
+    )
+    def test_get_filtered_mappings(
+        self,
+        tag_ids_to_include,
+        tag_ids_to_exclude,
+        mapping_path_like,
+        within_db_path_str=None,
+        query_str=None,
+    ):
+        self.assertEqual(
+            [
+                (mapping.doc_id, dict(mapping))
+                for mapping in sqlite_db_operations.get_filtered_mappings(
+                    tag_ids_to_include,
+                    tag_ids_to_exclude,
+                    mapping_path_like,
+                    within_db_path_str,
+                    query_str,
+                )
+            ],
+            [
+                (mapping.doc_id, dict(mapping))
+                for mapping in db_operations.get_filtered_mappings(
+                    tag_ids_to_include,
+                    tag_ids_to_exclude,
+                    mapping_path_like,
+                    within_db_path_str,
+                    query_str,
+                )
+            ],
+        )
+
+    @parameterized.expand(
+        [
+            ("/", True),
+            ("/", False),
+            ("/home", True),
+            ("/home", False),
+            ("/home/dino/", False),
+            ("/home/din", True),
+            ("/media", True),
+            ("", True),
+        ]
+    )
+    def test_get_mappings_under(self, db_path_str, recursive):
+        self.assertEqual(
+            [
+                (mapping.doc_id, dict(mapping))
+                for mapping in sqlite_db_operations.get_mappings_under(
+                    db_path_str, recursive
+                )
+            ],
+            [
+                (mapping.doc_id, dict(mapping))
+                for mapping in db_operations.get_mappings_under(db_path_str, recursive)
+            ],
+        )
+
+    @parameterized.expand(
+        [
+            (query_db_path_str, recursive)
+            for query_db_path_str in ("/", "/a", "/a/", "/a/b", "/a/bc")
+            for recursive in (True, False)
+        ]
+    )
+    def test_trailing_slash_paths(self, query_db_path_str, recursive):
+        for db_path_str in ("/", "/a/", "/a/b", "/a/b/", "/a/b/c/", "/a/bc", "/ab/"):
+            for db_module in (db_operations, sqlite_db_operations):
+                db_module.insert_mapping(db_path_str, [1])
+        self.assertSameState()
+        for getter_name, args in (
+            ("get_mappings_under", (query_db_path_str, recursive)),
+            ("get_filtered_mappings", ([], [], None, query_db_path_str, None)),
+            (
+                "get_filtered_mappings",
+                ([], [], None, None, f'under:"{query_db_path_str}"'),
+            ),
+        ):
+            with self.subTest(getter_name, args=args):
+                self.assertEqual(
+                    [
+                        mapping.doc_id
+                        for mapping in getattr(sqlite_db_operations, getter_name)(*args)
+                    ],
+                    [
+                        mapping.doc_id
+                        for mapping in getattr(db_operations, getter_name)(*args)
+                    ],
+                )
+
+    @parameterized.expand(
+        [
+            ({},),
+            ({"limit": 2, "offset": 3},),
+            ({"limit": 1, "after_mapping_id": 2},),
+            ({"after_mapping_id": 6},),
+            ({"limit": -1, "offset": -1},),
+        ]
+    )
+    def test_iter_all_mappings(self, kwargs):
+        self.assertEqual(
+            [
+                (mapping.doc_id, dict(mapping))
+                for mapping in sqlite_db_operations.iter_all_mappings(**kwargs)
+            ],
+            [
+                (mapping.doc_id, dict(mapping))
+                for mapping in db_operations.iter_all_mappings(**kwargs)
+            ],
+        )
+
+    @parameterized.expand(
+        [
+            (1, {}),
+            (1, {"limit": 2, "offset": 1}),
+            (2, {"after_mapping_id": 2}),
+            (11, {}),
+        ]
+    )
+    def test_iter_tag_mappings(self, tag_id, kwargs):
+        self.assertEqual(
+            [
+                (mapping.doc_id, dict(mapping))
+                for mapping in sqlite_db_operations.iter_tag_mappings(tag_id, **kwargs)
+            ],
+            [
+                (mapping.doc_id, dict(mapping))
+                for mapping in db_operations.iter_tag_mappings(tag_id, **kwargs)
+            ],
+        )
+
+    @parameterized.expand(
+        [
+            ([1], [], None, None, None, {}),
+            ([], [3], "dino", None, None, {"limit": 2}),
+            ([], [], "O", None, None, {"offset": 1, "limit": 2}),
+            ([], [], "ČĆ", None, None, {}),
+            ([], [], None, "/home", None, {"after_mapping_id": 2}),
+            ([], [], None, None, "Music | !Videos", {"after_mapping_id": 1}),
+        ]
+    )
+    def test_iter_filtered_mappings(
+        self,
+        tag_ids_to_include,
+        tag_ids_to_exclude,
+        db_path_str_like,
+        within_db_path_str,
+        query_str,
+        kwargs,
+    ):
+        args = (
+            tag_ids_to_include,
+            tag_ids_to_exclude,
+            db_path_str_like,
+            within_db_path_str,
+            query_str,
+        )
+        self.assertEqual(
+            [
+                (mapping.doc_id, dict(mapping))
+                for mapping in sqlite_db_operations.iter_filtered_mappings(
+                    *args, **kwargs
+                )
+            ],
+            [
+                (mapping.doc_id, dict(mapping))
+                for mapping in db_operations.iter_filtered_mappings(*args, **kwargs)
+            ],
+        )
+
+    def test_snapshot(self):
+        def get_state(db_module):
+            return (
+                [
+                    mapping.doc_id
+                    for mapping in db_module.get_filtered_mappings([1], [])
+                ],
+                db_module.get_tag(name="Music"),
+                db_module.get_tag_occurrence_counts(),
+            )
+
+        def write(db_module):
+            db_module.insert_mapping("/foo", [1])
+            db_module.update_tag(1, "Audio", "#000000")
+            db_module.delete_mappings([1, 2])
+
+        for db_module in (db_operations, sqlite_db_operations):
+            with self.subTest(db_module.__name__):
+                with db_module.snapshot():
+                    exp_state = get_state(db_module)
+                    writer = threading.Thread(target=write, args=(db_module,))
+                    writer.start()
+                    writer.join()
+                    self.assertEqual(get_state(db_module), exp_state)
+                self.assertNotEqual(get_state(db_module), exp_state)
+        self.assertSameState()
+
+
+class TestOpenDb(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = TemporaryDirectory()  # pylint: disable=consider-using-with
+        self.db_sqlite_path_prev = params.DB_SQLITE_PATH
+        params.DB_SQLITE_PATH = os.path.join(self.tmp_dir.name, "TaggerDB.sqlite3")
+        sqlite_db_operations.DB = None
+
+    def tearDown(self):
+        if sqlite_db_operations.DB is not None:
+            sqlite_db_operations.DB.close()
+        params.DB_SQLITE_PATH = self.db_sqlite_path_prev
+        self.tmp_dir.cleanup()
+
+    def test_open_on_first_use(self):
+        self.assertFalse(os.path.exists(params.DB_SQLITE_PATH))
+        with self.assertLogs("pathtagger.sqlite_db_operations", "INFO") as logs:
+            self.assertEqual(sqlite_db_operations.get_mappings_count(), 0)
+        self.assertEqual(sqlite_db_operations.DB.path, params.DB_SQLITE_PATH)
+        self.assertIn("Found 0 tags, 0 mappings, and 0 favorites.", logs.output[-1])
+
+    def test_warm_up_db(self):
+        with self.assertLogs("pathtagger.sqlite_db_operations", "DEBUG"):
+            sqlite_db_operations.warm_up_db()
+        self.assertTrue(os.path.exists(params.DB_SQLITE_PATH))
@@ -15,6 +15,7 @@ from django.urls.base import reverse
 from parameterized import parameterized
 
 from pathtagger import db_operations, urls, views
+from pathtagger.db_utils import MappingsBatch
 from pathtagger.views import MyPath
 from Tagger import params, settings
 
@@ -85,6 +86,9 @@ class Test(SimpleTestCase):
         ]
         act_extended_dataset = views._get_extended_dataset(mappings)
         self.assertTrue(len(act_extended_dataset) == len(mapping_ids))
+        self.assertFalse(
+            any(key in mapping for mapping in mappings for key in exp_keys)
+        )
         for i, act_mapping in enumerate(act_extended_dataset):
             self.assertTrue(all(key in act_mapping.keys() for key in exp_keys))
             if exp_tag_ids[i]:
@@ -618,6 +622,56 @@ class Test(SimpleTestCase):
                 with self.assertRaises(KeyError):
                     soup.select_one(f"#filter_tag_{tag_id}_exclude")["checked"]
 
+    @parameterized.expand(
+        [
+            ("folder", "/home/dino", 5, False),
+            ("trailing slash", "/home/dino/", 5, False),
+            ("nested folder", "/home/dino/Pictures", 1, False),
+            ("mapped path", "/media", -1, False),
+            ("empty", "", 6, False),
+            ("relative path", "home/dino", -1, True),
+        ]
+    )
+    @unittest.mock.patch.object(views.Path, "is_dir", return_value=True)
+    @unittest.mock.patch.object(views.Path, "exists", return_value=True)
+    def test_mappings_list_within_folder(
+        self, _, within_folder, exp_mappings_table_row_count, exp_error, *__
+    ):
+        response = self.client.get(
+            reverse(f"{urls.app_name}:mappings_list"), {"within_folder": within_folder}
+        )
+        self.assertEqual(response.status_code, 200)
+        soup = BeautifulSoup(response.content, "lxml")
+        self.assertEqual(
+            _table_row_count(soup, "mappings_table_body"), exp_mappings_table_row_count
+        )
+        self.assertEqual(
+            soup.select_one("#WithinFolderTextbox")["value"], within_folder
+        )
+        self.assertEqual(soup.select_one("#WithinFolderError") is not None, exp_error)
+
+    @parameterized.expand(
+        [
+            ("valid", "Music & !Videos", 1, False),
+            ("invalid", "Music &", 6, True),
+        ]
+    )
+    @unittest.mock.patch.object(views.Path, "is_dir", return_value=True)
+    @unittest.mock.patch.object(views.Path, "exists", return_value=True)
+    def test_mappings_list_query(
+        self, _, query_str, exp_mappings_table_row_count, exp_error, *__
+    ):
+        response = self.client.get(
+            reverse(f"{urls.app_name}:mappings_list"), {"q": query_str}
+        )
+        self.assertEqual(response.status_code, 200)
+        soup = BeautifulSoup(response.content, "lxml")
+        self.assertEqual(
+            _table_row_count(soup, "mappings_table_body"), exp_mappings_table_row_count
+        )
+        self.assertEqual(soup.select_one("#QueryTextbox")["value"], query_str)
+        self.assertEqual(soup.select_one("#QueryError") is not None, exp_error)
+
     def test_mappings_list_empty(self):
         views.db.DB.purge_table("_default")
         data = {"path_type": "all"}
@@ -754,6 +808,14 @@ class Test(SimpleTestCase):
             ),
             3,
         )
+        soup = BeautifulSoup(response.content, "lxml")
+        self.assertEqual(
+            {
+                tag_id: soup.select_one(f"#tag_{tag_id}_occurrences").text.strip()
+                for tag_id in (1, 2, 3)
+            },
+            {1: "3", 2: "3", 3: "2"},
+        )
 
         db_operations.DB.purge_tables()
         response = self.client.get(reverse(f"{urls.app_name}:tags_list"))
@@ -1233,18 +1295,19 @@ class Test(SimpleTestCase):
 
     @parameterized.expand(
         [
-            ("None", None, 0),
-            ("empty", set(), 0),
-            ("sole invalid", {""}, 0),
-            ("sole nonexistent", {"/foo"}, 1),
-            ("sole existing", {"/media"}, 1),
-            ("invalid plus nonexistent", {"", "/foo"}, 1),
-            ("invalid plus existing", {"", "/media"}, 1),
-            ("nonexisting plus existing", {"/foo", "/media"}, 2),
+            ("None", None, 0, 0),
+            ("empty", set(), 0, 0),
+            ("sole invalid", {""}, 0, 0),
+            ("sole nonexistent", {"/foo"}, 0, 1),
+            ("sole existing", {"/media"}, 1, 0),
+            ("invalid plus nonexistent", {"", "/foo"}, 0, 1),
+            ("invalid plus existing", {"", "/media"}, 1, 0),
+            ("nonexisting plus existing", {"/foo", "/media"}, 1, 1),
             (
                 "mixed",
                 {"/foo", "/media", "", "/bar", "/fubar", "/home/dino/Downloads"},
-                5,
+                2,
+                3,
             ),
         ]
     )
@@ -1253,11 +1316,18 @@ class Test(SimpleTestCase):
         _,
         raw_path_strs,
         exp_mapping_ids_count,
+        exp_inserted_mappings_count,
     ):
+        mappings_batch = MappingsBatch()
         self.assertEqual(
-            len(views._prepare_mapping_ids_for_tag_update(raw_path_strs)),
+            len(
+                views._prepare_mapping_ids_for_tag_update(
+                    raw_path_strs, mappings_batch, {1}
+                )
+            ),
             exp_mapping_ids_count,
         )
+        self.assertEqual(len(mappings_batch.db_path_strs), exp_inserted_mappings_count)
 
     @parameterized.expand(
         [
@@ -1275,8 +1345,7 @@ class Test(SimpleTestCase):
             ("3 paths, with new tag names, with current path", 1, object(), object()),
         ]
     )
-    @unittest.mock.patch.object(views.db, "remove_tags_from_mappings")
-    @unittest.mock.patch.object(views.db, "append_tags_to_mappings")
+    @unittest.mock.patch.object(views.db, "batch")
     @unittest.mock.patch.object(views, "_parse_tag_ids_to_append_and_remove")
     @unittest.mock.patch.object(views, "_prepare_mapping_ids_for_tag_update")
     def test_edit_path_tags(
@@ -1287,9 +1356,9 @@ class Test(SimpleTestCase):
         current_path_parameter,
         mock__prepare_mapping_ids_for_tag_update,
         mock__parse_tag_ids_to_append_and_remove,
-        mock_append_tags_to_mappings,
-        mock_remove_tags_from_mappings,
+        mock_batch,
     ):
+        mock_mappings_batch = mock_batch.return_value.__enter__.return_value
         raw_path_strs = {object() for _ in range(raw_path_str_parameter_count)}
         mock__parse_tag_ids_to_append_and_remove_rval1 = object()
         mock__parse_tag_ids_to_append_and_remove_rval2 = object()
@@ -1318,17 +1387,17 @@ class Test(SimpleTestCase):
             fetch_redirect_response=False,
         )
         if raw_path_str_parameter_count:
-            mock_append_tags_to_mappings.assert_called_once_with(
+            mock_batch.assert_called_once_with()
+            mock_mappings_batch.append_tags_to_mappings.assert_called_once_with(
                 mock__parse_tag_ids_to_append_and_remove_rval1,
-                mock__prepare_mapping_ids_for_tag_update(raw_path_strs),
+                mock__prepare_mapping_ids_for_tag_update.return_value,
             )
-            mock_remove_tags_from_mappings.assert_called_once_with(
+            mock_mappings_batch.remove_tags_from_mappings.assert_called_once_with(
                 mock__parse_tag_ids_to_append_and_remove_rval2,
-                mock__prepare_mapping_ids_for_tag_update(raw_path_strs),
+                mock__prepare_mapping_ids_for_tag_update.return_value,
             )
         else:
-            mock_append_tags_to_mappings.assert_not_called()
-            mock_remove_tags_from_mappings.assert_not_called()
+            mock_batch.assert_not_called()
 
     @parameterized.expand(
         [
@@ -8,31 +8,41 @@ from django.http import JsonResponse
 from django.shortcuts import redirect, render
 from tinydb.database import Document
 
-from pathtagger import db_operations as db
+from pathtagger import db_backends, db_query
 from pathtagger.mypath import MyPath
 from Tagger import params, settings
 
 logger = logging.getLogger(__name__)
+db = db_backends.get_db_operations()  # pylint: disable=invalid-name
 
 
 def _get_extended_dataset(dataset: List[Document]) -> List[Document]:
     if not dataset:
         logger.debug("Falsy argument for parameter 'dataset': %r", dataset)
-    else:
-        for element in dataset:
-            mypath = MyPath(element["path"], False)
-            logger.debug("MyPath: %r", mypath)
-            element["abs_path_str"] = mypath.abs_path_str
-            element["system_path_str"] = str(mypath.abs_path)
-            element["db_path_str"] = mypath.db_path_str
-            element["path_exists"] = mypath.abs_path.exists()
-            element["path_is_dir"] = mypath.abs_path.is_dir()
-            if element.get("tag_ids", []):
-                element["tags"] = [
-                    db.get_tag(tag_id=int(mapping_tag_id))
-                    for mapping_tag_id in element["tag_ids"]
-                ]
-    return dataset
+        return dataset
+    # the documents are extended in copies, so that they only hold stored fields
+    extended_dataset = []
+    for element in dataset:
+        mypath = MyPath(element["path"], False)
+        logger.debug("MyPath: %r", mypath)
+        extended_element = Document(
+            {
+                **element,
+                "abs_path_str": mypath.abs_path_str,
+                "system_path_str": str(mypath.abs_path),
+                "db_path_str": mypath.db_path_str,
+                "path_exists": mypath.abs_path.exists(),
+                "path_is_dir": mypath.abs_path.is_dir(),
+            },
+            element.doc_id,
+        )
+        if element.get("tag_ids", []):
+            extended_element["tags"] = [
+                db.get_tag(tag_id=mapping_tag_id)
+                for mapping_tag_id in element["tag_ids"]
+            ]
+        extended_dataset.append(extended_element)
+    return extended_dataset
 
 
 def get_drive_root_dirs():
@@ -66,15 +76,16 @@ def mapping_details(request, mapping_id):
         if mypath.is_valid_db_path_str:
             db.update_mapping_path(mapping_id, mypath.db_path_str)
         return redirect("pathtagger:mappings_list")
-    return render(
-        request,
-        "pathtagger/mapping_details.html",
-        {
-            "mapping": _get_extended_dataset(
-                [db.get_mapping(mapping_id=mapping_id)]
-            ).pop()
-        },
-    )
+    with db.snapshot():
+        return render(
+            request,
+            "pathtagger/mapping_details.html",
+            {
+                "mapping": _get_extended_dataset(
+                    [db.get_mapping(mapping_id=mapping_id)]
+                ).pop()
+            },
+        )
 
 
 def add_mapping(request):
@@ -169,8 +180,9 @@ def edit_mappings(request):
                 new_tag_names,
             )
             tag_ids_to_append.update(_get_tag_ids_for_tag_names(new_tag_names))
-            db.append_tags_to_mappings(tag_ids_to_append, mapping_ids)
-            db.remove_tags_from_mappings(tag_ids_to_remove, mapping_ids)
+            with db.batch() as mappings_batch:
+                mappings_batch.append_tags_to_mappings(tag_ids_to_append, mapping_ids)
+                mappings_batch.remove_tags_from_mappings(tag_ids_to_remove, mapping_ids)
         return redirect("pathtagger:mappings_list")
     logger.error(
         "Request should have exactly one of the following parameters: "
@@ -195,11 +207,46 @@ def mappings_list(request):
     tag_ids_to_exclude = [int(tag_id) for tag_id in tag_id_exclude_strs]
     path_name_like = request.GET.get("path_name_like", "")
     logger.debug("Path name like: %r", path_name_like)
+    within_folder = request.GET.get("within_folder", "")
+    logger.debug("Within folder: %r", within_folder)
+    within_db_path_str = None
+    within_folder_error = None
+    if within_folder:
+        if (within_db_path_str := MyPath(within_folder, True).db_path_str) is None:
+            logger.error(
+                "Invalid value for request parameter 'within_folder': %r",
+                within_folder,
+            )
+            within_folder_error = "Not an absolute path within the base path"
+    query_str = request.GET.get("q", "")
+    logger.debug("Query: %r", query_str)
+    query_error = None
+    if query_str:
+        try:
+            db_query.parse_query(query_str)
+        except db_query.QuerySyntaxError as exc:
+            logger.error("Invalid value for request parameter 'q': %s", exc)
+            query_error = str(exc)
     path_type = request.GET.get("path_type", "all")
     logger.debug("Path type: %r", path_type)
-    mappings = _get_extended_dataset(
-        db.get_filtered_mappings(tag_ids_to_include, tag_ids_to_exclude, path_name_like)
-    )
+    # the page is rendered from a single version of the database
+    with db.snapshot():
+        # an invalid folder must not be taken for no folder at all
+        mappings = (
+            []
+            if within_folder_error
+            else _get_extended_dataset(
+                db.get_filtered_mappings(
+                    tag_ids_to_include,
+                    tag_ids_to_exclude,
+                    path_name_like,
+                    within_db_path_str,
+                    None if query_error else query_str,
+                )
+            )
+        )
+        mappings_count = db.get_mappings_count()
+        tags = db.get_all_tags()
     if path_type == "existent":
         mappings = [mapping for mapping in mappings if mapping["path_exists"]]
     elif path_type == "nonexistent":
@@ -209,14 +256,18 @@ def mappings_list(request):
         "pathtagger/mappings_list.html",
         {
             "mappings": mappings,
-            "no_mappings_at_all": not db.get_all_mappings(),
+            "no_mappings_at_all": not mappings_count,
             "filters": {
                 "tag_ids_to_include": tag_ids_to_include,
                 "tag_ids_to_exclude": tag_ids_to_exclude,
                 "path_name_like": path_name_like,
+                "within_folder": within_folder,
+                "within_folder_error": within_folder_error,
+                "q": query_str,
+                "query_error": query_error,
                 "path_type": path_type,
             },
-            "tags": db.get_all_tags(),
+            "tags": tags,
         },
     )
 
@@ -234,14 +285,15 @@ def tag_details(request, tag_id):
         if name and color:
             db.update_tag(tag_id, name, color)
         return redirect("pathtagger:tags_list")
-    return render(
-        request,
-        "pathtagger/tag_details.html",
-        {
-            "tag": db.get_tag(tag_id=tag_id),
-            "mappings": _get_extended_dataset(db.get_tag_mappings(tag_id)),
-        },
-    )
+    with db.snapshot():
+        return render(
+            request,
+            "pathtagger/tag_details.html",
+            {
+                "tag": db.get_tag(tag_id=tag_id),
+                "mappings": _get_extended_dataset(db.get_tag_mappings(tag_id)),
+            },
+        )
 
 
 def add_tag(request):
@@ -271,8 +323,9 @@ def delete_tags(request):
 
 def tags_list(request):
     tags = db.get_all_tags()
+    occurrence_counts = db.get_tag_occurrence_counts()
     for tag in tags:
-        tag["occurrences"] = len(db.get_tag_mappings(tag.doc_id))
+        tag["occurrences"] = occurrence_counts.get(tag.doc_id, 0)
     return render(request, "pathtagger/tags_list.html", {"tags": tags})
 
 
@@ -325,7 +378,7 @@ def mypath_children_data(mypath: MyPath) -> List[Dict[str, str]]:
             "is_dir": mypath_child.abs_path.is_dir(),
             "tags": (
                 [
-                    db.get_tag(tag_id=int(mapping_tag_id))
+                    db.get_tag(tag_id=mapping_tag_id)
                     for mapping_tag_id in mapping["tag_ids"]
                 ]
                 if (mapping := db.get_mapping(db_path_str=mypath_child.db_path_str))
@@ -375,7 +428,9 @@ def path_details(request, abs_path_str):
     )
 
 
-def _prepare_mapping_ids_for_tag_update(raw_path_strs: Set[str]) -> Set[int]:
+def _prepare_mapping_ids_for_tag_update(
+    raw_path_strs: Set[str], mappings_batch, tag_ids: Set[int]
+) -> Set[int]:
     logger.debug("Raw path strings: %r", raw_path_strs)
     mapping_ids = set()
     if raw_path_strs:
@@ -389,8 +444,7 @@ def _prepare_mapping_ids_for_tag_update(raw_path_strs: Set[str]) -> Set[int]:
                 mapping_ids.add(mapping.doc_id)
             else:
                 logger.debug("Mapping (path=%r) does not exist yet", mapping)
-                if mapping_id := db.insert_mapping(mypath.db_path_str, []):
-                    mapping_ids.add(mapping_id)
+                mappings_batch.insert_mapping(mypath.db_path_str, tag_ids)
         logger.debug("Returning %d mapping ids...", len(mapping_ids))
     return mapping_ids
 
@@ -398,7 +452,6 @@ def _prepare_mapping_ids_for_tag_update(raw_path_strs: Set[str]) -> Set[int]:
 def edit_path_tags(request):
     if raw_path_strs := set(request.POST.getlist("path")):
         logger.debug("Raw path strings: %r", raw_path_strs)
-        mapping_ids = _prepare_mapping_ids_for_tag_update(raw_path_strs)
         new_tag_names = request.POST.get("new_tag_names")
         logger.debug("New tag names: %r", new_tag_names)
         tag_ids_to_append, tag_ids_to_remove = _parse_tag_ids_to_append_and_remove(
@@ -409,11 +462,15 @@ def edit_path_tags(request):
             },
             new_tag_names,
         )
-        logger.debug("Mapping ids to update: %r", mapping_ids)
-        logger.debug("Tag ids to append: %r", tag_ids_to_append)
-        logger.debug("Tag ids to remove: %r", tag_ids_to_remove)
-        db.append_tags_to_mappings(tag_ids_to_append, mapping_ids)
-        db.remove_tags_from_mappings(tag_ids_to_remove, mapping_ids)
+        with db.batch() as mappings_batch:
+            mapping_ids = _prepare_mapping_ids_for_tag_update(
+                raw_path_strs, mappings_batch, tag_ids_to_append
+            )
+            logger.debug("Mapping ids to update: %r", mapping_ids)
+            logger.debug("Tag ids to append: %r", tag_ids_to_append)
+            logger.debug("Tag ids to remove: %r", tag_ids_to_remove)
+            mappings_batch.append_tags_to_mappings(tag_ids_to_append, mapping_ids)
+            mappings_batch.remove_tags_from_mappings(tag_ids_to_remove, mapping_ids)
     else:
         logger.error("Invalid value for request parameters 'path': %r", raw_path_strs)
     return redirect(